@@ -22,15 +22,27 @@ import osr
 import gdal
 import re
 import os
+import sys
+import threading
+import tempfile
+import socket
+import httplib
+import cPickle
+import json
 
 #from osr import CoordinateTransformation
 from datetime import datetime
 from abc import ABCMeta, abstractmethod
 from difflib import SequenceMatcher
+from Queue import Queue, Full
+from urllib2 import URLError
+from collections import deque
 
-from lds.LDSUtilities import LDSUtilities as LU, Debugging as DB, DirectDownload, SUFIExtractor, FeatureCounter
-from lds.ProjectionReference import Projection
+from lds.LDSUtilities import LDSUtilities as LU, Debugging as DB, DirectDownload, SUFIExtractor, PageFetcher, KeysetFetcher, PageCache, \
+    GeoJSONStream, FeatureCounter
+from lds.ProjectionReference import Projection, TransformPool
 from lds.ConfigWrapper import ConfigWrapper
+from lds.MetricsUtilities import LayerMetrics
 #from TransferProcessor import CONF_EXT, CONF_INT
 
 ldslog = LU.setupLogging()
@@ -41,7 +53,10 @@ ogr.UseExceptions()
 
 #exceptions
 class DSReaderException(Exception): 
-    def __init__(self,em,ll=ldslog.error): ll('{} - {}'.format(type(self).__name__,em))
+    def __init__(self,em,ll=ldslog.error): 
+        ll('{} - {}'.format(type(self).__name__,em))
+        #the message is matched against GDAL_IGNORE to decide whether to retry
+        super(DSReaderException,self).__init__(em)
 class DSConversionException(Exception): pass
 class LDSReaderException(DSReaderException): pass
 
@@ -53,6 +68,8 @@ class DatasourceConnectException(DSReaderException): pass
 class DatasourceOpenException(DSReaderException): pass
 class LayerCreateException(LDSReaderException): pass
 class FeatureCopyException(LDSReaderException): pass
+class StaleCheckpointException(FeatureCopyException): pass
+class ArrowCopyException(FeatureCopyException): pass
 class InvalidLayerException(LDSReaderException): pass
 class InvalidFeatureException(LDSReaderException): pass
 class InvalidSQLException(LDSReaderException): pass
@@ -91,7 +108,6 @@ class DataStore(object):
     DRIVER_NAMES = {'pg':'PostgreSQL','ms':'MSSQLSpatial','sl':'SQLite','fg':'FileGDB'}
     
     LDS_CONFIG_TABLE = 'lds_config'
-    TEMP_FILE = os.path.join(os.path.dirname(__file__), '../conf/tempfile.xml')
     DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
     EARLIEST_INIT_DATE = '2000-01-01T00:00:00'
     #Number of retry attempts before abandoning replication completely
@@ -100,12 +116,33 @@ class DataStore(object):
     TRANSACTION_THRESHOLD_WFS_ATTEMPTS = 3
     #Number of records to prefetch before writing output
     MAX_PREFETCH = 100000
+    #Memory (MB) held by prefetched features before further features are spilled to disk
+    DEFAULT_PREFETCH_MEMORY = 256
+    #Target time (s) to fetch a page of features
+    DEFAULT_PAGE_LATENCY = 60
+    #Output formats pages can be requested in. GML pages are opened by OGR, JSON pages are parsed as they are read
+    PAGE_FORMATS = ('GML2','GML3','JSON')
     
     DRIVER_NAME = '<init in subclass>'
     
+    #Destination can store 64bit integers, needs GDAL >= 2.0. Otherwise 64bit columns are written as strings
+    INTEGER64_CAPABLE = hasattr(ogr,'OFTInteger64')
+    
+    #Non-incremental copy engines. Arrow needs GDAL >= 3.8 python bindings with pyarrow
+    COPY_ENGINES = ('feature','arrow')
+    ARROW_GDAL_VERSION = 3080000
+    
     DEFAULT_FETCH_METHOD = 'direct'
+    FETCH_METHODS = ('direct','prefetch','staged')
+    #Change type column added to staging tables used by the 'staged' fetch method 
+    STAGE_CHANGE_COL = 'lds_change'
+    STAGE_SUFFIX = '_lds_stage'
+    #Set in subclasses implementing buildStagedApplySQL
+    STAGED_APPLY = False
+    #Number of keys per batched 'delete ... in' statement, set in subclasses according to driver sql limits. 0 disables batching
+    DELETE_CHUNK_SIZE = 0
     
-    CONFIG_COLUMNS = ('id','pkey','name','category','lastmodified','geocolumn','index','epsg','discard','cql')
+    CONFIG_COLUMNS = ('id','pkey','name','category','lastmodified','geocolumn','index','epsg','discard','cql','checkpoint','concurrency','pagesize','fmt')
     #TEMP_DS_TYPES = ('Memory','ESRI Shapefile','Mapinfo File','GeoJSON','GMT','DXF')
     
     ValidGeometryTypes = (ogr.wkbUnknown, ogr.wkbPoint, ogr.wkbLineString,
@@ -125,8 +162,11 @@ class DataStore(object):
     GDAL_CACHEMAX = 2047
     GML_INVERT = 'YES'
     GML_URN = 'YES'
-    GDAL_IGNORE = 'Function sequence error','HTTP error code : 50[234]','HTTP error code : 404',\
-        'General Error','Empty content returned by server','Feature count mismatch','Cannot access any Features'
+    #gateway errors as reported by GDAL and by urllib2, for pages fetched directly
+    GDAL_OVERLOAD = 'HTTP [Ee]rror( code :)? 50[234]'
+    GDAL_IGNORE = 'Function sequence error',GDAL_OVERLOAD,'HTTP error code : 404',\
+        'General Error','Empty content returned by server','Feature count mismatch','Cannot access any Features',\
+        'Page [0-9]+ of \S+ failed'
     
     
     def __init__(self,conn_str=None,user_config=None):
@@ -148,12 +188,25 @@ class DataStore(object):
         self.config = None
         self.src_link = None
         self.sufi_list = None # should be unique per layer
+        self.copy_plan = None # as is the field mapping
+        self.fid_map = None # pkey->FID lookup, also unique per layer
+        self.metrics = LayerMetrics(None) # operation timings, flushed per layer
+        self.delete_queue = []
+        self.delete_keys = set()
+        self.stage_name = None # staging table of the layer being copied
+        self.stage_keys = {} # staged pkey->FID
         self.ds = None
         self.transform = None
         self.sixtyfour = None
         self.conn_str = None
         
         self.prefetchsize = None
+        self.commitinterval = None
+        self.pipeline = None
+        self.paged_source = None
+        self.page_cache = None # PageCache of the layer being copied
+        self.transform_stage = None
+        self.download = None # DirectDownload of an oversize layer
         
         #self.CONFIG_XSL = "getcapabilities."+self.DRIVER_NAME.lower()+".xsl"#we use just 'file' or 'json' now
          
@@ -167,6 +220,7 @@ class DataStore(object):
         
         self.getDriver(self.DRIVER_NAME)
         #NB. confwrap here isnt the same as the main/user distinction in the ConfigWrapper    
+        self.user_config = user_config
         self.confwrap = ConfigWrapper(user_config)
         
         self.params = self.confwrap.readDSParameters(self.DRIVER_NAME)
@@ -191,6 +245,12 @@ class DataStore(object):
             
     def __str__(self):
         return '{name}: URI:{uri}, Layer:{layer}, CQL:{cql} '.format(name=self.name,uri=self.uri,layer=self.layer,cql=self.cql)
+    
+    def clone(self):
+        '''New, unconnected instance of the same DS type and config. Per layer state (src/dst info, change counts etc) is not shared'''
+        clone = type(self)(self.conn_str,self.user_config)
+        clone.name = str(self.name)+'C'
+        return clone
         
     def setDS(self,ds):
         self.ds = ds
@@ -226,11 +286,84 @@ class DataStore(object):
         '''returns prefetch is available but defaults to partitionsize which is set in ReadConfig'''
         return self.prefetchsize if self.prefetchsize else self.MAX_PREFETCH
             
+    def setCommitInterval(self,commitinterval=None):
+        self.commitinterval = int(commitinterval) if LU.assessNone(commitinterval) else None
+        
+    def getCommitInterval(self):
+        '''returns the number of features copied between intermediate commits, None if the layer is committed in a single transaction'''
+        return self.commitinterval
+            
+    def getPipelineDepth(self):
+        '''returns the size of the read-ahead queue for pipelined copies, 0 if features are read and written on the same thread'''
+        pd = self.confwrap.readDSProperty('Misc','pipelinedepth')
+        return int(pd) if LU.assessNone(pd) and str(pd).strip().isdigit() else 0
+            
+    def getPageConcurrency(self,layer):
+        '''returns the number of pages of a layer fetched at once, from the layer's 'concurrency' property or the Misc pageconcurrency 
+        default. 1 leaves paging to the WFS driver'''
+        pc = self.layerconf.readLayerProperty(layer,'concurrency')
+        if not (LU.assessNone(pc) and str(pc).strip().isdigit()):
+            pc = self.confwrap.readDSProperty('Misc','pageconcurrency')
+        return int(pc) if LU.assessNone(pc) and str(pc).strip().isdigit() else 1
+            
+    def getPageFormat(self,layer,default=None):
+        '''returns the output format pages of a layer are requested in, from the layer's 'fmt' property or the default (the LDS fmt
+        setting). None if neither is a page format'''
+        fmt = self.layerconf.readLayerProperty(layer,'fmt')
+        fmt = str(fmt if LU.assessNone(fmt) else default).strip().upper()
+        return fmt if fmt in self.PAGE_FORMATS else None
+            
+    def getPageLatency(self):
+        '''returns the target time (ms) for fetching a page, the page size grows while pages take less and shrinks when they take more'''
+        pl = self.confwrap.readDSProperty('Misc','pagelatency')
+        return 1000*(int(pl) if LU.assessNone(pl) and str(pl).strip().isdigit() else self.DEFAULT_PAGE_LATENCY)
+            
+    def getTimerSample(self):
+        '''returns N where 1 in N feature operations is also traced individually to the timer log, 0 for summaries only'''
+        ts = self.confwrap.readDSProperty('Misc','timersample')
+        return int(ts) if LU.assessNone(ts) and str(ts).strip().isdigit() else 0
+            
+    def getCopyEngine(self):
+        '''returns the non-incremental copy method, the arrow batch copy if configured and supported otherwise feature copy'''
+        ce = self.confwrap.readDSProperty('Misc','copyengine')
+        if not ce or ce.lower()!='arrow' or self.arrow_failed:
+            return self.featureCopy
+        if self.getCommitInterval():
+            ldslog.warn('Arrow copy does not write checkpoints, using feature copy')
+        elif not self.arrowCapable():
+            ldslog.warn('Arrow copy not supported by this GDAL/pyarrow, using feature copy')
+        else:
+            return self.featureCopyArrow
+        return self.featureCopy
+    
+    @classmethod
+    def arrowCapable(cls):
+        '''Tests for GDAL >= 3.8 with the Arrow stream read/write bindings and pyarrow'''
+        if int(gdal.VersionInfo()) < cls.ARROW_GDAL_VERSION:
+            return False
+        if not (hasattr(ogr.Layer,'GetArrowStreamAsPyArrow') and hasattr(ogr.Layer,'WritePyArrow')):
+            return False
+        try:
+            import pyarrow
+        except ImportError:
+            return False
+        return True
+            
+    def getPrefetchMemory(self):
+        '''returns the memory budget in MB for features held by the prefetch method, features beyond this are spilled to disk'''
+        pm = self.confwrap.readDSProperty('Misc','prefetchmemory')
+        return int(pm) if LU.assessNone(pm) and str(pm).strip().isdigit() else self.DEFAULT_PREFETCH_MEMORY
+            
+    def getTransformWorkers(self):
+        '''returns the number of processes used to reproject geometries in blocks, 0 if each geometry is transformed as it is copied'''
+        tw = self.confwrap.readDSProperty('Misc','transformworkers')
+        return int(tw) if LU.assessNone(tw) and str(tw).strip().isdigit() else 0
+            
     def getPrefetchMethod(self):
         if self.DRIVER_NAME==DataStore.DRIVER_NAMES['fg']:
             return 'prefetch'
-        else:
-            return self.DEFAULT_FETCH_METHOD
+        fm = self.confwrap.readDSProperty('Misc','fetchmethod')
+        return fm.lower() if fm and fm.lower() in self.FETCH_METHODS else self.DEFAULT_FETCH_METHOD
 
     def applyConfigOptions(self):
         for opt in self.getConfigOptions():
@@ -409,65 +542,127 @@ class DataStore(object):
         self.sixtyfour = sixtyfour
         #Clear sufi list between consecutive calls to reinit on different layers
         self.sufi_list = None
+        self.copy_plan = None
+        self.fid_map = None
+        self.delete_queue = []
+        self.delete_keys = set()
         self.attempts = 0
+        self.arrow_failed = False
+        self.download = None
+        self.page_cache = None
+        self.stage_name = None
+        self.metrics = LayerMetrics(layername,self.getTimerSample())
 
-        while self.attempts < self.MAXIMUM_WFS_ATTEMPTS:
-            try:
-                ldslog.info('PAGING1 = '+str(gdal.GetConfigOption('OGR_WFS_PAGING_ALLOWED')))
-                #if incr&haspk then fCi
-                if self.getIncremental():
-                    # standard incremental featureCopyIncremental. change_col used in delete list and as change (INS/DEL/UPD) indicator
-                    #gdal.SetConfigOption('OGR_WFS_PAGING_ALLOWED','ON')
-                    self.featureCopyIncremental(self.src_link.getDS(),self.getDS(),layername,self.src_link.CHANGE_COL)
-                else:
-                    #gdal.SetConfigOption('OGR_WFS_PAGING_ALLOWED','OFF') 
-                    self.featureCopy(self.src_link.getDS(),self.getDS(),layername)
+        try:
+            while self.attempts < self.MAXIMUM_WFS_ATTEMPTS:
+                try:
+                    ldslog.info('PAGING1 = '+str(gdal.GetConfigOption('OGR_WFS_PAGING_ALLOWED')))
+                    #if incr&haspk then fCi
+                    try:
+                        if self.getIncremental():
+                            # standard incremental featureCopyIncremental. change_col used in delete list and as change (INS/DEL/UPD) indicator
+                            #gdal.SetConfigOption('OGR_WFS_PAGING_ALLOWED','ON')
+                            self.featureCopyIncremental(self.src_link.getDS(),self.getDS(),layername,self.src_link.CHANGE_COL)
+                        else:
+                            #gdal.SetConfigOption('OGR_WFS_PAGING_ALLOWED','OFF') 
+                            self.getCopyEngine()(self.src_link.getDS(),self.getDS(),layername)
+                    finally:
+                        #the reader thread must be stopped before the source is re-read for a retry
+                        self.closeFeatureReader()
                 
-            except (FeatureCopyException, InaccessibleFeatureException, RuntimeError) as rte:
-                em = gdal.GetLastErrorMsg()
-                en = gdal.GetLastErrorNo()
-                ldslog.warn("GDAL ErrorMsg: "+str(em))
-                ldslog.warn("GDAL ErrorNo: "+str(en))
-                #Errors below seem to all indicate server load problems, so we try again
-                if self.attempts < self.MAXIMUM_WFS_ATTEMPTS-1 and \
-                    re.search('|'.join(self.GDAL_IGNORE),str(rte)):
+                except StaleCheckpointException as sce:
+                    #source has changed since the interrupted copy started so it can't be resumed, start again
                     self.attempts += 1
-                    attcount = str(self.attempts)+"/"+str(self.MAXIMUM_WFS_ATTEMPTS)
-                    ldslog.warn("Failed LDS fetch attempt "+attcount+". "+str(rte))
-                    print '*** Att '+attcount+'  *** '+str(datetime.now().isoformat())
-                    #re-initialise one/all of the datasources
-                    src.read(src.getURI(),False)
-                    #self.read(self.getURI(),False)
+                    if self.attempts >= self.MAXIMUM_WFS_ATTEMPTS:
+                        ldslog.error('Source changed on every attempt, giving up. '+str(sce))
+                        raise
+                    ldslog.warn('Restarting layer copy. '+str(sce))
+                    self.restartLayer(src,layername)
                     
-                    #For 504's also reduce page size
-                    if re.search('HTTP error code : 50[234]',str(rte)):
-                        ps = src.getPartitionSize() if src.getPartitionSize() else src.OGR_WFS_PAGE_SIZE
-                        reduction = int(ps*src.PAGE_REDUCTION_STEP)
-                        ldslog.warn('Reducing Page Size to '+str(reduction))
-                        src.setPartitionSize(reduction)
-                        src.applyConfigOptionSingle('OGR_WFS_PAGE_SIZE='+str(reduction))
-                else: 
-                    #for all other errors, quit
-                    ldslog.error('Traceback {}'.format(rte),exc_info=1)
-                    raise
+                except ArrowCopyException as ace:
+                    #the batches written were rolled back so the layer is copied again feature by feature
+                    self.attempts += 1
+                    self.arrow_failed = True
+                    ldslog.warn('Retrying layer {} with feature copy. {}'.format(layername,ace))
+                    src.read(src.getURI(),False)
                 
-            except OversizeLayerException as ole:
-                #HACK7. Layer is too big to fetch over ogr so we have to pre-download and using urllib read local file
-                ldslog.warn('OGR layer download failure {}. Implementing manual download workaround'.format(ole))
-                DirectDownload(self.src_link.getDS().name,self.TEMP_FILE).download()
-                self.src_link.offline = True
-                self.src_link.getDriver('GML')
-                if not self.src_link.read(self.TEMP_FILE):
-                    raise
-                self.attempts += 1
+                except (FeatureCopyException, InaccessibleFeatureException, RuntimeError) as rte:
+                    em = gdal.GetLastErrorMsg()
+                    en = gdal.GetLastErrorNo()
+                    ldslog.warn("GDAL ErrorMsg: "+str(em))
+                    ldslog.warn("GDAL ErrorNo: "+str(en))
+                    #Errors below seem to all indicate server load problems, so we try again
+                    if self.attempts < self.MAXIMUM_WFS_ATTEMPTS-1 and \
+                        re.search('|'.join(self.GDAL_IGNORE),str(rte)):
+                        self.attempts += 1
+                        attcount = str(self.attempts)+"/"+str(self.MAXIMUM_WFS_ATTEMPTS)
+                        ldslog.warn("Failed LDS fetch attempt "+attcount+". "+str(rte))
+                        print '*** Att '+attcount+'  *** '+str(datetime.now().isoformat())
+                        #For 50x's also reduce page size, before the source is re-read
+                        sizer = src.getPageSizer()
+                        if sizer and re.search(self.GDAL_OVERLOAD,str(rte)):
+                            ldslog.warn('Reducing Page Size to '+str(sizer.failure()))
+                            src.applyPageSize()
+                        #re-initialise one/all of the datasources, resuming from the last committed chunk if there is one
+                        checkpoint = self.getCheckpoint(layername) if self.getCommitInterval() and not self.getIncremental() else None
+                        if checkpoint and not src.setResumePoint(checkpoint):
+                            ldslog.warn('Checkpoint {} has no key to resume from, restarting layer {}'.format(checkpoint,layername))
+                            self.restartLayer(src,layername)
+                        else:
+                            if checkpoint:
+                                ldslog.info('Resuming layer {} from checkpoint {}'.format(layername,checkpoint))
+                                src.setURI(src.requestbuilder.sourceURI(layername))
+                            src.read(src.getURI(),False)
+                        #self.read(self.getURI(),False)
+                    else: 
+                        #for all other errors, quit
+                        ldslog.error('Traceback {}'.format(rte),exc_info=1)
+                        raise
                 
+                except OversizeLayerException as ole:
+                    #HACK7. Layer is too big to fetch over ogr so we have to pre-download and using urllib read local file
+                    ldslog.warn('OGR layer download failure {}. Implementing manual download workaround'.format(ole))
+                    if self.download: self.download.remove()
+                    self.download = DirectDownload(self.src_link.getDS().name,self.src_link.pxy,layername)
+                    self.src_link.offline = True
+                    self.src_link.getDriver('GML')
+                    if not self.src_link.read(self.download.download()):
+                        raise
+                    self.attempts += 1
+                
+                else:
+                    #break if no exceptions
+                    self.estimatePageLatency(src)
+                    break
             else:
-                #break if no exceptions
-                break
+                #out of attempts without a complete copy, the layer mustn't be marked as done
+                raise FeatureCopyException('Layer '+str(layername)+' not copied after '+str(self.attempts)+' attempts')
             
-            finally:
-                if os.path.exists(self.TEMP_FILE): os.remove(self.TEMP_FILE)
+        finally:
+            #one summary per layer regardless of retries
+            self.metrics.flush()
+            #the learned page size is kept whether or not the copy completed, reductions are worth remembering too
+            sizer = src.getPageSizer()
+            if sizer and sizer.size != sizer.initial:
+                self.setPageSize(layername,sizer.size)
+            #a downloaded layer is read for the whole copy so is only removed once the layer is finished
+            if self.download:
+                self.download.remove()
+                self.download = None
+            #pages are kept across attempts so retries don't fetch them again
+            if self.page_cache:
+                self.page_cache.purge()
+                self.page_cache = None
+            #as is the staging table, a failed attempt's table is replaced by the next one
+            self.dropStagingLayer()
           
+    def estimatePageLatency(self,src):
+        '''Pages read by the WFS driver aren't timed individually so their latency is estimated from the mean feature fetch time. 
+        Only used if no pages were timed and at least one full page was read'''
+        sizer = src.getPageSizer()
+        if sizer and not sizer.pages and self.metrics.summary('fetch')[0] >= sizer.size:
+            sizer.success(self.metrics.mean('fetch')*sizer.size)
+        
     def deleteOptionalColumns(self,dst_layer):
         '''Delete unwanted columns from layer'''
         #because column deletion behaviour is different for each driver (advancing index or not) split out and subclass
@@ -494,50 +689,90 @@ class DataStore(object):
         
     #--------------------------------------------------------------------------
         
-    def getFeatureCount(self,layername):
-        '''Alternate feature counter by hacking the uri (using wfs version 1.1.0) and asking for a hits result'''
-        import WFSDataStore
-        from RequestBuilder import RequestBuilder as RB
-        if self.src_link.offline:
-            try:
-                return self.src_link.GetLayer(LU.recode(layername,uflag='compat')).GetFeatureCount()
-            except: 
-                return self.src_feat_count
-        
-        newurl = LU.reVersionURL(self.src_link.getURI(), WFSDataStore.WFSDataStore.VERSION_COUNT)
-        doc = self.processExternal(LU.readLDS, (RB.hitsAppend(newurl),self.src_link.pxy))
-        fc = FeatureCounter.readCount(doc)
-        ldslog.info('Alt FeatureCount '+str(fc))
-        return fc
+    def getFeatureCount(self,src_layer):
+        '''Returns the source feature count where it is known without another request, i.e. the numberMatched of the first page 
+        read or the count of a local file. None if the features have to be counted as they are copied, the copy is then checked 
+        against its checkpoint total if it has one'''
+        if self.paged_source:
+            return self.paged_source.matched
+        try:
+            if src_layer.TestCapability(ogr.OLCFastFeatureCount):
+                fc = src_layer.GetFeatureCount(0)
+            elif self.src_link.offline:
+                fc = src_layer.GetFeatureCount()
+            else:
+                fc = -1
+        except RuntimeError as rte:
+            ldslog.warn('Cannot read feature count, counting features as copied. '+str(rte))
+            fc = -1
+        return fc if fc >= 0 else None
     
     def getFirstFeature(self,src_layer):
-        '''fetch first source feature. useful for reading feeature. features ie dimensions'''
+        '''fetch first source feature, None if the layer is empty. Called before the feature count so the first page has been read'''
         try:
-            src_feat = src_layer.GetNextFeature()
+            return src_layer.GetNextFeature()
         except Exception as e:
             m = LU.errorMessageTranslate(e.message)
             if not re.search('1.Unable',m): raise InaccessibleFeatureException('Error calling layer.GetNextFeature. {}'.format(m))
             raise OversizeLayerException('Error writing during layer.GetNextFeature. {}'.format(m))
-
-        if src_feat:
-            self.src_info.feat_info.setGeometryRef(src_feat)
-            new_feat_def = self.partialCloneFeatureDef(src_feat)          
+        
+    def getFirstIncrementalFeature(self,src_layer):
+        '''fetch first source feature of a changeset, None if there are no changes'''
+        #src_feat = self.processExternal(LU.wrapWorker,(src_layer.GetNextFeature,))
+        try:
+            #print 'GNFi1'
+            return src_layer.GetNextFeature()
+        except Exception as e:
+            raise InaccessibleFeatureException('Unable to GetNextFeature 1i. {}'.format(LU.errorMessageTranslate(e.message)))
+        
+    def readFirstFeature(self,src_layer,read):
+        '''Returns the first source feature, None if the layer is empty, and sets the source and destination SRS. Paged sources read 
+        it from their first page, along with the CRS, so the WFS driver only supplies the layer schema and doesn't fetch the page 
+        as well. Otherwise it is read from the WFS layer using read'''
+        self.paged_source = self.openPagedSource(src_layer)
+        src_feat = self.paged_source.next() if self.paged_source else read(src_layer)
+        self.src_info.spatial_ref = self.paged_source and self.paged_source.srs or src_layer.GetSpatialRef()
+        self.dst_info.spatial_ref = self.transformSRS(self.src_info.spatial_ref)
+        return src_feat
+        
+    def readSourceCount(self,src_layer,src_feat):
+        '''Sets the source feature count following the first feature read. Returns False if there are no features to copy'''
+        self.src_feat_count = self.getFeatureCount(src_layer)
+        if self.src_feat_count is None:
+            ldslog.info('Features available = unknown, counting while copying')
         else:
-            print src_feat
+            ldslog.info('Features available = '+str(self.src_feat_count))
+        if src_feat:
+            return True
+        if self.src_feat_count:
             raise InaccessibleFeatureException('Cannot access first Feature. ({} available)'.format(self.src_feat_count))
+        self.src_feat_count = 0
+        return False
         
-        return src_feat,new_feat_def
+    def validateFeatureCount(self,dst_layer,transaction_flag,checkpoint=None):
+        '''Checks the features copied against the source count. Where the source count wasn't reported the features copied become 
+        the count and a resumed copy is instead checked against its checkpoint total'''
+        copied = sum(self.change_ct.values())
+        if self.src_feat_count is None:
+            self.src_feat_count = copied
+            if checkpoint and checkpoint.total is not None and checkpoint.committed+copied != checkpoint.total:
+                if transaction_flag:
+                    dst_layer.RollbackTransaction()
+                raise StaleCheckpointException('Source count changed. Committed['+str(checkpoint.committed)+'] + Copied['+str(copied)+'] <> Total['+str(checkpoint.total)+']')
+        elif self.src_feat_count != copied:
+            if transaction_flag:
+                dst_layer.RollbackTransaction()
+            raise FeatureCopyException('Feature count mismatch. Source count['+str(self.src_feat_count)+'] <> Change count['+str(copied)+']')
                 
-    @DB.dmesg(prefix='fC')
-    def featureCopy(self,src_ds,dst_ds,layername):
-        '''Feature copy without the change column (and other incremental) overhead. Replacement for driverCopy(cloneDS).''' 
+    def _prepareCopy(self,src_ds,dst_ds,layername):
+        '''Common setup for the non-incremental copy engines. Reads the layer config and source count, fetches the first feature to 
+        build the destination definition and opens or creates the destination layer. Returns None if there are no features to copy'''
         #Since driver update ds.GetFeatureCount will return all layers available in the DS not just those in the original request
         #so now we have to specify which layer it is we wanted access to. 
         
         #for li in range(0,src_ds.GetLayerCount()): Use this when using GML2 and expecting multiple layers per query
 
         is_new = False
-        transaction_flag = True
         src_layer = src_ds.GetLayer(LU.recode(layername,uflag='compat'))
         
         lc_id = LU.standardiseLayername(src_layer.GetName())
@@ -553,35 +788,34 @@ class DataStore(object):
         
         self.src_info.geometry = src_layer.GetGeomType()
         self.dst_info.geometry = self.selectValidGeom(self.src_info.geometry)
-        self.src_info.spatial_ref = src_layer.GetSpatialRef()
-        self.dst_info.spatial_ref = self.transformSRS(self.src_info.spatial_ref)
         self.src_info.parseLayerDefn(src_layer.GetLayerDefn())
         self.dst_info.parseLayerDefn(self.src_info.layer_defn)
         '''parse discard columns'''
         self.optcols |= set(self.dst_info.discard.strip('[]{}()').split(',') if LU.assessNone(self.dst_info.discard) else [])
         
         ldslog.info("Dest layer: "+self.dst_info.layer_id)
-        try:
-            #self.src_feat_count = src_layer.GetFeatureCount()
-            self.src_feat_count = self.getFeatureCount(layername)
-        except Exception:
-            '''Try to get a feat count one more time'''
-            ldslog.warn('Failed getting feature count. Rebuilding SDS')
-            self.src_link.rebuildDS()
-            src_ds = self.src_link.ds
-            src_layer = src_ds.GetLayer(LU.recode(layername,uflag='compat'))
-            self.src_feat_count = self.getFeatureCount(layername)
+        #the count comes from the first page so is read after the first feature
+        src_feat = self.readFirstFeature(src_layer,self.getFirstFeature)
+        has_features = self.readSourceCount(src_layer,src_feat)
+
+            
+        #a copy can only be resumed if the features committed plus those remaining still add up to the original source count.
+        #Without a reported count this is checked once the remaining features have been counted
+        checkpoint = self.getCheckpoint(self.src_info.layer_id) if self.getCommitInterval() and not self.src_link.conn_str else None
+        if checkpoint and checkpoint.total is not None and self.src_feat_count is not None and checkpoint.committed+self.src_feat_count != checkpoint.total:
+            raise StaleCheckpointException('Source count changed. Committed['+str(checkpoint.committed)+'] + Available['+str(self.src_feat_count)+'] <> Total['+str(checkpoint.total)+']')
             
-        ldslog.info('Features available = '+str(self.src_feat_count))
         '''since the characteristics of each feature wont change between layers we only need to define a new feature definition once'''
-        if self.src_feat_count>0:
-            src_feat,new_feat_def = self.getFirstFeature(src_layer)
+        if has_features:
+            self.src_info.feat_info.setGeometryRef(src_feat)
+            new_feat_def = self.partialCloneFeatureDef(src_feat)
         else:
             #if there are no features (likely with small incr)
             ldslog.info('No features available, returning')
+            self.clearCheckpoint(self.src_info.layer_id)
             src_layer.ResetReading()
             #dst_layer.ResetReading()#hasn't been created yet
-            return
+            return None
             #no need to raise exception, there are no feats (kinda unlikely) so just return
 
         #MSSQL doesn't like schema specifiers
@@ -597,6 +831,22 @@ class DataStore(object):
             ldslog.warning("Non-Incremental layer ["+self.dst_info.layer_id+"] request. Creating layer")
             '''create a new layer if a similarly named existing layer can't be found on the dst'''
             dst_layer,is_new = self.buildNewDestinationLayer(dst_ds)
+        elif checkpoint and checkpoint.lastkey is not None:
+            self.discardUncheckpointed(checkpoint)
+            
+        return src_layer,dst_layer,src_feat,new_feat_def,is_new,checkpoint
+
+    @DB.dmesg(prefix='fC')
+    def featureCopy(self,src_ds,dst_ds,layername):
+        '''Feature copy without the change column (and other incremental) overhead. Replacement for driverCopy(cloneDS).''' 
+        prepared = self._prepareCopy(src_ds,dst_ds,layername)
+        if prepared is None:
+            return
+        self._copyFeatures(*prepared)
+        
+    def _copyFeatures(self,src_layer,dst_layer,src_feat,new_feat_def,is_new,checkpoint):
+        '''Copies the prepared layer feature by feature, from the first feature already read'''
+        transaction_flag = True
             
         #Start Transaction
         if  self.attempts < self.TRANSACTION_THRESHOLD_WFS_ATTEMPTS and dst_layer.TestCapability(ogr.OLCTransactions):
@@ -606,27 +856,37 @@ class DataStore(object):
             transaction_flag = False
             ldslog.warn('FC Transactions Disabled '+str(self.attempts))
             
+        sortkey = self.src_link.getPrimaryKey()
+        if sortkey and src_feat.GetFieldIndex(sortkey)<0: sortkey = None
+        #chunked commits need a transaction to commit and a source we can re-request from a given start point. Without a key to sort 
+        #on, startIndex paging isn't guaranteed to return features in the same order so the layer is committed as a whole
+        interval = self.getCommitInterval() if transaction_flag and not self.src_link.conn_str and sortkey else None
+        if self.getCommitInterval() and not sortkey:
+            ldslog.warn('No primary key to resume {} from, chunked commits disabled'.format(self.src_info.layer_id))
+        committed = checkpoint.committed if checkpoint else 0
+        total = checkpoint.total if checkpoint else self.src_feat_count
+            
         self.change_ct['insert'] = 0
+        next_feature = self.openFeatureReader(src_layer,'2',first_feat=src_feat)
         #Loop feats
-        while src_feat:
-            #slowest part of this copy operation is the insert since we have to build a new feature from defn and check fields for discards and sufis
-            self.change_op['insert'](dst_layer,src_feat,new_feat_def)
-            self.change_ct['insert'] += 1
-            #Produces a lot of output and slows things down
-            #ldslog.debug('sref diff {}'.format(SequenceMatcher(None,str(src_layer.GetSpatialRef()),str(dst_layer.GetSpatialRef())).ratio()))
-            try:
-                src_feat = src_layer.GetNextFeature()
-                #print 'GNF3',src_feat.GetFID(),self.change_ct['insert']
-            except RuntimeError as re1:
-                ldslog.warn('GNF Failure 1 {}'.format(re1))
-                src_feat = self._retryGNF(src_layer)
-            except Exception as e:
-                raise InaccessibleFeatureException('Unable to GetNextFeature 2. {}'.format(LU.errorMessageTranslate(e.message)))
-        
-        if self.src_feat_count and self.src_feat_count != sum(self.change_ct.values()):
-            if transaction_flag:
-                dst_layer.RollbackTransaction()
-            raise FeatureCopyException('Feature count mismatch. Source count['+str(self.src_feat_count)+'] <> Change count['+str(sum(self.change_ct.values()))+']')
+        try:
+            while src_feat:
+                #slowest part of this copy operation is the insert since we have to build a new feature from defn and check fields for discards and sufis
+                self.change_op['insert'](dst_layer,src_feat,new_feat_def)
+                self.change_ct['insert'] += 1
+                if interval and self.change_ct['insert'] % interval == 0:
+                    lastkey = src_feat.GetFieldAsString(sortkey) if sortkey else None
+                    self.commitCheckpoint(dst_layer,Checkpoint(committed+self.change_ct['insert'],lastkey,total))
+                #Produces a lot of output and slows things down
+                #ldslog.debug('sref diff {}'.format(SequenceMatcher(None,str(src_layer.GetSpatialRef()),str(dst_layer.GetSpatialRef())).ratio()))
+                src_feat = next_feature()
+        except Exception:
+            #discard the uncommitted chunk, anything before the last checkpoint is kept for the retry
+            if interval:
+                self._rollbackTransaction(dst_layer)
+            raise
+        
+        self.validateFeatureCount(dst_layer,transaction_flag,checkpoint)
         
         
         '''Builds an index on a newly created layer if; 
@@ -635,22 +895,92 @@ class DataStore(object):
         if is_new and (self.dst_info.geocolumn or self.dst_info.pkey) and sum(self.change_ct.values())>0: self.buildIndex()
             
         if transaction_flag:
-            try:
-                ogr.DontUseExceptions()
-                dst_layer.CommitTransaction()
-            except RuntimeError as rte:
-                #HACK
-                if re.search('General Error',str(rte)):
-                    ldslog.warn('CommitTransaction raising OGR General Error. [ '+str(rte)+']')
-                #else:
-                    raise
-            finally:
-                ogr.UseExceptions()
-
+            self.commitTransaction(dst_layer)
+        
+        #layer complete, nothing to resume
+        if self.getCommitInterval(): self.clearCheckpoint(self.src_info.layer_id)
         
         src_layer.ResetReading()
         dst_layer.ResetReading()   
                 
+    @DB.dmesg(prefix='fCA')
+    def featureCopyArrow(self,src_ds,dst_ds,layername):
+        '''Non-incremental copy moving record batches from the source Arrow stream to the destination batch writer. Discards are
+        dropped as ignored source fields, 64bit columns cast to strings where the destination can't store them and geometries 
+        transformed per batch. A failed batch is rolled back so only destinations with transactions are copied in batches'''
+        src_layer = src_ds.GetLayer(LU.recode(layername,uflag='compat'))
+        if not self.arrowCopyable(src_layer):
+            return self.featureCopy(src_ds,dst_ds,layername)
+        
+        prepared = self._prepareCopy(src_ds,dst_ds,layername)
+        if prepared is None:
+            return
+        src_layer,dst_layer,_,_,is_new,_ = prepared
+        #pages are read through GDAL one at a time so have no Arrow stream to read from
+        if self.paged_source:
+            ldslog.info('Layer {} is read in pages, using feature copy'.format(self.src_info.layer_id))
+            return self._copyFeatures(*prepared)
+        if not (self.attempts < self.TRANSACTION_THRESHOLD_WFS_ATTEMPTS and dst_layer.TestCapability(ogr.OLCTransactions)):
+            ldslog.warn('FCA Transactions Disabled '+str(self.attempts)+', using feature copy')
+            return self._copyFeatures(*prepared)
+        dst_layer.StartTransaction()
+        ldslog.debug('FCA Start Transaction '+str(self.attempts))
+        
+        #the first feature was only read to build the destination definition so rewind and stream the whole layer
+        src_fields = [fd.GetName() for fd in self.src_info.feat_info.fdef_list]
+        src_layer.SetIgnoredFields([f for f in src_fields if f in self.optcols and not self.identify64Bit(f)])
+        src_layer.ResetReading()
+        
+        self.change_ct['insert'] = 0
+        try:
+            for batch in src_layer.GetArrowStreamAsPyArrow(['INCLUDE_FID=NO']):
+                dst_layer.WritePyArrow(self.prepareArrowBatch(batch))
+                self.change_ct['insert'] += batch.num_rows
+        except Exception as e:
+            #nothing has been committed so write() can copy the layer again feature by feature
+            self._rollbackTransaction(dst_layer)
+            raise ArrowCopyException('Arrow batch write failed after {} features. {}'.format(self.change_ct['insert'],e))
+        finally:
+            src_layer.SetIgnoredFields([])
+            timerlog.info('ARROWCOPY,{},{}'.format(self.src_info.layer_id,self.change_ct['insert']))
+        
+        self.validateFeatureCount(dst_layer,True)
+        
+        if is_new and (self.dst_info.geocolumn or self.dst_info.pkey) and sum(self.change_ct.values())>0: self.buildIndex()
+        
+        self.commitTransaction(dst_layer)
+        
+        src_layer.ResetReading()
+        dst_layer.ResetReading()
+        
+    def arrowCopyable(self,src_layer):
+        '''Batches are written as read so the destination geometry type must match the source and 64bit columns must already 
+        be read at full precision'''
+        if self.selectValidGeom(src_layer.GetGeomType()) != src_layer.GetGeomType():
+            ldslog.info('Geometry type conversion needed, using feature copy')
+            return False
+        defn = src_layer.GetLayerDefn()
+        for fi in range(0,defn.GetFieldCount()):
+            fd = defn.GetFieldDefn(fi)
+            if CopyPlan.inexact64Bit(fd,self.identify64Bit,self.sixtyfour):
+                ldslog.info('64bit column {} not read as Integer64, using feature copy'.format(fd.GetName()))
+                return False
+        return True
+    
+    def prepareArrowBatch(self,batch):
+        '''Applies the feature copy conversions to a whole batch, 64bit columns to strings where the destination can't store them 
+        and geometries to the destination SRS'''
+        import pyarrow as pa
+        arrays = list(batch.columns)
+        fields = list(batch.schema)
+        for i,field in enumerate(fields):
+            if self.identify64Bit(field.name) and not (self.INTEGER64_CAPABLE and pa.types.is_int64(field.type)):
+                arrays[i] = arrays[i].cast(pa.string())
+                fields[i] = field.with_type(pa.string())
+            elif self.transform and field.metadata and field.metadata.get(b'ARROW:extension:name')==b'ogc.wkb':
+                arrays[i] = pa.array(Projection.transformWKB(self.transform,arrays[i].to_pylist(),iso=True),type=arrays[i].type)
+        return pa.RecordBatch.from_arrays(arrays,schema=pa.schema(fields,batch.schema.metadata))
+    
     @DB.dmesg(prefix='fCI')
     def featureCopyIncremental(self,src_ds,dst_ds,layername,changecol):
         #TDOD. decide whether C_C is better as an arg or a src.prop
@@ -679,6 +1009,9 @@ class DataStore(object):
         '''parse discard columns'''
         self.optcols |= set(self.dst_info.discard.strip('[]{}()').split(',') if LU.assessNone(self.dst_info.discard) else [])
         
+        #read before the destination layer is built as the CRS of paged sources comes with the first feature
+        src_feat = self.readFirstFeature(src_layer,self.getFirstIncrementalFeature)
+        
         try:
             tableonly = LU.recode(self.dst_info.layer_id,uflag='compat')
             if self.dst_info.lastmodified:
@@ -698,8 +1031,6 @@ class DataStore(object):
             
         self.src_info.geometry = src_layer.GetGeomType()
         self.dst_info.geometry = self.selectValidGeom(self.src_info.geometry)
-        self.src_info.spatial_ref = src_layer.GetSpatialRef()
-        self.dst_info.spatial_ref = self.transformSRS(self.src_info.spatial_ref)
         self.src_info.parseLayerDefn(src_layer.GetLayerDefn())
         self.dst_info.parseLayerDefn(self.src_info.layer_defn)
         
@@ -714,33 +1045,8 @@ class DataStore(object):
                 raise LayerCreateException('Unable to initialise a new Layer on destination')
         
         #add/copy features
-        try:
-            #self.src_feat_count = src_layer.GetFeatureCount()
-            self.src_feat_count = self.getFeatureCount(layername)
-        except Exception:         
-            '''Try to get a feat count one more time'''
-            ldslog.warn('Failed getting feature count. Rebuilding SDS')
-            self.src_link.rebuildDS()
-            src_ds = self.src_link.ds
-            src_layer = src_ds.GetLayer(LU.recode(layername,uflag='compat'))
-            self.src_feat_count = self.getFeatureCount(layername)
-            
-        ldslog.info('Features available = '+str(self.src_feat_count))
-        
-        if self.src_feat_count>0:
-            #src_feat = self.processExternal(LU.wrapWorker,(src_layer.GetNextFeature,))
-            try:
-                #print 'GNFi1'
-                src_feat = src_layer.GetNextFeature()
-            except Exception as e:
-                raise InaccessibleFeatureException('Unable to GetNextFeature 1i. {}'.format(LU.errorMessageTranslate(e.message)))
-            
-            if src_feat:
-                new_feat_def = self.partialCloneFeatureDef(src_feat)
-            else:
-                em = 'Cannot access first Feature. ('+str(self.src_feat_count)+' available)'
-                ldslog.warn(em)
-                raise InaccessibleFeatureException(em)
+        if self.readSourceCount(src_layer,src_feat):
+            new_feat_def = self.partialCloneFeatureDef(src_feat)
         else:
             #if there are no features (likely with small incr)
             ldslog.info('No features available, returning')
@@ -758,10 +1064,26 @@ class DataStore(object):
         else:
             transaction_flag = False
             ldslog.warn('FCI Transactions Disabled '+str(self.attempts))
+            
+        #prefetch vs direct vs staged
+        fetch_method = self.getPrefetchMethod()
+        if fetch_method=='staged' and not (LU.assessNone(self.dst_info.pkey) and self.STAGED_APPLY):
+            ldslog.warn('Staged apply needs a primary key and driver support, using direct')
+            fetch_method = 'direct'
+            
+        '''index destination FIDs by pkey so updates/deletes dont need a per-feature search. A new layer is empty so starts with an empty index'''
+        if fetch_method!='staged' and isinstance(self.dst_info.pkey,basestring) and LU.assessNone(self.dst_info.pkey):
+            self.fid_map = {} if is_new else self.buildFIDMap(dst_layer,self.dst_info.pkey)
+        else:
+            self.fid_map = None
+        
+        self.delete_queue = []
+        self.delete_keys = set()
         
 
-        #prefetch vs direct  
-        if self.getPrefetchMethod()=='direct':
+        next_feature = self.openFeatureReader(src_layer,{'direct':'2i','prefetch':'3i','staged':'4i'}.get(fetch_method),retry=fetch_method!='direct',first_feat=src_feat)
+
+        if fetch_method=='direct':
             ldslog.info('Direct')
 
             e = 0
@@ -770,13 +1092,22 @@ class DataStore(object):
 
             while src_feat:
                 feat_count += 1
-                #(src_feat.GetField(changecol) if LU.assessNone(changecol) else "insert").lower()
-                change =  (src_feat.GetField(changecol) if LU.assessNone(changecol) else 'insert').lower()
+                try:
+                    change = self.getChange(src_feat,changecol)
+                except InvalidFeatureException as ife:
+                    ldslog.error("Invalid Feature Exception reading change. "+str(ife))
+                    src_feat = next_feature()
+                    continue
+                #a queued delete must be applied before any later change to the same key
+                if change != 'delete' and self.delete_keys and src_feat.GetFieldAsString(self.dst_info.pkey) in self.delete_keys:
+                    self.flushDeletes()
                 
                 try:
-                    e = self.change_op[change](dst_layer, src_feat, new_feat_def)
+                    op = self.getChangeOp(change)
+                    e = op(dst_layer, src_feat, new_feat_def)
                     # raise KeyError("Error with Key "+str(change)+" !E {ins,del,upd}",exc_info=1)
-                    self.change_ct[change] += 1
+                    #queued deletes are counted when they're flushed
+                    if op != self.queueDelete: self.change_ct[change] += 1
                 except InvalidFeatureException as ife:
                     ldslog.error("Invalid Feature Exception during "+change+" operation on dest. "+str(ife),exc_info=1)
                 #except Exception as e:
@@ -792,63 +1123,58 @@ class DataStore(object):
                             raise InvalidFeatureException("Driver Error [d="+str(e1)+",i="+str(e2)+"] on "+change)
                 #testing
                 #ldslog.info(feat_count) 
-                try:
-                    #print 'GNFi2'
-                    src_feat = src_layer.GetNextFeature()
-                except Exception as e:
-                    raise InaccessibleFeatureException('Unable to GetNextFeature 2i. {}'.format(LU.errorMessageTranslate(e.message))) 
+                src_feat = next_feature()
                  
-            ##if self.src_feat_count != self.dst_change_ct:
-            if self.src_feat_count != sum(self.change_ct.values()):
-                if transaction_flag:
-                    dst_layer.RollbackTransaction()
-                #raise FeatureCopyException('Feature count mismatch. Source count['+str(self.src_feat_count)+'] <> Change count['+str(self.dst_change_ct)+']')
-                raise FeatureCopyException('Feature count mismatch. Source count['+str(self.src_feat_count)+'] <> Change count['+str(sum(self.change_ct.values()))+']')
+            self.flushDeletes()
+            
+            self.validateFeatureCount(dst_layer,transaction_flag)
 
         #prefetch results (mandatory for fgdb)
         
-        elif self.getPrefetchMethod()=='prefetch':
+        elif fetch_method=='prefetch':
             ldslog.info('Pre-Fetch')
 
-            e = 0
-            #key order here is important
-            src_array = {'delete':(),'update':(),'insert':()}    
+            #changes are applied in delete,update,insert order once the whole changeset has been read
+            src_array = PrefetchBuffer(self.getPrefetchMemory()*1024*1024)
             self.change_ct = {'delete':0,'update':0,'insert':0}
             
-            ldslog.info('Begin Pre-Fetch with {} Features'.format(self.getPrefetchSize()))
-            feat_count = 0
-            proc_count = 0
+            ldslog.info('Begin Pre-Fetch with {}MB buffer'.format(self.getPrefetchMemory()))
 
+            try:
+                while src_feat:
+                    try:
+                        src_array.add(self.getChange(src_feat,changecol),src_feat)
+                    except InvalidFeatureException as ife:
+                        ldslog.error("Invalid Feature Exception reading change. "+str(ife))
+                    src_feat = next_feature()
+                
+                ldslog.info('Loading {} Features, {} spilled to disk'.format(len(src_array),src_array.spilled))
+                self.processFetchedIncrement(src_array,dst_layer,new_feat_def)
+            finally:
+                src_array.close()
+             
+            self.validateFeatureCount(dst_layer,transaction_flag)
+            
+        #bulk load changes to a staging table and apply them with set based sql
+        
+        elif fetch_method=='staged':
+            ldslog.info('Staged')
+            
+            self.change_ct = {'delete':0,'update':0,'insert':0}
+            stage_layer,stage_def = self.buildStagingLayer(dst_ds,new_feat_def)
+            
             while src_feat:
-                feat_count += 1
-                change =  (src_feat.GetField(changecol) if LU.assessNone(changecol) else "insert").lower()
-  
-                src_array[change] += (src_feat,)
-                if feat_count>=self.getPrefetchSize():
-                    ldslog.info('Loading Features {}-{}'.format(self.getPrefetchSize()*proc_count,self.getPrefetchSize()*(proc_count+1)))
-                    self.processFetchedIncrement(src_array,dst_layer,new_feat_def)
-                    feat_count = 0
-                    proc_count += 1
-                    src_array = {'delete':(),'update':(),'insert':()}
-                #testing
-                #ldslog.info(feat_count) 
-                #print 'GNFi3'
                 try:
-                    src_feat = src_layer.GetNextFeature()            
-                except RuntimeError as re1:
-                    ldslog.warn('GNFi Failure 1 {}'.format(re1))
-                    src_feat = self._retryGNF(src_layer)
-                except Exception as e:
-                    raise InaccessibleFeatureException('Unable to GetNextFeature 3i. {}'.format(LU.errorMessageTranslate(e.message))) 
+                    change = self.getChange(src_feat,changecol)
+                    self.stageChange(stage_layer,self.partialCloneFeature(src_feat,stage_def),change)
+                    self.change_ct[change] += 1
+                except InvalidFeatureException as ife:
+                    ldslog.error("Invalid Feature Exception during staging. "+str(ife))
+                src_feat = next_feature()
                 
-                 
-            ldslog.info('Loading remaining Features {}-{}'.format(self.getPrefetchSize()*proc_count,self.src_feat_count))
-            self.processFetchedIncrement(src_array,dst_layer,new_feat_def)
-             
-            if self.src_feat_count != sum(self.change_ct.values()):
-                if transaction_flag:
-                    dst_layer.RollbackTransaction()
-                raise FeatureCopyException('Feature count mismatch. Source count['+str(self.src_feat_count)+'] <> Change count['+str(sum(self.change_ct.values()))+']')
+            self.validateFeatureCount(dst_layer,transaction_flag)
+
+            self.applyStagedIncrement(dst_layer,stage_layer)
 
         else:
             ldslog.error('Unknown Fetch Method') 
@@ -862,26 +1188,138 @@ class DataStore(object):
         if is_new and (self.dst_info.geocolumn or self.dst_info.pkey) and sum(self.change_ct.values())>0: self.buildIndex()
             
         if transaction_flag:
-            try:
-                ogr.DontUseExceptions()
-                dst_layer.CommitTransaction()
-            except RuntimeError as rte:
-                #HACK
-                if re.search('General Error',str(rte)):
-                    ldslog.warn('CommitTransaction raising OGR General Error. [ '+str(rte)+'] Ignoring!')
-                #else:
-                    raise
-            finally:
-                ogr.UseExceptions()
+            self.commitTransaction(dst_layer)
             
         ldslog.info('Inserts={0}, Deletes={1}, Updates={2}'.format(self.change_ct['insert'],self.change_ct['delete'],self.change_ct['update']))
         
+        if fetch_method=='staged':
+            self.dropStagingLayer()
+        self.fid_map = None
         src_layer.ResetReading()
         dst_layer.ResetReading()
             
         #returning nothing disables manual paging    
         #return max_index    
               
+    def nextFeature(self,src_layer,ref,retry=True):
+        '''GetNextFeature for the copy loops, ref identifies the calling loop in error messages'''
+        st = LayerMetrics.start()
+        try:
+            feat = src_layer.GetNextFeature()
+            self.metrics.record('fetch',st)
+            return feat
+        except RuntimeError as re1:
+            if not retry: 
+                raise InaccessibleFeatureException('Unable to GetNextFeature {}. {}'.format(ref,LU.errorMessageTranslate(re1.message)))
+            ldslog.warn('GNF{} Failure 1 {}'.format(ref,re1))
+            return self._retryGNF(src_layer)
+        except Exception as e:
+            raise InaccessibleFeatureException('Unable to GetNextFeature {}. {}'.format(ref,LU.errorMessageTranslate(e.message)))
+        
+    def openFeatureReader(self,src_layer,ref,retry=True,first_feat=None):
+        '''Returns the next-feature function for a copy loop. If a pipeline depth is set features are read ahead on a separate 
+        thread so the WFS fetch/parse overlaps the destination writes. If transform workers are set geometries are reprojected 
+        in blocks across a process pool before they reach the copy loop'''
+        fetch = lambda: self.nextFeature(src_layer,ref,retry)
+        #the pool is normally started by the TransferProcessor before any threads, this only starts it for a single threaded caller
+        workers = self.getTransformWorkers() if self.transform and RUN_ENV != 'QGIS' else 0
+        if workers and (self.src_feat_count is None or self.src_feat_count > TransformPool.BLOCK_SIZE) and TransformPool.start(workers):
+            self.transform_stage = TransformStage(TransformPool(self.src_info.spatial_ref,self.dst_info.spatial_ref),self.metrics)
+            #the first feature has already been read so is transformed on its own
+            if first_feat: self.transform_stage.pool.transformFeatures([first_feat])
+        if self.paged_source:
+            fetch = self.paged_source.next
+        depth = self.getPipelineDepth()
+        if depth:
+            self.pipeline = FeaturePipeline(fetch,depth,self.src_info.layer_id)
+            self.pipeline.start()
+            fetch = self.pipeline.next
+        if self.transform_stage:
+            fetch = self.transform_stage.setSource(fetch)
+        return fetch
+    
+    def openPagedSource(self,src_layer):
+        '''Returns a PagedSource reading the layer from pages following on by primary key (partition layers) or fetched concurrently, 
+        if the source is an LDS request. Otherwise None and features are read from the WFS layer. The number of features, and so 
+        of pages, is set once known from the first page'''
+        if self.src_link.offline or self.src_link.conn_str or not hasattr(self.src_link,'requestbuilder'):
+            return None
+        keyset = self.src_link.getKeyset()
+        concurrency = self.getPageConcurrency(self.src_info.layer_id)
+        fmt = self.getPageFormat(self.src_info.layer_id,self.src_link.fmt)
+        defn = src_layer.GetLayerDefn()
+        fdefs = [defn.GetFieldDefn(i) for i in range(defn.GetFieldCount())]
+        inexact = [f.GetName() for f in fdefs if CopyPlan.inexact64Bit(f,self.identify64Bit,self.sixtyfour)]
+        #JSON, and 64bit columns GDAL can't read exactly, can only be read from pages so are fetched in pages even one at a time
+        if not keyset and concurrency < 2 and fmt != 'JSON' and not inexact:
+            return None
+        rb = self.src_link.requestbuilder
+        fmt = fmt or rb.DEFAULT_OUTPUT_GML_FORMAT
+        uri = rb.formatURI(self.src_link.getURI(),fmt)
+        size = self.src_link.getPartitionSize() or self.src_link.OGR_WFS_PAGE_SIZE
+        xsd,suffix = None,'.json'
+        if fmt != 'JSON':
+            xsd,suffix = DirectDownload(rb.describeFeatureTypeURI(uri),self.src_link.pxy,self.src_info.layer_id+'_schema','.xsd'),'.gml'
+            xsd.download()
+        #a retry re-reads the same request, a resumed copy has a new one and the pages cached for the old request are dropped
+        if self.page_cache is None or self.page_cache.request != uri:
+            if self.page_cache: self.page_cache.purge()
+            self.page_cache = PageCache(uri,self.src_info.layer_id)
+        elif self.page_cache.pages:
+            ldslog.info('Replaying up to {} cached pages of {}'.format(len(self.page_cache.pages),self.src_info.layer_id))
+        #the 64bit columns are read as strings, from GeoJSON directly and from GML parsed out of each page as it's read
+        sufi = None
+        if inexact:
+            ldslog.info('Reading 64bit columns {} from the pages of {}'.format(inexact,self.src_info.layer_id))
+            defn = PagedSource.stringDefn(defn,inexact)
+            if xsd: sufi = (CopyPlan.keyName(self.dst_info.pkey),inexact)
+        
+        if keyset:
+            size = self.src_link.getKeysetSize()
+            pkey = self.src_link.getPrimaryKey()
+            ldslog.info('Fetching {} in {} pages of {} by {}'.format(self.src_info.layer_id,fmt,size,pkey))
+            fetcher = KeysetFetcher(lambda lastkey,count: rb.keysetURI(uri,lastkey,count),self.src_link.pxy,size,self.src_info.layer_id,
+                                    self.src_link.getPageSizer(),suffix,self.page_cache)
+            return PagedSource(fetcher,defn,xsd,self.metrics,pkey,sufi=sufi)
+        
+        ldslog.info('Fetching {} in {} pages of {}, {} at a time'.format(self.src_info.layer_id,fmt,size,concurrency))
+        #page offsets are fixed once cut so the page size is only adjusted for the next run. The pages after the first are cut 
+        #once it has been read and the source total is known, open ended if it isn't and reading stops at the first empty page
+        pages = ((s,n,rb.pageURI(uri,s,n)) for s,n in self.cutPages(0,lambda: source.total,size,self.page_cache))
+        fetcher = PageFetcher(pages,self.src_link.pxy,concurrency,size,self.src_info.layer_id,self.src_link.getPageSizer(),suffix,
+                              self.page_cache)
+        source = PagedSource(fetcher,defn,xsd,self.metrics,sufi=sufi)
+        return source
+    
+    @staticmethod
+    def cutPages(start,end,size,cache):
+        '''(offset,count) of the pages from start up to the offset returned by end, or without end while it returns None. The first 
+        page is always cut, end is only asked for the pages after it. Pages cached by an earlier attempt keep the count they were 
+        fetched with so they still line up if the page size has changed since'''
+        while True:
+            cached = cache.get(start)
+            count = cached[1] if cached else size
+            yield start,count
+            start += count
+            if end() is not None and start >= end():
+                return
+    
+    def closeFeatureReader(self):
+        '''Stops any read-ahead thread and reports its queue metrics, then shuts down any page fetcher, transform pool and 64bit 
+        column reader'''
+        if self.pipeline:
+            self.pipeline.stop()
+            self.pipeline = None
+        if self.paged_source:
+            self.paged_source.close()
+            self.paged_source = None
+        if self.transform_stage:
+            self.transform_stage.close()
+            self.transform_stage = None
+        if self.sufi_list:
+            self.sufi_list.close()
+            self.sufi_list = None
+    
     def _retryGNF(self,src_layer):
         '''Get trying to get features if the error surfaceMember'''
         fault = 1
@@ -899,11 +1337,13 @@ class DataStore(object):
     
     def processFetchedIncrement(self, src_array, dst_layer, new_feat_def):
         '''Process current feature pool'''          
-        for change in src_array.keys():
+        e = 0
+        for change in ('delete','update','insert'):
             for src_feat in src_array[change]:
                 try:
-                    e = self.change_op[change](dst_layer, src_feat, new_feat_def, self.dst_info.pkey) 
-                    self.change_ct[change] += 1
+                    op = self.getChangeOp(change)
+                    e = op(dst_layer, src_feat, new_feat_def)
+                    if op != self.queueDelete: self.change_ct[change] += 1
 
                 except InvalidFeatureException as ife:
                     ldslog.error("Invalid Feature Exception during " + change + " operation on dest. " + str(ife), exc_info=1)
@@ -919,7 +1359,89 @@ class DataStore(object):
                         e2 = self.change_op['insert'](dst_layer, src_feat, new_feat_def)
                         if e1 + e2 != 0:
                             raise InvalidFeatureException("Driver Error [d=" + str(e1) + ",i=" + str(e2) + "] on " + change)
-        
+            if change == 'delete':
+                self.flushDeletes()
+        
+        
+    def buildStagingLayer(self,dst_ds,new_feat_def):
+        '''Creates a staging table alongside the destination layer with the destination columns plus a change type column'''
+        stage_name = self.dst_info.ascii_name+self.STAGE_SUFFIX
+        stage_def = ogr.FeatureDefn()
+        for fi in range(0,new_feat_def.GetFieldCount()):
+            stage_def.AddFieldDefn(new_feat_def.GetFieldDefn(fi))
+        stage_def.AddFieldDefn(ogr.FieldDefn(self.STAGE_CHANGE_COL,ogr.OFTString))
+        
+        #a table left by a failed attempt is replaced whatever the configured overwrite setting
+        options = [o for o in self.getLayerOptions(self.src_info.layer_id) if not o.startswith('OVERWRITE=')]+['OVERWRITE=YES']
+        stage_layer = dst_ds.CreateLayer(stage_name,self.dst_info.spatial_ref,self.dst_info.geometry,options)
+        if stage_layer is None:
+            raise LayerCreateException('Unable to create staging layer '+stage_name)
+        self.stage_name = stage_layer.GetName()
+        self.stage_keys = {}
+        for fi in range(0,stage_def.GetFieldCount()):
+            stage_layer.CreateField(stage_def.GetFieldDefn(fi))
+        ldslog.info('Staging changes in '+stage_name)
+        return stage_layer,stage_def
+    
+    def stageChange(self,stage_layer,stage_feat,change):
+        '''Adds a change to the staging layer keeping one row per key. A repeated key replaces the earlier row, as a delete if 
+        that's the last change otherwise as an update, which the staged statements apply whether or not the key exists'''
+        key = stage_feat.GetFieldAsString(self.dst_info.pkey)
+        fid = self.stage_keys.get(key)
+        if fid is not None:
+            stage_layer.DeleteFeature(fid)
+            if change != 'delete': change = 'update'
+        stage_feat.SetField(self.STAGE_CHANGE_COL,change)
+        stage_layer.CreateFeature(stage_feat)
+        self.stage_keys[key] = stage_feat.GetFID()
+    
+    def dropStagingLayer(self):
+        '''Drops the staging table of the current layer, if one was created'''
+        if not self.stage_name:
+            return
+        try:
+            self._deleteLayerByName(self.getDS(),self.stage_name)
+        except RuntimeError as rte:
+            ldslog.warn('Unable to drop staging table {}. {}'.format(self.stage_name,rte))
+        finally:
+            self.stage_name = None
+            self.stage_keys = {}
+    
+    def applyStagedIncrement(self,dst_layer,stage_layer):
+        '''Applies staged changes to the destination layer using the driver specific set based statements'''
+        st = datetime.now()
+        #as named by the driver, which may add a schema
+        stage_name = self.stage_name
+        dst_defn = dst_layer.GetLayerDefn()
+        stage_defn = stage_layer.GetLayerDefn()
+        dst_cols = [dst_defn.GetFieldDefn(fi).GetName() for fi in range(0,dst_defn.GetFieldCount())]
+        columns = ()
+        for fi in range(0,stage_defn.GetFieldCount()):
+            name = stage_defn.GetFieldDefn(fi).GetName()
+            if name in dst_cols and name != self.STAGE_CHANGE_COL:
+                columns += ((name,name),)
+        if dst_layer.GetGeometryColumn() and stage_layer.GetGeometryColumn():
+            columns += ((dst_layer.GetGeometryColumn(),stage_layer.GetGeometryColumn()),)
+        
+        #without an index on the staged keys each statement becomes a nested scan 
+        self.executeSQL('create index {0}_pk on {1}({2})'.format(stage_name.split('.')[-1],stage_name,self.dst_info.pkey))
+        for sql in self.buildStagedApplySQL(self.dst_info.ascii_name,stage_name,self.dst_info.pkey,columns):
+            self.executeSQL(sql)
+        ldslog.info('Applied staged changes to {} in {}s'.format(self.dst_info.ascii_name,(datetime.now()-st).total_seconds()))
+            
+    def buildStagedApplySQL(self,table,stage,pkey,columns):
+        '''Returns the set based statements applying a staging table to its destination table, to be overridden in subclasses. 
+        Columns are (destination,stage) name pairs'''
+        raise NotImplementedError('Staged changes not implemented for '+self.DRIVER_NAME)
+    
+    def _deleteLayerByName(self,ds,name):
+        '''Deletes a layer from the DS using the name returned by layer.GetName()'''
+        for li in range(0,ds.GetLayerCount()):
+            if ds.GetLayer(li).GetName() == name:
+                ds.DeleteLayer(li)
+                return True
+        ldslog.warn('Layer {} not found'.format(name))
+        return False
         
     def transformSRS(self,src_layer_sref):
         '''Defines the transform from one SRS to another. Doesn't actually do the transformation, just defines the transformation needed.
@@ -928,9 +1450,9 @@ class DataStore(object):
         selected_sref = self.getSRS()
         if LU.assessNone(selected_sref):
             #if the selected SRS fails to validate assume error and flag but dont silently drop back to default
-            validated_sref = Projection.validateEPSG(selected_sref)
+            #SRS and transformation are cached since most layers in a run share the same source and target 
+            validated_sref,self.transform = Projection.getTransformation(src_layer_sref,selected_sref)
             if validated_sref:
-                self.transform = osr.CoordinateTransformation(src_layer_sref, validated_sref)
                 if self.transform == None:
                     ldslog.warn('Can\'t init coordinatetransformation object with SRS:'+str(validated_sref))
                 return validated_sref
@@ -941,7 +1463,7 @@ class DataStore(object):
                       
     def insertFeature(self,dst_layer,src_feat,new_feat_def):
         '''insert a new feature'''
-        st = datetime.now()
+        st = LayerMetrics.start()
         new_feat = self.partialCloneFeature(src_feat,new_feat_def)
         #print 'GR','\n'.join(str(new_feat.GetGeometryRef()).split(','))
         #print 'VR',len(str(new_feat.GetGeometryRef()).split(','))
@@ -949,27 +1471,21 @@ class DataStore(object):
         e = dst_layer.CreateFeature(new_feat)
         #dst_fid = new_feat.GetFID()
         #ldslog.debug("INSERT: "+str(dst_fid))
-        timerlog.info('INSERT,{}'.format(1000*(datetime.now()-st).total_seconds()))
+        if self.fid_map is not None and e == 0 and new_feat.GetFID() >= 0:
+            self.fid_map[src_feat.GetFieldAsString(self.dst_info.pkey)] = new_feat.GetFID()
+        self.metrics.record('insert',st)
         
         return e
     
     def updateFeature(self,dst_layer,src_feat,new_feat_def):
         '''build new feature, assign it the looked-up matching fid and overwrite on dst'''
-        st = datetime.now()
-        ref_pkey = self.dst_info.pkey
-        if not ref_pkey:
-            if not self.feat_field_names:
-                self.feat_field_names = self.getFieldNames(src_feat)
-            ref_pkey = self.feat_field_names
-            src_pkey = self.getFieldValues(src_feat)
-        else:
-            src_pkey = src_feat.GetFieldAsInteger(ref_pkey)
+        st = LayerMetrics.start()
+        src_pkey,dst_fid = self._lookupFID(dst_layer,src_feat)
             
         #ldslog.debug("UPDATE: "+str(src_pkey))
         #if not new_layer_flag: 
-        new_feat = self.partialCloneFeature(src_feat,new_feat_def,ref_pkey)
-        dst_fid = self._findMatchingFID(dst_layer, ref_pkey, src_pkey)
-        if dst_fid:
+        new_feat = self.partialCloneFeature(src_feat,new_feat_def)
+        if dst_fid is not None:
             new_feat.SetFID(dst_fid)
             e = dst_layer.SetFeature(new_feat)
             
@@ -977,34 +1493,131 @@ class DataStore(object):
             ldslog.error("No match for FID with ID="+str(src_pkey)+" on update",exc_info=1)
             raise InvalidFeatureException("No match for FID with ID="+str(src_pkey)+" on update")
         
-        timerlog.info('UPDATE,{}'.format(src_pkey,1000*(datetime.now()-st).total_seconds()))
+        self.metrics.record('update',st,src_pkey)
         
         return e
     
     def deleteFeature(self,dst_layer,src_feat,_): 
         '''lookup and delete using fid matching ID of feature being deleted'''
-        #naive first implementation, might/will be slow 
-        st = datetime.now()
-        ref_pkey = self.dst_info.pkey
-        if not ref_pkey:
-            if not self.feat_field_names:
-                self.feat_field_names = self.getFieldNames(src_feat)
-            ref_pkey = self.feat_field_names
-            src_pkey = self.getFieldValues(src_feat)
-        else:
-            src_pkey = src_feat.GetFieldAsInteger(ref_pkey)
+        st = LayerMetrics.start()
+        src_pkey,dst_fid = self._lookupFID(dst_layer,src_feat)
             
         #ldslog.debug("DELETE: "+str(src_pkey))
-        dst_fid = self._findMatchingFID(dst_layer, ref_pkey, src_pkey)
-        if dst_fid:
+        if dst_fid is not None:
             e = dst_layer.DeleteFeature(dst_fid)
+            if self.fid_map is not None and e == 0:
+                self.fid_map.pop(src_feat.GetFieldAsString(self.dst_info.pkey),None)
         else:
             ldslog.error("No match for FID with ID="+str(src_pkey)+" on delete",exc_info=1)
             raise InvalidFeatureException("No match for FID with ID="+str(src_pkey)+" on delete")
         
-        timerlog.info('DELETE,{},{}'.format(src_pkey,1000*(datetime.now()-st).total_seconds()))
+        self.metrics.record('delete',st,src_pkey)
         
         return e
+    
+    def getChange(self,src_feat,changecol):
+        '''Returns the change type of a source feature, insert if there's no change column'''
+        if not LU.assessNone(changecol):
+            return 'insert'
+        change = (src_feat.GetField(changecol) or '').lower()
+        if change not in self.change_op:
+            raise InvalidFeatureException('Unknown change type "{}" on feature {}'.format(change,src_feat.GetFID()))
+        return change
+    
+    def getChangeOp(self,change):
+        '''Returns the function applying a change type, queueing deletes for batching where the driver allows it'''
+        if change == 'delete' and self.DELETE_CHUNK_SIZE and isinstance(self.dst_info.pkey,basestring) and LU.assessNone(self.dst_info.pkey):
+            return self.queueDelete
+        return self.change_op[change]
+    
+    def queueDelete(self,dst_layer,src_feat,_):
+        '''Queues a feature for deletion by key, deleting the queue as a single statement once it reaches the chunk size'''
+        src_pkey = src_feat.GetFieldAsString(self.dst_info.pkey)
+        if src_pkey not in self.delete_keys:
+            self.delete_queue.append(src_pkey)
+            self.delete_keys.add(src_pkey)
+        if len(self.delete_queue) >= self.DELETE_CHUNK_SIZE:
+            self.flushDeletes()
+        return 0
+    
+    def flushDeletes(self):
+        '''Deletes all queued keys with a 'delete from ... where pkey in (...)' statement. Keys missing from the layer are logged 
+        as for a single delete and only the keys found are counted as deleted'''
+        if not self.delete_queue:
+            return
+        st = datetime.now()
+        table,pkey = self.dst_info.ascii_name,self.dst_info.pkey
+        if self.fid_map is not None:
+            found = set(key for key in self.delete_queue if key in self.fid_map)
+        else:
+            found = self._selectKeys(table,pkey,self.delete_queue)
+        for key in self.delete_queue:
+            if key not in found:
+                ldslog.error("No match for FID with ID="+str(key)+" on delete")
+        if found:
+            self._baseDeleteFeature(table,self.formatInClause(pkey,[k for k in self.delete_queue if k in found]))
+            if self.fid_map is not None:
+                for key in found:
+                    self.fid_map.pop(key,None)
+        self.change_ct['delete'] += len(found)
+        timerlog.info('DELETEBATCH,{},{}'.format(len(found),1000*(datetime.now()-st).total_seconds()))
+        self.delete_queue = []
+        self.delete_keys = set()
+        
+    def _selectKeys(self,table,ref_pkey,key_vals):
+        '''Returns the key values, as strings, from a list that are present in a table'''
+        found = set()
+        res = self.executeSQL('select {0} from {1} where {2}'.format(ref_pkey,table,self.formatInClause(ref_pkey,key_vals)))
+        if res is None:
+            return found
+        try:
+            feat = res.GetNextFeature()
+            while feat:
+                found.add(feat.GetFieldAsString(0))
+                feat = res.GetNextFeature()
+        finally:
+            self.getDS().ReleaseResultSet(res)
+        return found
+    
+    def _lookupFID(self,dst_layer,src_feat):
+        '''Returns the source key value and the matching destination FID, using the pkey index if one has been built for this layer'''
+        ref_pkey = self.dst_info.pkey
+        if not ref_pkey:
+            if not self.feat_field_names:
+                self.feat_field_names = self.getFieldNames(src_feat)
+            ref_pkey = self.feat_field_names
+            src_pkey = self.getFieldValues(src_feat)
+        elif self.fid_map is not None:
+            #the map holds every key in the layer and is kept up to date by inserts and deletes, a miss means there's no match
+            src_pkey = src_feat.GetFieldAsString(ref_pkey)
+            return src_pkey,self.fid_map.get(src_pkey)
+        else:
+            src_pkey = src_feat.GetFieldAsInteger(ref_pkey)
+        return src_pkey,self._findMatchingFID(dst_layer, ref_pkey, src_pkey)
+    
+    def buildFIDMap(self,dst_layer,ref_pkey):
+        '''Builds a pkey->FID lookup for the destination layer with a single scan, reading only the pkey column'''
+        st = datetime.now()
+        fid_map = {}
+        dst_defn = dst_layer.GetLayerDefn()
+        if dst_defn.GetFieldIndex(ref_pkey) < 0:
+            ldslog.warn('Cannot index destination layer, no field matching pkey {}'.format(ref_pkey))
+            return None
+        ignored = [dst_defn.GetFieldDefn(i).GetName() for i in range(0,dst_defn.GetFieldCount())]
+        ignored = [f for f in ignored if f != ref_pkey]+['OGR_GEOMETRY','OGR_STYLE']
+        try:
+            dst_layer.SetAttributeFilter(None)
+            dst_layer.SetIgnoredFields(ignored)
+            dst_layer.ResetReading()
+            dst_feat = dst_layer.GetNextFeature()
+            while dst_feat:
+                fid_map[dst_feat.GetFieldAsString(ref_pkey)] = dst_feat.GetFID()
+                dst_feat = dst_layer.GetNextFeature()
+        finally:
+            dst_layer.SetIgnoredFields([])
+            dst_layer.ResetReading()
+        ldslog.info('Indexed {} destination features on {} in {}s'.format(len(fid_map),ref_pkey,(datetime.now()-st).total_seconds()))
+        return fid_map
         
     def getFieldNames(self,feature):  
         '''Returns the names of fields in a feature'''
@@ -1087,7 +1700,7 @@ class DataStore(object):
             if name not in self.optcols and name not in [field.name for field in dst_layer.schema]:
                 #dst_layer.CreateField(fdef)
                 '''post create alter column type'''
-                if self.identify64Bit(name):
+                if self.identify64Bit(name) and not self.native64Bit(fdef):
                     #self.changeColumnIntToString(dst_layer_name,name)
                     new_field_def = ogr.FieldDefn(name,ogr.OFTString)
                     dst_layer.CreateField(new_field_def)
@@ -1112,6 +1725,10 @@ class DataStore(object):
         sufi-id is the only 64 bit data type in use. This is due to change soon with some new hydro layers being added
         that have sufi-ids which aren't 64bit...)'''
         return 'sufi' in name     
+    
+    def native64Bit(self,fdef):
+        '''64bit columns are copied as integers if the source was read as Integer64 and the destination driver can store them'''
+        return self.INTEGER64_CAPABLE and fdef.GetType() == getattr(ogr,'OFTInteger64',None)
                 
     @staticmethod
     def _compareGeometries(f1,f2):
@@ -1172,72 +1789,76 @@ class DataStore(object):
         return clone
                     
     def partialCloneFeature(self,fin,fout_def):
-        '''Builds a feature using a passed in feature definition. Must still ignore discarded columns since they will be in the source'''
+        '''Builds a feature using a passed in feature definition. Fields are copied using the layer copy plan so discarded columns 
+        and 64bit conversions aren't resolved per feature'''
+        if self.copy_plan is None:
+            self.copy_plan = CopyPlan(fin,self.optcols,self.identify64Bit,self.dst_info.pkey,self.sixtyfour)
+        plan = self.copy_plan
+        
         fout = ogr.Feature(fout_def)
         fin_geom = fin.GetGeometryRef()
-        if fin_geom:
+        if plan.SET_FROM:
+            fout.SetFromWithMap(fin,1,plan.field_map)
+            #geometry is only copied by SetFrom if the geometry field names match
+            if fin_geom and fout.GetGeometryRef() is None: fout.SetGeometry(fin_geom)
+        else:
+            if fin_geom: fout.SetGeometry(fin_geom)
+            for fin_no,fout_no in plan.copy:
+                fout.SetField(fout_no, fin.GetField(fin_no))
+        
+        #geometry changes are made to the output copy so the source feature can be reused, e.g. update falling back to delete+insert
+        fout_geom = fout.GetGeometryRef()
+        if fout_geom:
             #absent geom attribute indicates aspatial
-            '''Modify input geometry from P to MP'''
+            '''Modify output geometry from P to MP'''
             if ENABLE_FORCE_GEOMETRY:
-                fin_geotype = fin_geom.GetGeometryType()
-                if fin_geotype == ogr.wkbPolygon:
-                    fin_geom = ogr.ForceToMultiPolygon(fin_geom)
-                    fin.SetGeometryDirectly(fin_geom)
-                elif fin_geotype == ogr.wkbPolygon25D:
-                    fin_geom = ogr.ForceToPolygon(fin_geom)
-                    fin.SetGeometryDirectly(fin_geom)
+                fout_geotype = fout_geom.GetGeometryType()
+                if fout_geotype == ogr.wkbPolygon:
+                    fout.SetGeometryDirectly(ogr.ForceToMultiPolygon(fout_geom))
+                elif fout_geotype == ogr.wkbPolygon25D:
+                    fout.SetGeometryDirectly(ogr.ForceToPolygon(fout_geom))
+                fout_geom = fout.GetGeometryRef()
       
-            '''set Geometry transforming if needed'''
-            if hasattr(self,'transform') and self.transform:
+            '''set Geometry transforming if needed, unless already done in blocks by the transform stage'''
+            if hasattr(self,'transform') and self.transform and not self.transform_stage:
                 try:
-                    fin_geom.Transform(self.transform)
+                    st = LayerMetrics.start()
+                    fout_geom.Transform(self.transform)
+                    self.metrics.record('transform',st)
                 except RuntimeError as rer:
                     if 'OGR Error' in str(rer):
                         ldslog.error('Cannot convert to requested SR. '+str(rer))
                         raise
-                
-            '''and then set the output geometry'''
-            fout.SetGeometry(fin_geom)
 
         #DataStore._showFeatureData(fin)
         #DataStore._showFeatureData(fout)
-        '''prepopulate any 64 replacement lists. this is done once per 64bit inclusive layer so not too intensive'''
-        if self.sixtyfour and (not hasattr(self,'sufi_list') or self.sufi_list is None): 
-            self.sufi_list = {}
-            doc = None
-            for fin_no in range(0,fin.GetFieldCount()):
-                fin_field_name = fin.GetFieldDefnRef(fin_no).GetName()
-                if self.identify64Bit(fin_field_name) and fin_field_name not in self.sufi_list:
-                    if doc is None:
-                        #fetch the GC document in GML2 format for column extraction. #TODO JSON extractor
-                        up = (re.sub('JSON|GML3','GML2',self.src_link.getURI()),self.src_link.pxy)
-                        doc = self.processExternal(LU.readLDS, up)
-                        #doc = LU.readDocument(re.sub('JSON|GML3','GML2',self.src_link.getURI()),self.src_link.pxy)
-                    self.sufi_list[fin_field_name] = SUFIExtractor.readURI(doc,fin_field_name)
-            
-        '''populate non geometric fields'''
-        fout_no = 0
-        for fin_no in range(0,fin.GetFieldCount()):
-            fin_field_name = fin.GetFieldDefnRef(fin_no).GetName()
-            #assumes id is the PK
-            if fin_field_name == self.dst_info.pkey:#'id':
-                current_id =  fin.GetField(fin_no)
-            if self.sixtyfour and self.identify64Bit(fin_field_name): #in self.sixtyfour
-                #assumes id occurs before sufi in the document
-                #sixtyfour test first since identify could be time consuming. Luckily sufi-containing tables are small and process quite quickly                
-                copy_field = self.sufi_list[fin_field_name][current_id]
-                fout.SetField(fout_no, str(copy_field))
-                fout_no += 1
-            elif fin_field_name not in self.optcols:
-                copy_field = fin.GetField(fin_no)
-                fout.SetField(fout_no, copy_field)
-                fout_no += 1
+        '''64bit fields GDAL couldn't read at full precision from a downloaded layer are replaced with their string values read from 
+        the download, looked up by key'''
+        if plan.sufi:
+            if self.sufi_list is None: self.sufi_list = self.openSUFIExtractor(plan)
+            values = self.sufi_list.lookup(fin.GetFieldAsString(plan.key_no))
+            for fin_no,fout_no,fin_field_name in plan.sufi:
+                fout.SetField(fout_no, values[fin_field_name])
             
         return fout 
+    
+    def openSUFIExtractor(self,plan):
+        '''Opens a streaming reader of the key and 64bit columns of the downloaded layer. Values are read as the features are copied 
+        so only those read ahead of the copy are held. LDS requests are read from pages which already give the exact values'''
+        if plan.key_no is None:
+            raise FeatureCopyException('64bit columns need a key column to match source values')
+        cols = [fin_field_name for _,_,fin_field_name in plan.sufi]
+        if not (self.src_link.offline and self.download):
+            raise FeatureCopyException('64bit columns {} of {} can only be read exactly from LDS pages or a downloaded layer'
+                                       .format(cols,self.src_info.layer_id))
+        ldslog.info('Reading 64bit columns {} by {}'.format(cols,plan.key_name))
+        return SUFIExtractor(self.download.path,plan.key_name,cols)
  
     @DB.dmesg(prefix='pCFD')
     def partialCloneFeatureDef(self,fin):
         '''Builds a feature definition ignoring optcols i.e. {gml_id, __change__} and any other discarded columns'''
+        #the field mapping for the layer is fixed by this definition so compile it once here
+        self.copy_plan = CopyPlan(fin,self.optcols,self.identify64Bit,self.dst_info.pkey,self.sixtyfour)
         #create blank feat defn
         fout_def = ogr.FeatureDefn()
         #read input feat defn
@@ -1246,10 +1867,12 @@ class DataStore(object):
         for fin_no in range(0,fin.GetFieldCount()):
             fin_field_def = fin.GetFieldDefnRef(fin_no)
             fin_field_name = fin_field_def.GetName()
-            if self.identify64Bit(fin_field_name): 
+            if not CopyPlan.keeps(fin_field_name,self.optcols,self.identify64Bit):
+                continue
+            if self.identify64Bit(fin_field_name) and not self.native64Bit(fin_field_def): 
                 new_field_def = ogr.FieldDefn(fin_field_name,ogr.OFTString)
                 fout_def.AddFieldDefn(new_field_def)
-            elif fin_field_name not in self.optcols:
+            else:
                 #print "n={}, typ={}, wd={}, prc={}, tnm={}".format(fin_field_def.GetName(),fin_field_def.GetType(),fin_field_def.GetWidth(),fin_field_def.GetPrecision(),fin_field_def.GetTypeName())
                 fout_def.AddFieldDefn(fin_field_def)
                 
@@ -1279,6 +1902,85 @@ class DataStore(object):
         
     #----------------------------------------------------------------------------------------------
     
+    def getPageSize(self,layer):
+        '''Gets the page size learned for a layer on previous runs, None if it hasn't been adjusted'''
+        ps = self.layerconf.readLayerProperty(layer,'pagesize')
+        return int(ps) if LU.assessNone(ps) and str(ps).strip().isdigit() else None
+    
+    def setPageSize(self,layer,size):
+        '''Records the page size reached by the page size controller'''
+        self.layerconf.writeLayerProperty(layer, 'pagesize', str(size))
+        ldslog.debug('Setting PS layer={} pagesize={}'.format(layer,size))
+        
+    #----------------------------------------------------------------------------------------------
+    
+    def getCheckpoint(self,layer):
+        '''Gets the point reached by an interrupted chunked copy of a layer, None if the last copy completed'''
+        return Checkpoint.parse(self.layerconf.readLayerProperty(layer,'checkpoint'))
+    
+    def setCheckpoint(self,layer,checkpoint):
+        '''Records the features committed so far in a chunked copy'''
+        self.layerconf.writeLayerProperty(layer, 'checkpoint', str(checkpoint))
+        ldslog.debug('Setting CP layer={} checkpoint={}'.format(layer,checkpoint))
+        
+    def clearCheckpoint(self,layer):
+        '''Clears the copy checkpoint once a layer completes or is cleaned'''
+        if self.getCheckpoint(layer):
+            self.layerconf.writeLayerProperty(layer, 'checkpoint', None)
+        
+    def commitCheckpoint(self,dst_layer,checkpoint):
+        '''Commits the current chunk and records its checkpoint then starts a new transaction for the next chunk. Unlike the layer
+        commit a failure raises, a checkpoint must never be recorded for a chunk that may not have been committed'''
+        #an internal layer config shares the destination connection so the checkpoint can be committed with the data. 
+        #Otherwise write it after the commit so it never gets ahead of the data
+        st = LayerMetrics.start()
+        if self.layerconf.getDS():
+            self.setCheckpoint(self.src_info.layer_id,checkpoint)
+            dst_layer.CommitTransaction()
+        else:
+            dst_layer.CommitTransaction()
+            self.setCheckpoint(self.src_info.layer_id,checkpoint)
+        self.metrics.record('commit',st,checkpoint.committed)
+        dst_layer.StartTransaction()
+        
+    def discardUncheckpointed(self,checkpoint):
+        '''Deletes features keyed after a checkpoint's last key so a resumed copy doesn't insert them twice. A checkpoint kept in a 
+        file is written after its chunk commits, features committed after the last recorded checkpoint are copied again'''
+        sortkey = self.src_link.getPrimaryKey()
+        fstr = "{0} > {1}" if re.search('^\d+$',checkpoint.lastkey) else "{0} > '{1}'"
+        ldslog.info('Discarding features after checkpoint key '+checkpoint.lastkey)
+        self._baseDeleteFeature(self.dst_info.ascii_name,fstr.format(sortkey,checkpoint.lastkey.replace("'","''")))
+        
+    def restartLayer(self,src,layername):
+        '''Discards a partially copied layer and re-requests the source from the first feature'''
+        self._cleanLayerByRef(self.getDS(),layername,True)
+        self.clearLastModified(layername)
+        self.clearCheckpoint(layername)
+        src.clearResumePoint()
+        src.setURI(src.requestbuilder.sourceURI(layername))
+        src.read(src.getURI(),False)
+        
+    def commitTransaction(self,dst_layer):
+        '''Commits the layer transaction. A failed commit is logged rather than raised, as it was when OGR exceptions were switched 
+        off around the commit, since some drivers report an error on an otherwise successful commit. Exceptions are now left enabled, 
+        switching them off is process wide and would race with other layer workers. Chunk commits raise, see commitCheckpoint'''
+        st = LayerMetrics.start()
+        try:
+            dst_layer.CommitTransaction()
+        except RuntimeError as rte:
+            #HACK
+            ldslog.warn('CommitTransaction raising OGR Error. [ '+str(rte)+'] Ignoring!')
+        self.metrics.record('commit',st)
+        
+    def _rollbackTransaction(self,dst_layer):
+        '''Rollback without masking the exception that caused it'''
+        try:
+            dst_layer.RollbackTransaction()
+        except Exception as e:
+            ldslog.warn('Rollback failed. '+str(e))
+        
+    #----------------------------------------------------------------------------------------------
+    
     def getEPSGConversion(self,layer):
         '''Gets the saved EPSG for the layer'''
         return self.layerconf.readLayerProperty(layer,'epsg')
@@ -1357,7 +2059,10 @@ class DataStore(object):
                 continue
             if re.match('select\s+',line):
                 continue
-            if re.match('(?:update|insert)\s+(?:\w+|\*)\s+',line):
+            if re.match('(?:update|insert)\s+(?:[\w\.]+|\*)\s+',line):
+                continue
+            #MSSQL set based changeset apply
+            if re.match('merge\s+',line):
                 continue
             if re.match('if\s+object_id\(',line):
                 continue
@@ -1504,7 +2209,7 @@ class DataStore(object):
     def _baseDeleteFeature(self,table,where=None):
         '''Deletion by feature using base methods but intended for truncate operations'''
         #works with PG, MS, SL FG? NB. Not Fully tested...
-        sql_str = u"delete * from "+table + " where "+str(where) if where else "delete from "+table
+        sql_str = u"delete from "+table + " where "+str(where) if where else "delete from "+table
         return self.executeSQL(sql_str)
         
     def _clean(self):
@@ -1541,6 +2246,11 @@ class DataStore(object):
         fstr = "{0} = {1}" if isinstance(key_val,int) or re.search('^\d+$',str(key_val)) else "{0} = '{1}'"
         return fstr.format(ref_pkey,key_val)
     
+    def formatInClause(self,ref_pkey,key_vals):
+        if all([isinstance(k,int) or re.search('^\d+$',str(k)) for k in key_vals]):
+            return "{0} in ({1})".format(ref_pkey,','.join([str(k) for k in key_vals]))
+        return "{0} in ({1})".format(ref_pkey,','.join(["'{}'".format(str(k).replace("'","''")) for k in key_vals]))
+    
     def _findMatchingFeature(self,search_layer,ref_pkey,key_val):
         '''Find the Feature matching a primary key value'''
         matching_feature = None
@@ -1650,6 +2360,530 @@ class LayerInfo(object):
         
 
         
+class Checkpoint(object):
+    '''Simple class recording the progress of a chunked layer copy, stored in the layer config as "committed=N;total=T;lastkey=K".
+    The total is the source feature count when the copy started and is used to check the source hasn't changed before resuming'''
+    def __init__(self,committed=0,lastkey=None,total=None):
+        self.committed = committed
+        self.lastkey = lastkey
+        self.total = total
+        
+    def __str__(self):
+        return 'committed={};total={};lastkey={}'.format(self.committed,'' if self.total is None else self.total,'' if self.lastkey is None else self.lastkey)
+    
+    @classmethod
+    def parse(cls,cpstr):
+        '''Rebuild a checkpoint from its config string, returns None if no checkpoint is recorded'''
+        if not LU.assessNone(cpstr): return None
+        #lastkey is last so a key containing the separator still parses
+        cpd = dict([kv.split('=',1) for kv in cpstr.split(';',2) if '=' in kv])
+        return cls(int(cpd.get('committed',0)),cpd.get('lastkey') or None,int(cpd['total']) if cpd.get('total') else None)
+
+        
+class CopyPlan(object):
+    '''Per layer field mapping for partialCloneFeature, built once from the first source feature. Matches the field order of 
+    partialCloneFeatureDef i.e. 64bit fields are kept and other discarded columns are dropped'''
+    #available in GDAL >= 1.8
+    SET_FROM = hasattr(ogr.Feature,'SetFromWithMap')
+    #key matching features to their 64bit values if no primary key is configured
+    DEFAULT_KEY = 'id'
+    
+    def __init__(self,fin,optcols,identify64Bit,pkey,sixtyfour):
+        #source index -> destination index, -1 for fields not copied directly. Used by SetFromWithMap
+        self.field_map = []
+        #(source index, destination index) pairs for the per-field fallback
+        self.copy = ()
+        #(source index, destination index, name) for 64bit fields GDAL couldn't read exactly, replaced by their extracted string values
+        self.sufi = ()
+        self.key_name = self.keyName(pkey)
+        self.key_no = None
+        fout_no = 0
+        for fin_no in range(0,fin.GetFieldCount()):
+            fin_field_def = fin.GetFieldDefnRef(fin_no)
+            fin_field_name = fin_field_def.GetName()
+            if fin_field_name == self.key_name: 
+                self.key_no = fin_no
+            if not self.keeps(fin_field_name,optcols,identify64Bit):
+                self.field_map.append(-1)
+                continue
+            if self.inexact64Bit(fin_field_def,identify64Bit,sixtyfour):
+                self.sufi += ((fin_no,fout_no,fin_field_name),)
+                self.field_map.append(-1)
+            else:
+                self.copy += ((fin_no,fout_no),)
+                self.field_map.append(fout_no)
+            fout_no += 1
+            
+    @staticmethod
+    def keeps(name,optcols,identify64Bit):
+        '''Whether a source field has a destination column, shared with partialCloneFeatureDef so their field orders match. 64bit 
+        columns are kept even if listed as discarded'''
+        return identify64Bit(name) or name not in optcols
+            
+    @staticmethod
+    def keyName(pkey):
+        return pkey if LU.assessNone(pkey) else CopyPlan.DEFAULT_KEY
+    
+    @classmethod
+    def inexact64Bit(cls,fdef,identify64Bit,sixtyfour):
+        '''Whether a field is a 64bit column of a 64bit layer that GDAL couldn't read at full precision'''
+        return bool(sixtyfour) and identify64Bit(fdef.GetName()) and not cls.isFullPrecision(fdef)
+            
+    @staticmethod
+    def isFullPrecision(fdef):
+        '''64bit values are exact if the source driver read them as Integer64 (GDAL >= 2.0 with a typed schema) or as strings'''
+        return fdef.GetType() in (getattr(ogr,'OFTInteger64',ogr.OFTString),ogr.OFTString)
+            
+
+class PrefetchBuffer(object):
+    '''Holds prefetched features by change type. Once the estimated size of the held features exceeds the memory budget all 
+    further features are serialised (fid, fields, WKB geometries) to a temporary file per change type. Indexing by change type
+    returns the held features followed by the spilled ones, in the order they were added'''
+    #approximate per feature cost of the SWIG wrapper and OGRFeature beyond its field and geometry data
+    FEATURE_OVERHEAD = 512
+    
+    def __init__(self,budget):
+        self.budget = budget
+        self.used = 0
+        self.held = {'delete':[],'update':[],'insert':[]}
+        self.spill = {}
+        self.spilled = 0
+        self.feat_def = None
+        
+    def __len__(self):
+        return sum(len(h) for h in self.held.values())+self.spilled
+        
+    def __getitem__(self,change):
+        return self.iterChange(change)
+    
+    def add(self,change,feat):
+        if self.feat_def is None:
+            self.feat_def = feat.GetDefnRef()
+        if not self.spill:
+            self.used += self.sizeOf(feat)
+            if self.used <= self.budget:
+                self.held[change].append(feat)
+                return
+            ldslog.info('Prefetch memory budget of {}MB reached, spilling features to disk'.format(self.budget/1024/1024))
+        if change not in self.spill:
+            self.spill[change] = tempfile.TemporaryFile(prefix='lds_prefetch_')
+        cPickle.dump(self.serialise(feat),self.spill[change],cPickle.HIGHEST_PROTOCOL)
+        self.spilled += 1
+        
+    def iterChange(self,change):
+        for feat in self.held[change]:
+            yield feat
+        sf = self.spill.get(change)
+        if sf:
+            sf.seek(0)
+            while True:
+                try:
+                    yield self.deserialise(cPickle.load(sf))
+                except EOFError:
+                    break
+    
+    def close(self):
+        for sf in self.spill.values():
+            sf.close()
+        self.spill = {}
+        self.held = {'delete':[],'update':[],'insert':[]}
+    
+    def sizeOf(self,feat):
+        size = self.FEATURE_OVERHEAD
+        for i in range(feat.GetFieldCount()):
+            size += len(feat.GetFieldAsString(i))
+        for i in range(feat.GetGeomFieldCount()):
+            geom = feat.GetGeomFieldRef(i)
+            if geom: size += geom.WkbSize()
+        return size
+    
+    @staticmethod
+    def serialise(feat):
+        fields = [feat.GetField(i) if feat.IsFieldSet(i) else None for i in range(feat.GetFieldCount())]
+        geoms = []
+        for i in range(feat.GetGeomFieldCount()):
+            geom = feat.GetGeomFieldRef(i)
+            geoms.append(geom.ExportToIsoWkb() if geom else None)
+        return (feat.GetFID(),fields,geoms)
+        
+    def deserialise(self,record):
+        fid,fields,geoms = record
+        feat = ogr.Feature(self.feat_def)
+        feat.SetFID(fid)
+        for i,value in enumerate(fields):
+            if value is not None: feat.SetField(i,value)
+        for i,wkb in enumerate(geoms):
+            if wkb is not None: feat.SetGeomFieldDirectly(i,ogr.CreateGeometryFromWkb(wkb))
+        return feat
+            
+
+class PagedSource(object):
+    '''Reads the features of pages fetched by a PageFetcher in page order. GML pages are opened using the layer's DescribeFeatureType 
+    schema and their features copied onto the source layer definition, so copy loops see the same fields as from the WFS layer.
+    Without a schema pages are read as GeoJSON, directly onto the source layer definition. If a key column is given the last key 
+    read is passed to the fetcher for the next page. Reading ends with the pages, at an empty page or once 'total' features, if 
+    known, have been read. A page that can't be fetched or read raises InaccessibleFeatureException so the layer is retried.
+    The CRS of the layer, 'srs', and the number of features, 'matched', are read from the first page and the total set from 
+    the count if it wasn't given. Columns named by 'sufi' are 64bit columns typed as strings in the layer definition, their
+    exact values are parsed from each GML page as GDAL may read them through a double. GeoJSON pages with the axes of a URN named CRS are swapped to the 
+    x,y order GDAL reads GML in'''
+    
+    def __init__(self,fetcher,defn,xsd,metrics,keycol=None,lastkey=None,total=None,sufi=None):
+        self.fetcher = fetcher
+        self.keycol = keycol
+        self.lastkey = lastkey
+        self.defn = defn
+        self.xsd = xsd
+        self.metrics = metrics
+        self.total = total
+        self.srs = None
+        self.matched = None
+        self.swap = False
+        #(key column,64bit columns) parsed from each GML page and the {key:{column:value}} of the current page
+        self.sufi = sufi
+        self.pairs = None
+        self.ds = None
+        self.layer = None
+        self.path = None
+        self.field_map = None
+        self.pages = 0
+        self.read = 0
+        self.count = 0
+        
+    def next(self):
+        while True:
+            if self.layer is not None:
+                st = LayerMetrics.start()
+                try:
+                    feat = self.layer.GetNextFeature()
+                except ValueError as ve:
+                    self.unreadable(ve)
+                if feat:
+                    self.read += 1
+                    self.count += 1
+                    if self.keycol: self.lastkey = feat.GetFieldAsString(self.keycol)
+                    self.metrics.record('fetch',st)
+                    return feat if self.field_map is None else self.convert(feat)
+                self.layer,self.ds = None,None
+                #a short page isn't necessarily the last, the server may cap the page size below the one requested
+                if self.read == 0 or (self.total is not None and self.count >= self.total):
+                    return None
+            try:
+                self.path = self.fetcher.next(self.lastkey)
+            except (URLError, socket.error, httplib.HTTPException) as e:
+                raise InaccessibleFeatureException('Page {} of {} failed. {}'.format(self.pages+1,self.fetcher.name,PageFetcher.reason(e)))
+            if self.path is None:
+                return None
+            self.pages += 1
+            self.open(self.path)
+            if self.layer is None:
+                return None
+            
+    def open(self,path):
+        self.read = 0
+        self.field_map = None
+        self.pairs = None
+        if self.xsd is None:
+            try:
+                if self.pages == 1: self.readMembers(GeoJSONStream.readMembers(path))
+                self.layer = GeoJSONLayer(path,self.defn,self.swap)
+            except (ValueError, IOError, EOFError) as ve:
+                self.unreadable(ve)
+            return
+        try:
+            if self.pages == 1: self.setMatched(FeatureCounter.readMatched(path))
+            if hasattr(gdal,'OpenEx'):
+                self.ds = gdal.OpenEx(path,gdal.OF_VECTOR,open_options=['XSD='+self.xsd.path])
+            else:
+                self.ds = ogr.Open(path)
+        except (RuntimeError, IOError, EOFError) as rte:
+            self.unreadable(rte)
+        if self.ds is None:
+            self.unreadable('Not a GML document')
+        #a page with no features has no layer
+        if self.ds.GetLayerCount()==0:
+            self.ds = None
+            self.layer = None
+            return
+        self.layer = self.ds.GetLayer(0)
+        if self.pages == 1: self.srs = self.layer.GetSpatialRef()
+        if self.sufi:
+            try:
+                self.pairs = SUFIExtractor.readPage(path,*self.sufi)
+            except (IOError, EOFError, SyntaxError) as se:
+                self.unreadable(se)
+        page_defn = self.layer.GetLayerDefn()
+        self.field_map = [self.defn.GetFieldIndex(page_defn.GetFieldDefn(i).GetName()) for i in range(page_defn.GetFieldCount())]
+        
+    def setMatched(self,matched):
+        self.matched = int(matched) if matched is not None else None
+        if self.total is None: self.total = self.matched
+        
+    def readMembers(self,members):
+        self.setMatched(members.get('numberMatched',members.get('totalFeatures')))
+        self.readCRS(members.get('crs'))
+        
+    def readCRS(self,name):
+        '''Sets the SRS from the crs named by the first GeoJSON page. As for GML, coordinates are in the axis order of a CRS named 
+        by URN so are swapped if it is EPSG lat/long or northing/easting. Without an EPSG crs pages are read in the layer CRS'''
+        code = re.search('EPSG\D+(?:[\d.]+\D+)?(\d+)$',name or '',flags=re.IGNORECASE)
+        srs = Projection.getSpatialReference(code.group(1)) if code else None
+        if srs is None:
+            ldslog.warn('GeoJSON pages of {} have no EPSG crs ({}), read as in the layer CRS'.format(self.fetcher.name,name))
+            return
+        self.srs = srs.Clone()
+        if hasattr(self.srs,'SetAxisMappingStrategy'): self.srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        if not re.match('EPSG:\d+$|.*epsg\.xml#',name,flags=re.IGNORECASE):
+            self.swap = bool(srs.EPSGTreatsAsLatLong() or hasattr(srs,'EPSGTreatsAsNorthingEasting') and srs.EPSGTreatsAsNorthingEasting())
+        if self.swap: ldslog.info('GeoJSON pages of {} are in {} axis order, swapping to x,y'.format(self.fetcher.name,name))
+        
+    def unreadable(self,err):
+        '''Raises for a page that isn't a feature collection, e.g. an exception report returned with a 200, or is cut short. The 
+        page is dropped from the cache so a retry fetches it again'''
+        self.layer,self.ds = None,None
+        self.fetcher.discard(self.path)
+        raise InaccessibleFeatureException('Page {} of {} failed, cannot read {}. {}'.format(self.pages,self.fetcher.name,self.path,err))
+        
+    def convert(self,feat):
+        out = ogr.Feature(self.defn)
+        if CopyPlan.SET_FROM:
+            out.SetFromWithMap(feat,1,self.field_map)
+        else:
+            for fin_no,fout_no in enumerate(self.field_map):
+                if fout_no >= 0: out.SetField(fout_no,feat.GetField(fin_no))
+        if self.pairs is not None:
+            key = feat.GetFieldAsString(self.sufi[0])
+            if key not in self.pairs:
+                raise FeatureCopyException('No 64bit values found for {}={} in page {} of {}'.format(self.sufi[0],key,self.pages,self.fetcher.name))
+            for name,value in self.pairs[key].items():
+                if value is not None: out.SetField(name,value)
+        geom = feat.GetGeometryRef()
+        if geom and out.GetGeometryRef() is None: out.SetGeometry(geom)
+        out.SetFID(feat.GetFID())
+        return out
+    
+    @staticmethod
+    def stringDefn(defn,names):
+        '''Copy of a layer definition with the named fields typed as strings'''
+        out = ogr.FeatureDefn(defn.GetName())
+        out.SetGeomType(defn.GetGeomType())
+        for i in range(defn.GetFieldCount()):
+            fdef = defn.GetFieldDefn(i)
+            out.AddFieldDefn(ogr.FieldDefn(fdef.GetName(),ogr.OFTString) if fdef.GetName() in names else fdef)
+        return out
+    
+    def close(self):
+        if isinstance(self.layer,GeoJSONLayer): self.layer.close()
+        self.layer,self.ds = None,None
+        self.fetcher.stop()
+        if self.xsd: self.xsd.remove()
+        
+
+class GeoJSONLayer(object):
+    '''Stands in for the OGR layer of a GML page, reading a GeoJSON page as features of the source layer definition. Properties are 
+    set on the fields of the same name, including __change__, and 64bit integers from the exact value parsed rather than through 
+    a double. As the GML driver does with gml:id, the feature id fills gml_id and its numeric suffix the FID. If swap is set 
+    geometries are read with their x and y exchanged'''
+    INTEGER64 = getattr(ogr,'OFTInteger64',None)
+    
+    def __init__(self,path,defn,swap=False):
+        self.stream = GeoJSONStream(path)
+        self.defn = defn
+        self.swap = swap
+        self.fields = dict((defn.GetFieldDefn(i).GetName(),(i,defn.GetFieldDefn(i).GetType())) for i in range(defn.GetFieldCount()))
+        self.gml_id = self.fields.get('gml_id')
+        self.count = 0
+        
+    def GetNextFeature(self):
+        jfeat = next(self.stream,None)
+        if jfeat is None:
+            return None
+        self.count += 1
+        feat = ogr.Feature(self.defn)
+        for name,value in (jfeat.get('properties') or {}).iteritems():
+            field = self.fields.get(name.encode('utf-8'))
+            if field and value is not None: self.setField(feat,field,value)
+        fid = jfeat.get('id')
+        if fid is not None and self.gml_id: self.setField(feat,self.gml_id,fid)
+        suffix = unicode(fid).rsplit('.',1)[-1] if fid is not None else ''
+        feat.SetFID(int(suffix) if suffix.isdigit() else self.count)
+        geom = jfeat.get('geometry')
+        if geom: 
+            if self.swap: geom = self.swapAxes(geom)
+            feat.SetGeometryDirectly(ogr.CreateGeometryFromJson(json.dumps(geom)))
+        return feat
+    
+    @classmethod
+    def swapAxes(cls,geom):
+        '''Copy of a GeoJSON geometry with the first two ordinates of every position exchanged'''
+        if 'geometries' in geom:
+            return dict(geom,geometries=[cls.swapAxes(g) for g in geom['geometries']])
+        def swap(coords):
+            if coords and isinstance(coords[0],(int,long,float)):
+                return [coords[1],coords[0]]+coords[2:]
+            return [swap(c) for c in coords]
+        return dict(geom,coordinates=swap(geom['coordinates']))
+    
+    def setField(self,feat,field,value):
+        index,ftype = field
+        if isinstance(value,(dict,list)): 
+            value = json.dumps(value)
+        if ftype == self.INTEGER64:
+            feat.SetFieldInteger64(index,int(value))
+        elif ftype == ogr.OFTInteger:
+            feat.SetField(index,int(value))
+        elif ftype == ogr.OFTReal:
+            feat.SetField(index,float(value))
+        elif isinstance(value,unicode):
+            feat.SetField(index,value.encode('utf-8'))
+        elif isinstance(value,bool):
+            feat.SetField(index,'true' if value else 'false')
+        else:
+            #64bit ids read into string columns keep every digit
+            feat.SetField(index,str(value))
+            
+    def close(self):
+        self.stream.close()
+        
+
+class PageSizeController(object):
+    '''Additive increase/multiplicative decrease of the number of features requested per page. Pages fetched within the target 
+    latency grow the size by a fixed step, slower pages cut it gently and server timeouts (50x) halve it'''
+    MINIMUM = 100
+    MAXIMUM = 100000
+    SLOW_DECREASE = 0.75
+    FAILURE_DECREASE = 0.5
+    
+    def __init__(self,size,target,step=None):
+        '''target latency in ms, step defaults to a tenth of the starting size'''
+        self.initial = min(max(int(size),self.MINIMUM),self.MAXIMUM)
+        self.size = self.initial
+        self.target = target
+        self.step = step or max(self.initial//10,self.MINIMUM)
+        self.pages = 0
+        #pages may be fetched concurrently
+        self.lock = threading.Lock()
+        
+    def success(self,ms):
+        '''Adjusts the size following a page that took ms to fetch'''
+        with self.lock:
+            self.pages += 1
+            if ms > self.target:
+                self.size = max(int(self.size*self.SLOW_DECREASE),self.MINIMUM)
+            else:
+                self.size = min(self.size+self.step,self.MAXIMUM)
+            return self.size
+        
+    def failure(self):
+        '''Adjusts the size following a gateway error or timeout'''
+        with self.lock:
+            self.size = max(int(self.size*self.FAILURE_DECREASE),self.MINIMUM)
+            return self.size
+        
+
+class TransformStage(object):
+    '''Reads blocks of features ahead of a copy loop and reprojects their geometries together using a TransformPool'''
+    def __init__(self,pool,metrics):
+        self.pool = pool
+        self.metrics = metrics
+        self.fetch = None
+        self.block = deque()
+        self.exhausted = False
+        
+    def setSource(self,fetch):
+        '''Sets the next-feature function to read from and returns the transformed equivalent'''
+        self.fetch = fetch
+        return self.next
+        
+    def next(self):
+        if not self.block and not self.exhausted:
+            self._readBlock()
+        return self.block.popleft() if self.block else None
+    
+    def _readBlock(self):
+        feats = []
+        while len(feats) < self.pool.getBlockSize():
+            feat = self.fetch()
+            if not feat:
+                self.exhausted = True
+                break
+            feats.append(feat)
+        if feats:
+            st = LayerMetrics.start()
+            self.pool.transformFeatures(feats)
+            self.metrics.record('transform',st,len(feats))
+        self.block.extend(feats)
+        
+    def close(self):
+        '''The pool is shared by every layer so is left running, only the features read ahead are discarded'''
+        self.block.clear()
+        
+
+class FeaturePipeline(object):
+    '''Reads features on a separate thread into a bounded queue for a writer consuming them with next(). Records the queue 
+    depth seen by the writer and how often either side had to wait, showing whether the fetch or the write is the bottleneck'''
+    POLL = 1
+    
+    def __init__(self,fetch,depth,name=None):
+        self.fetch = fetch
+        self.depth = depth
+        self.name = name
+        self.queue = Queue(depth)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._read,name='FeatureReader')
+        self.thread.daemon = True
+        self.reads = 0
+        self.depth_sum = 0
+        self.writer_waits = 0
+        self.reader_waits = 0
+        
+    def start(self):
+        self.thread.start()
+        
+    def _read(self):
+        '''Reader thread. Queues features until the source is exhausted, ending with None or the exception that stopped it'''
+        try:
+            feat = self.fetch()
+            while feat and self._put((feat,None)):
+                feat = self.fetch()
+            self._put((None,None))
+        except Exception:
+            self._put((None,sys.exc_info()))
+            
+    def _put(self,item):
+        '''Blocking put that gives up if the writer stops'''
+        if self.queue.full(): self.reader_waits += 1
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item,timeout=self.POLL)
+                return True
+            except Full:
+                pass
+        return False
+        
+    def next(self):
+        '''Returns the next feature, None at the end of the source, re-raising any reader exception on the writer thread'''
+        qd = self.queue.qsize()
+        self.reads += 1
+        self.depth_sum += qd
+        if qd == 0: self.writer_waits += 1
+        feat,err = self.queue.get()
+        if err: raise err[0],err[1],err[2]
+        return feat
+        
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.report()
+        
+    def report(self):
+        if not self.reads: return
+        avg = float(self.depth_sum)/self.reads
+        timerlog.info('PIPELINE,{},{},{:.1f},{},{}'.format(self.name,self.reads,avg,self.writer_waits,self.reader_waits))
+        ldslog.info('Pipeline {}: reads={} depth={:.1f}/{} writer waits={} reader waits={}. {} bound'.format(
+                    self.name,self.reads,avg,self.depth,self.writer_waits,self.reader_waits,'Fetch' if self.writer_waits>self.reader_waits else 'Write'))
+
+        
 class FeatureInfo(object):    
     '''Simple convenience class used to store common feature info, to be embedded in LayerInfo'''
     def __init__(self,feat_id,feat_name):
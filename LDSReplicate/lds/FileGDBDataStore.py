@@ -34,6 +34,8 @@ class FileGDBDataStore(ESRIDataStore):
     
     FGDB_BULK_LOAD = 'YES'
     SUFFIX = '.gdb'
+    #the FileGDB API has no 64bit integer field type
+    INTEGER64_CAPABLE = False
     
         #wkbNone removed
     ValidGeometryTypes = (ogr.wkbUnknown, ogr.wkbPoint, ogr.wkbLineString,
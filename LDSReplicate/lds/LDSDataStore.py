@@ -18,17 +18,14 @@ Created on 23/07/2012
 '''
 
 import re
-
-from contextlib import closing
+import gdal
 
 from lxml import etree
 from lxml.etree import XMLSyntaxError
 
-from urllib2 import urlopen, build_opener, install_opener, ProxyHandler
-
 from lds.WFSDataStore import WFSDataStore
 from lds.RequestBuilder import RequestBuilder
-from lds.LDSUtilities import LDSUtilities
+from lds.LDSUtilities import LDSUtilities, CapabilitiesCache
 from lds.VersionUtilities import AppVersion
 
 ldslog = LDSUtilities.setupLogging()
@@ -43,8 +40,6 @@ class LDSDataStore(WFSDataStore):
     OGR_WFS_PAGE_SIZE = 10000
     OGR_WFS_PAGING_ALLOWED = 'OFF'
     
-    PAGE_REDUCTION_STEP = 0.5
-    
     OGR_WFS_LOAD_MULTIPLE_LAYER_DEFN = 'OFF'
     OGR_WFS_BASE_START_INDEX = 0
     
@@ -79,6 +74,9 @@ class LDSDataStore(WFSDataStore):
         self.pkey = None
         self.psize = None
         self.pstart = None
+        self.keyset = False
+        self.ksize = None
+        self.pagesizer = None
         
         super(LDSDataStore,self).__init__(conn_str,user_config)
         
@@ -100,7 +98,7 @@ class LDSDataStore(WFSDataStore):
         #CPL_CURL_VERBOSE for those ogrerror/generalerror
         #OGR_WFS_PAGING_ALLOWED, OGR_WFS_PAGE_SIZE, OGR_WFS_BASE_START_INDEX
         local_opts  = ['GDAL_HTTP_USERAGENT='+str(self.GDAL_HTTP_USERAGENT)]
-        local_opts  = ['GDAL_HTTP_TIMEOUT='+str(self.GDAL_HTTP_TIMEOUT)]
+        local_opts += ['GDAL_HTTP_TIMEOUT='+str(self.GDAL_HTTP_TIMEOUT)]
         local_opts += ['OGR_WFS_PAGING_ALLOWED='+str(self.OGR_WFS_PAGING_ALLOWED)]
         local_opts += ['OGR_WFS_PAGE_SIZE='+str(self.getPartitionSize() if self.getPartitionSize() else self.OGR_WFS_PAGE_SIZE)]
         local_opts += ['OGR_WFS_USE_STREAMING='+str(self.OGR_WFS_USE_STREAMING)]
@@ -114,8 +112,12 @@ class LDSDataStore(WFSDataStore):
         return super(LDSDataStore,self).getLayerOptions(layer_id) + local_opts
     
     def setPrimaryKey(self,pkey):
-        '''Sets the name of the primary key column in the datasource object'''
+        '''Sets the name of the primary key column in the datasource object. Requests are sorted on this key when it is set'''
         self.pkey = pkey
+        self.requestbuilder.pkey = pkey
+        
+    def getPrimaryKey(self):
+        return self.pkey
         
     def setPartitionSize(self,psize):
         '''Sets the partition size i.e. the number of features to be returned per WFS request'''
@@ -124,9 +126,50 @@ class LDSDataStore(WFSDataStore):
     def getPartitionSize(self):
         return self.psize
         
+    def setPageSizer(self,sizer):
+        '''Sets the controller adjusting the page size as the layer is read and applies its current size'''
+        self.pagesizer = sizer
+        self.applyPageSize()
+        
+    def getPageSizer(self):
+        return self.pagesizer
+    
+    def applyPageSize(self):
+        '''Uses the controller's current size for following requests. The GDAL option is set for this thread only, where 
+        supported, since concurrent layer workers may have reached different sizes'''
+        if self.pagesizer:
+            self.setPartitionSize(self.pagesizer.size)
+            setOption = getattr(gdal,'SetThreadLocalConfigOption',gdal.SetConfigOption)
+            setOption('OGR_WFS_PAGE_SIZE',str(self.pagesizer.size))
+        
+    def setKeyset(self,keyset,ksize=None):
+        '''Sets whether the layer is read in pages of ksize features following the last primary key read. Needs a primary key'''
+        self.keyset = keyset
+        self.ksize = int(ksize) if LDSUtilities.assessNone(ksize) and str(ksize).strip().isdigit() else None
+        
+    def getKeyset(self):
+        return self.keyset and bool(self.pkey)
+    
+    def getKeysetSize(self):
+        '''Keyset page size, the controlled page size if there is one otherwise the partition or WFS page size'''
+        return self.getPartitionSize() or self.ksize or self.OGR_WFS_PAGE_SIZE
+        
     def setPartitionStart(self,pstart):
         '''Sets the starts point for LDS requests using the primary key as the index. Assumes the request will also be sorted by this same key'''
         self.pstart = pstart
+        self.requestbuilder.pstart = pstart
+        
+    def setResumePoint(self,checkpoint):
+        '''Sets the request start point from a copy checkpoint. Only requests sorted on the primary key can be resumed, startIndex 
+        paging without a sortBy isn't guaranteed a stable order. Returns False, clearing any start point, if the copy has to restart'''
+        if self.pkey and checkpoint.lastkey is not None:
+            self.setPartitionStart(checkpoint.lastkey)
+            return True
+        self.clearResumePoint()
+        return False
+            
+    def clearResumePoint(self):
+        self.setPartitionStart(None)
         
     def getCapabilities(self):
         '''GetCapabilities endpoint constructor'''
@@ -169,33 +212,47 @@ class LDSDataStore(WFSDataStore):
     
     
     @classmethod
-    def fetchLayerInfo(cls,url,ver=None,proxy=None):
-        '''Non-GDAL static method for fetching LDS layer ID's using etree parser.'''
-        res = []
-        content = None
-        wfs_ns = cls.NS['wfs20'] if re.match('^2',ver) else cls.NS['wfs11']
-        ftxp = "//{0}FeatureType".format(wfs_ns)
+    def fetchLayerInfo(cls,url,ver=None,proxy=None,ttl=None):
+        '''Non-GDAL static method for fetching LDS layer ID's using etree parser. The document and the parsed list are cached 
+        on disk, see CapabilitiesCache'''
+        cache = CapabilitiesCache(url,proxy,ttl)
+        try:
+            return cache.layers(lambda content: cls.parseLayerInfo(content,ver))
+        except XMLSyntaxError as xe:
+            ldslog.error('Error parsing URL;'+str(url)+' ERR;'+str(xe))
+            cache.clear()
+        return []
+    
+    @classmethod
+    def parseLayerInfo(cls,content,ver=None):
+        '''Returns (name,title,keywords) for each FeatureType in a capabilities document'''
+        return list(cls.iterLayerInfo(content,ver))
+    
+    @classmethod
+    def iterLayerInfo(cls,content,ver=None):
+        '''Yields (name,title,keywords) as each FeatureType in a capabilities document is parsed. Parsed elements are cleared 
+        so the whole document tree is never held'''
+        wfs_ns = cls.NS['wfs20'] if re.match('^2',ver or '') else cls.NS['wfs11']
+        ftag = "{0}FeatureType".format(wfs_ns)
         nmxp = "./{0}Name".format(wfs_ns)
         ttxp = "./{0}Title".format(wfs_ns)
         kyxp = "./{0}Keywords/{0}Keyword".format(cls.NS['ows'])
         
-        try:            
-            if not LDSUtilities.assessNone(proxy): install_opener(build_opener(ProxyHandler(proxy)))
-            #content = urlopen(url)#bug in lxml doesnt close url/files using parse method
-            with closing(urlopen(url)) as content:
-                tree = etree.parse(content)
-                for ft in tree.findall(ftxp):
-                    name = ft.find(nmxp).text#.encode('utf8')
-                    title = ft.find(ttxp).text#.encode('utf8')
-                    #keys = [x.text.encode('utf8') for x in ft.findall(kyxp)]
-                    keys = [x.text for x in ft.findall(kyxp)]
-                    
-                    res += ((name,title,keys),)
-                
-        except XMLSyntaxError as xe:
-            ldslog.error('Error parsing URL;'+str(url)+' ERR;'+str(xe))
-            
-        return res
+        for _,ft in etree.iterparse(content,events=('end',),tag=ftag):
+            name = ft.find(nmxp).text#.encode('utf8')
+            title = ft.find(ttxp).text#.encode('utf8')
+            #keys = [x.text.encode('utf8') for x in ft.findall(kyxp)]
+            keys = [x.text for x in ft.findall(kyxp)]
+            ft.clear()
+            #cleared FeatureTypes are still referenced by their parent
+            while ft.getprevious() is not None:
+                del ft.getparent()[0]
+            yield (name,title,keys)
+    
+    def getCapsCacheTTL(self):
+        '''Seconds a cached capabilities document is used before it is revalidated, None for the cache default'''
+        ttl = self.confwrap.readDSProperty('Misc','capscachettl')
+        return int(ttl) if LDSUtilities.assessNone(ttl) and str(ttl).strip().isdigit() else None
   
     def versionCheck(self):
         '''Nothing to check?'''
@@ -26,13 +26,29 @@ import logging
 import ast
 import urllib
 import traceback
+import time
+import socket
+import shutil
+import atexit
+import tempfile
+import httplib
+import threading
+import hashlib
+import zlib
+import struct
+import cPickle
+import json
+import gzip
 
 from string import whitespace
-from urllib2 import urlopen, build_opener, install_opener, ProxyHandler
+from urllib2 import Request, URLError, HTTPError, urlopen
+from urlparse import urlparse, urlsplit, urlunsplit, urljoin
 from contextlib import closing
 from StringIO import StringIO
 from lxml import etree
 from multiprocessing import Process, Queue
+from multiprocessing.pool import ThreadPool
+from collections import deque
 from functools import wraps, partial
 
 #ldslog = LDSUtilities.setupLogging()
@@ -413,7 +429,8 @@ class LDSUtilities(object):
     
     @staticmethod
     def timedProcessRunner(process,args,T):
-        '''For processes that are inclined to hang, stick them in new process and time them out'''
+        '''For processes that are inclined to hang, stick them in new process and time them out. HTTP reads don't need this, 
+        see HTTPTransport, it is for calls that can block inside native code'''
         timeout = T if T else LDS_READ_TIMEOUT
         pn = process.__name__
         #HACK to get around windows no-method-pickling rule 
@@ -470,9 +487,13 @@ class LDSUtilities(object):
         '''Simple LDS reader to be used in a timed worker thread context'''
         (u,p) = up
         ldslog.debug("LDS URL {} using Proxy {}".format(u,p))
-        if LDSUtilities.isProxyValid(p): install_opener(build_opener(ProxyHandler(p)))
-        with closing(urlopen(u)) as lds:
-            q.put(lds.read()) 
+        q.put(LDSUtilities.readDocument(u,p))
+        
+    @staticmethod
+    def readDocument(url,pxy=None):
+        '''Reads a document over the shared HTTP transport. Reads are bounded by the socket timeout so no worker process is needed'''
+        with closing(HTTPTransport.get(pxy).open(url)) as doc:
+            return doc.read()
             
     @staticmethod
     def isProxyValid(pxy):
@@ -649,14 +670,489 @@ class LDSUtilities(object):
                 sys.path.insert(0, p)
   
     
+class HTTPTransport(object):
+    '''Shared HTTP client for LDS requests. Connections are kept alive and pooled per host, proxy handling is set up once per
+    proxy map and a socket timeout bounds every read. Responses behave like urllib2's; error statuses raise HTTPError and 
+    redirects are followed. Responses are requested compressed and decoded as read unless the caller asks for an encoding 
+    itself, in which case it gets the encoded bytes. Bytes received and decoded are counted across all transports'''
+    #seconds without data before a read fails
+    TIMEOUT = LDS_READ_TIMEOUT
+    #idle connections kept per host
+    MAX_IDLE = 8
+    MAX_REDIRECTS = 5
+    REDIRECTS = (301,302,303,307,308)
+    ACCEPT_ENCODING = 'gzip, deflate'
+    _transports = {}
+    _lock = threading.Lock()
+    wire_bytes = 0
+    decoded_bytes = 0
+    
+    def __init__(self,pxy=None):
+        self.proxies = dict((k,urlparse(v if '://' in v else 'http://'+v)) for k,v in pxy.items()) if LDSUtilities.isProxyValid(pxy) else {}
+        self.idle = {}
+        self.lock = threading.Lock()
+        
+    @classmethod
+    def get(cls,pxy=None):
+        '''The transport for a proxy map (as WFSDataStore.pxy), created on first use'''
+        key = tuple(sorted(pxy.items())) if LDSUtilities.isProxyValid(pxy) else None
+        with cls._lock:
+            if key not in cls._transports:
+                cls._transports[key] = cls(pxy)
+            return cls._transports[key]
+        
+    def open(self,req,headers=None):
+        '''Sends a GET for a url or urllib2 Request returning the response. The connection returns to the pool when the response
+        is closed having been read to the end'''
+        url = req.get_full_url() if isinstance(req,Request) else req
+        hdrs = dict(req.header_items()) if isinstance(req,Request) else {}
+        hdrs.update(headers or {})
+        if urlsplit(url).scheme not in ('http','https'):
+            #local documents, e.g. file:// urls, aren't pooled
+            return urlopen(Request(url,headers=hdrs),timeout=self.TIMEOUT)
+        decode = 'Accept-encoding' not in hdrs and 'Accept-Encoding' not in hdrs
+        if decode: hdrs['Accept-Encoding'] = self.ACCEPT_ENCODING
+        for _ in range(self.MAX_REDIRECTS+1):
+            resp = self._request(url,hdrs,decode)
+            if resp.getcode() < 300:
+                return resp
+            #error and redirect bodies are read so the connection can be reused
+            resp.read()
+            resp.close()
+            if resp.getcode() in self.REDIRECTS and resp.info().getheader('Location'):
+                location = urljoin(url,resp.info().getheader('Location'))
+                ldslog.debug('Redirected {} to {}'.format(url,location))
+                url = location
+                continue
+            raise HTTPError(url,resp.getcode(),resp.resp.reason,resp.info(),None)
+        raise HTTPError(url,resp.getcode(),'Too many redirects',resp.info(),None)
+    
+    def _request(self,url,hdrs,decode):
+        parts = urlsplit(url)
+        proxy = self.proxies.get(parts.scheme)
+        key = (parts.scheme,parts.netloc)
+        path = urlunsplit(('','',parts.path or '/',parts.query,''))
+        if proxy and parts.scheme == 'http':
+            #plain http goes to the proxy with the absolute url, https is tunnelled
+            path = urlunsplit((parts.scheme,parts.netloc,parts.path or '/',parts.query,''))
+        #a pooled connection may have been closed by the server while idle, retry those once on a new connection
+        conn = self._acquire(key,parts,proxy)
+        reused = conn.sock is not None
+        try:
+            conn.request('GET',path,headers=hdrs)
+            resp = conn.getresponse()
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            if not reused:
+                raise
+            conn = self._connect(parts,proxy)
+            conn.request('GET',path,headers=hdrs)
+            resp = conn.getresponse()
+        return HTTPTransportResponse(self,key,conn,resp,url,decode)
+    
+    def _acquire(self,key,parts,proxy):
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop()
+        return self._connect(parts,proxy)
+    
+    def _connect(self,parts,proxy):
+        cls = httplib.HTTPSConnection if parts.scheme == 'https' else httplib.HTTPConnection
+        if proxy:
+            conn = cls(proxy.hostname,proxy.port,timeout=self.TIMEOUT)
+            if parts.scheme == 'https': conn.set_tunnel(parts.hostname,parts.port)
+        else:
+            conn = cls(parts.hostname,parts.port,timeout=self.TIMEOUT)
+        return conn
+    
+    def release(self,key,conn):
+        '''Returns a connection to the pool or closes it if the pool is full'''
+        with self.lock:
+            idle = self.idle.setdefault(key,[])
+            if len(idle) < self.MAX_IDLE:
+                idle.append(conn)
+                return
+        conn.close()
+        
+    @classmethod
+    def count(cls,wire,decoded):
+        with cls._lock:
+            cls.wire_bytes += wire
+            cls.decoded_bytes += decoded
+            
+    @classmethod
+    def resetCounters(cls):
+        with cls._lock:
+            cls.wire_bytes,cls.decoded_bytes = 0,0
+            
+    @classmethod
+    def summary(cls):
+        '''Bytes received against bytes decoded. Requests made by GDAL itself aren't counted'''
+        ratio = float(cls.decoded_bytes)/cls.wire_bytes if cls.wire_bytes else 1.0
+        return 'HTTP {:.1f}MB received, {:.1f}MB decoded ({:.1f}x), not counting requests made by the GDAL WFS driver (including '\
+            'the first page of each layer)'.format(cls.wire_bytes/1048576.0,cls.decoded_bytes/1048576.0,ratio)
+        
+    def close(self):
+        '''Closes all idle connections'''
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle: conn.close()
+            self.idle = {}
+    
+    
+class HTTPTransportResponse(object):
+    '''urllib2 style wrapper of an httplib response from a pooled connection, decoding gzip/deflate content if requested'''
+    CHUNK_SIZE = 64*1024
+    
+    def __init__(self,transport,key,conn,resp,url,decode=False):
+        self.transport = transport
+        self.key = key
+        self.conn = conn
+        self.resp = resp
+        self.url = url
+        self.encoded = (resp.getheader('Content-Encoding') or 'identity').lower() in ('gzip','deflate')
+        #32+ accepts either a gzip or zlib header, some servers send deflate without the zlib header
+        self.decoder = zlib.decompressobj(32+zlib.MAX_WBITS) if decode and self.encoded else None
+        self.raw = False
+        self.started = False
+        self.finished = False
+        self.buffer = ''
+        
+    def read(self,amt=None):
+        if self.decoder is None:
+            data = self.resp.read(amt)
+            #encoded bytes passed through are counted as decoded by the caller
+            HTTPTransport.count(len(data),0 if self.encoded else len(data))
+            return data
+        while not self.finished and (amt is None or len(self.buffer) < amt):
+            chunk = self.resp.read(self.CHUNK_SIZE)
+            decoded = self._decode(chunk) if chunk else self.decoder.flush()
+            HTTPTransport.count(len(chunk),len(decoded))
+            self.buffer += decoded
+            self.finished = not chunk
+        if amt is None:
+            data,self.buffer = self.buffer,''
+        else:
+            data,self.buffer = self.buffer[:amt],self.buffer[amt:]
+        return data
+    
+    def _decode(self,chunk):
+        try:
+            return self.decoder.decompress(chunk)
+        except zlib.error:
+            #a bad header on the first chunk is taken as raw deflate, anything else is corrupt
+            if self.raw or self.started: raise
+            self.raw = True
+            self.decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.decoder.decompress(chunk)
+        finally:
+            self.started = True
+    
+    def getcode(self):
+        return self.resp.status
+    
+    def info(self):
+        return self.resp.msg
+    
+    def geturl(self):
+        return self.url
+    
+    def close(self):
+        if self.conn is None: return
+        #only a response read to the end leaves the connection ready for the next request
+        if self.resp.isclosed() and not self.resp.will_close:
+            self.transport.release(self.key,self.conn)
+        else:
+            self.resp.close()
+            self.conn.close()
+        self.conn = None
+        
+        
 class DirectDownload(object):
+    '''Streams a layer request to a file in a temporary directory unique to this run. The response is requested gzipped and
+    stored as received for reading through /vsigzip/. Dropped connections are resumed with a Range request where the server 
+    allows it and progress is logged as the file is written'''
+    CHUNK_SIZE = 1024*1024
+    MAX_RESUMES = 5
+    #seconds between progress messages
+    PROGRESS_INTERVAL = 10
+    TEMP_DIR = None
     
-    def __init__(self,url,file):
+    def __init__(self,url,pxy=None,name='layer',suffix='.gml'):
         self.url = url
-        self.file = file
+        self.pxy = pxy
+        self.file = os.path.join(self.tempDir(),re.sub('[^\w\-]','_',str(name))+suffix)
+        #path to open the download with, set once downloaded
+        self.path = None
+        self.received = 0
+        
+    @classmethod
+    def tempDir(cls):
+        '''Per run download directory, removed at exit'''
+        if cls.TEMP_DIR is None:
+            cls.TEMP_DIR = tempfile.mkdtemp(prefix='lds_download_')
+            atexit.register(shutil.rmtree,cls.TEMP_DIR,True)
+        return cls.TEMP_DIR
         
     def download(self):
-        urllib.urlretrieve(self.url, self.file)
+        '''Downloads the url returning the path GDAL should open'''
+        transport = HTTPTransport.get(self.pxy)
+        self.received = 0
+        resumes = 0
+        etag,encoding,resumable = None,None,False
+        st = time.time()
+        while True:
+            req = Request(self.url,headers={'Accept-Encoding':'gzip'})
+            if self.received:
+                req.add_header('Range','bytes={}-'.format(self.received))
+                #If-Range returns the whole document if it has changed since the first request
+                if etag: req.add_header('If-Range',etag)
+            try:
+                with closing(transport.open(req)) as resp:
+                    if self.received and resp.getcode() != 206:
+                        ldslog.warn('Server ignored Range request, restarting download')
+                        self.received = 0
+                    if not self.received:
+                        info = resp.info()
+                        etag = info.getheader('ETag')
+                        encoding = info.getheader('Content-Encoding')
+                        resumable = info.getheader('Accept-Ranges') == 'bytes'
+                    length = resp.info().getheader('Content-Length')
+                    expected = self.received+int(length) if length else None
+                    self._write(resp,st)
+                if expected and self.received < expected:
+                    raise httplib.IncompleteRead('{} of {} bytes'.format(self.received,expected))
+                break
+            except HTTPError:
+                #a server error response isn't a dropped connection, leave any retry to the caller
+                raise
+            except (URLError, socket.error, httplib.HTTPException) as e:
+                if resumes >= self.MAX_RESUMES:
+                    raise
+                resumes += 1
+                if not resumable: self.received = 0
+                ldslog.warn('Download interrupted at {} bytes, {} attempt {}/{}. {}'.format(self.received,'resuming' if resumable else 'restarting',resumes,self.MAX_RESUMES,e))
+        
+        self._progress(st,'Downloaded')
+        self.path = '/vsigzip/'+self.file if encoding == 'gzip' else self.file
+        if encoding == 'gzip': HTTPTransport.count(0,self.decodedSize())
+        return self.path
+    
+    def decodedSize(self):
+        '''Uncompressed size of a gzip download from its trailer (modulo 4GB)'''
+        with open(self.file,'rb') as gz:
+            gz.seek(-4,os.SEEK_END)
+            return struct.unpack('<I',gz.read(4))[0]
+    
+    def _write(self,resp,st):
+        last = time.time()
+        with open(self.file,'ab' if self.received else 'wb') as out:
+            for chunk in iter(lambda: resp.read(self.CHUNK_SIZE),''):
+                out.write(chunk)
+                self.received += len(chunk)
+                if time.time()-last > self.PROGRESS_INTERVAL:
+                    self._progress(st,'Downloading')
+                    last = time.time()
+                
+    def _progress(self,st,msg):
+        el = max(time.time()-st,0.001)
+        ldslog.info('{} {:.1f}MB at {:.2f}MB/s'.format(msg,self.received/1048576.0,self.received/1048576.0/el))
+        
+    def remove(self):
+        if os.path.exists(self.file): os.remove(self.file)
+        
+        
+class PageFetcher(object):
+    '''Downloads the pages of a layer request on a pool of threads, keeping up to 'concurrency' pages in flight, and returns the 
+    downloaded files in page order. Each page is retried on its own so one failed request doesn't restart the whole layer. With a 
+    PageCache, pages are kept for the rest of the layer and any fetched by an earlier attempt are read from it'''
+    MAX_ATTEMPTS = 4
+    #seconds before the first retry of a page, doubled for each further attempt
+    RETRY_DELAY = 5
+    
+    def __init__(self,pages,pxy,concurrency,size,name='layer',sizer=None,suffix='.gml',cache=None):
+        '''pages is an iterable of (offset,count,url) tuples, it may be open ended if the page count isn't known. Only the first 
+        page is taken from it until that page has been returned. Page latencies and server timeouts are reported to the sizer if 
+        there is one'''
+        self.pages = enumerate(pages)
+        self.pxy = pxy
+        self.name = name
+        self.suffix = suffix
+        self.size = size
+        self.sizer = sizer
+        self.cache = cache
+        self.concurrency = concurrency
+        self.pool = ThreadPool(concurrency)
+        self.pending = deque()
+        self.current = None
+        self.fill(1)
+        
+    def fill(self,limit):
+        while len(self.pending) < limit:
+            try:
+                pno,(offset,count,url) = next(self.pages)
+            except StopIteration:
+                break
+            dl = DirectDownload(url,self.pxy,'{}_p{}'.format(self.name,pno),self.suffix)
+            self.pending.append((dl,count,self.pool.apply_async(self._fetchPage,(dl,pno,offset,count))))
+        
+    def next(self,lastkey=None):
+        '''Returns the path of the next page in order, None once all pages have been read. The previous page file is removed 
+        unless it has been cached'''
+        #the first page is fetched on its own, the pages following it may only be known once it has been read
+        self.fill(1 if self.current is None else self.concurrency+1)
+        if self.current: self.current.remove()
+        if not self.pending:
+            self.current = None
+            return None
+        self.current,self.size,result = self.pending.popleft()
+        return result.get()
+    
+    def pageSize(self):
+        '''Number of features requested in the page last returned'''
+        return self.size
+    
+    def stop(self):
+        '''Abandons any pages still being fetched and removes their files'''
+        self.pages = iter(())
+        self.pool.terminate()
+        self.pool.join()
+        for dl,_,_ in self.pending:
+            dl.remove()
+        self.pending.clear()
+        if self.current: self.current.remove()
+        self.current = None
+        
+    def _fetchPage(self,dl,pno,offset,count):
+        '''Returns the cached copy of a page if there is one, otherwise downloads the page into the cache'''
+        cached = self.cache.get(offset) if self.cache else None
+        if cached and cached[1] == count:
+            ldslog.debug('Page {} of {} read from cache'.format(pno,self.name))
+            return cached[0]
+        path = self._fetch(dl,pno)
+        return self.cache.put(offset,count,dl) if self.cache else path
+    
+    def _fetch(self,dl,pno):
+        '''Downloads a page retrying failed requests with a growing delay'''
+        attempt = 1
+        while True:
+            st = time.time()
+            try:
+                path = dl.download()
+                if self.sizer: self.sizer.success(1000*(time.time()-st))
+                return path
+            except (URLError, socket.error, httplib.HTTPException) as e:
+                if self.sizer and self._overloaded(e): self.sizer.failure()
+                if attempt >= self.MAX_ATTEMPTS:
+                    ldslog.error('Page {} of {} failed after {} attempts. {}'.format(pno,self.name,attempt,e))
+                    raise
+                delay = self.RETRY_DELAY*2**(attempt-1)
+                ldslog.warn('Page {} of {} failed, retrying in {}s. {}'.format(pno,self.name,delay,e))
+                time.sleep(delay)
+                attempt += 1
+                
+    def discard(self,path):
+        '''Drops a page that couldn't be read from the cache so a retry downloads it again'''
+        if self.cache: self.cache.discard(path)
+                
+    @staticmethod
+    def reason(e):
+        '''Describes a failed page request in the form GDAL reports HTTP errors, so the status is matched the same way'''
+        if isinstance(e,HTTPError):
+            return 'HTTP error code : {}. {}'.format(e.code,e.msg)
+        return '{}. {}'.format(type(e).__name__,getattr(e,'reason',None) or e)
+                
+    @staticmethod
+    def _overloaded(e):
+        '''Gateway errors and timeouts, i.e. the page took the server too long'''
+        if isinstance(e,HTTPError):
+            return e.code in (502,503,504)
+        return isinstance(e,socket.timeout) or isinstance(getattr(e,'reason',None),socket.timeout)
+
+
+class CapabilitiesCache(object):
+    '''On disk cache of a GetCapabilities document and the layer list parsed from it, keyed on a hash of the URL (which carries 
+    the WFS version and API key). Entries checked within the TTL are used without a request, older ones are revalidated with 
+    If-None-Match/If-Modified-Since and only downloaded again if the document has changed'''
+    CACHE_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__),'../cache/'))
+    #seconds
+    DEFAULT_TTL = 3600
+    
+    def __init__(self,url,pxy=None,ttl=None):
+        self.url = url
+        self.pxy = pxy
+        self.ttl = self.DEFAULT_TTL if ttl is None else ttl
+        if not os.path.exists(self.CACHE_DIR):
+            os.mkdir(self.CACHE_DIR)
+        name = os.path.join(self.CACHE_DIR,hashlib.sha1(str(url)).hexdigest())
+        self.docfile = name+'.xml'
+        self.metafile = name+'.meta'
+        self.meta = self._load()
+        
+    def document(self):
+        '''Path to a current copy of the capabilities document, fetching or revalidating it as needed'''
+        if self.meta and time.time()-self.meta['checked'] < self.ttl:
+            return self.docfile
+        req = Request(self.url)
+        if self.meta and self.meta['etag']: req.add_header('If-None-Match',self.meta['etag'])
+        if self.meta and self.meta['modified']: req.add_header('If-Modified-Since',self.meta['modified'])
+        st = time.time()
+        try:
+            with closing(HTTPTransport.get(self.pxy).open(req)) as resp:
+                info = resp.info()
+                with open(self.docfile+'.tmp','wb') as out:
+                    shutil.copyfileobj(resp,out,DirectDownload.CHUNK_SIZE)
+            self._replace(self.docfile+'.tmp',self.docfile)
+            self.meta = {'etag':info.getheader('ETag'),'modified':info.getheader('Last-Modified'),'layers':None}
+            ldslog.info('Fetched capabilities in {:.2f}s'.format(time.time()-st))
+        except HTTPError as he:
+            if he.code != 304 or not self.meta:
+                raise
+            ldslog.info('Capabilities unchanged, revalidated in {:.2f}s'.format(time.time()-st))
+        except (URLError, socket.error, httplib.HTTPException) as e:
+            if not self.meta:
+                raise
+            #left unchecked so the next call tries again
+            ldslog.warn('Cannot revalidate capabilities, using cached copy. '+str(e))
+            return self.docfile
+        self.meta['checked'] = time.time()
+        self._save()
+        return self.docfile
+    
+    def layers(self,parse):
+        '''The layer list parsed from the current document by parse(file). Parsed once per version of the document'''
+        path = self.document()
+        if self.meta['layers'] is None:
+            with open(path,'rb') as doc:
+                self.meta['layers'] = parse(doc)
+            self._save()
+        return self.meta['layers']
+    
+    def clear(self):
+        '''Discards the entry, e.g. if the document can't be parsed'''
+        for f in (self.docfile,self.metafile):
+            if os.path.exists(f): os.remove(f)
+        self.meta = None
+        
+    def _load(self):
+        try:
+            with open(self.metafile,'rb') as mf:
+                meta = cPickle.load(mf)
+            return meta if os.path.exists(self.docfile) else None
+        except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+            return None
+        
+    def _save(self):
+        with open(self.metafile+'.tmp','wb') as mf:
+            cPickle.dump(self.meta,mf,cPickle.HIGHEST_PROTOCOL)
+        self._replace(self.metafile+'.tmp',self.metafile)
+        
+    @staticmethod
+    def _replace(src,dst):
+        #rename doesn't overwrite on windows
+        if os.path.exists(dst): os.remove(dst)
+        os.rename(src,dst)
 
     
 class FileResolver(etree.Resolver):
@@ -667,7 +1163,7 @@ class ConfigInitialiser(object):
     '''Initialises configuration, for use at first run'''
 
     @staticmethod
-    def buildConfiguration(capsurl, wfs_ver,jorf, idp):
+    def buildConfiguration(capsurl, wfs_ver,jorf, idp, pxy=None):
         '''Given a destination DS use this to select an XSL transform object and generate an output document that will initialise a new config file/table'''
         #file name subst for testing
         #capsurl='http://data.linz.govt.nz/services;key=<api-key>/wfs?service=WFS&version=2.0.0&request=GetCapabilities'
@@ -682,7 +1178,8 @@ class ConfigInitialiser(object):
         jorfpart = 'json' if jorf else 'file'
         xslfile = os.path.join(os.path.dirname(__file__), '../conf/getcapabilities{}.{}.xsl'.format(wfspart,jorfpart))
         
-        xml = etree.parse(capsurl,parser)
+        #an init always revalidates the cached document, a conditional request if it hasn't changed
+        xml = etree.parse(CapabilitiesCache(capsurl,pxy,0).document(),parser)
         xsl = etree.parse(xslfile,parser)
         
         #this is a problem that seems to only affect eclipse, running from CL or the final bin is fine
@@ -774,23 +1271,239 @@ class ConfigInitialiser(object):
         
 
         
-class SUFIExtractor(object):
-    '''XSL parser to read big int columns returning a dict of id<->col matches'''
-    @staticmethod
-    def readURI(xml,colname):
-        p = os.path.join(os.path.dirname(__file__), '../conf/sufiselector.xsl')
-        with open(p,'r') as sufireader:
-            converter = sufireader.read()
-        xslt = etree.XML(converter.replace('#REPLACE',colname))
-        transform = etree.XSLT(xslt)
+class KeysetFetcher(PageFetcher):
+    '''Fetches the pages of a layer sorted on its primary key one after another, each page requesting the features following 
+    the last key read from the one before. Unlike startIndex pages each costs the server the same however deep into the layer'''
+    
+    def __init__(self,pageuri,pxy,size,name='layer',sizer=None,suffix='.gml',cache=None):
+        '''pageuri returns the url of the page of 'count' features following a key. Pages are 'size' features or, if there is a 
+        sizer, whatever size it has reached when the page is requested. Cached pages keep the size they were fetched at'''
+        self.pageuri = pageuri
+        self.pxy = pxy
+        self.name = name
+        self.suffix = suffix
+        self.size = size
+        self.sizer = sizer
+        self.cache = cache
+        self.pno = 0
+        self.current = None
         
-        doc = etree.parse(StringIO(xml))
-        res = transform(doc)
+    def next(self,lastkey=None):
+        if self.current: self.current.remove()
+        self.current = None
+        self.pno += 1
+        cached = self.cache.get(lastkey) if self.cache else None
+        if cached:
+            ldslog.debug('Page {} of {} read from cache'.format(self.pno,self.name))
+            path,self.size = cached
+            return path
+        if self.sizer: self.size = self.sizer.size
+        self.current = DirectDownload(self.pageuri(lastkey,self.size),self.pxy,'{}_k{}'.format(self.name,self.pno),self.suffix)
+        path = self._fetch(self.current,self.pno)
+        return self.cache.put(lastkey,self.size,self.current) if self.cache else path
+    
+    def stop(self):
+        if self.current: self.current.remove()
+        self.current = None
+    
+    
+class PageCache(object):
+    '''On disk store of the pages fetched for a layer request, so a copy retried after an error replays the pages it has already 
+    read instead of downloading them again. Pages are keyed on their offset, the startIndex or the last key they follow, and kept 
+    with the number of features requested. The store is in the run's download directory and is purged once the layer is done'''
+    
+    def __init__(self,request,name='layer'):
+        self.request = request
+        self.dir = tempfile.mkdtemp(prefix=re.sub('[^\w\-]','_',str(name))+'_pages_',dir=DirectDownload.tempDir())
+        self.pages = {}
+        self.files = 0
+        self.lock = threading.Lock()
+        
+    def get(self,offset):
+        '''(path,count) of a cached page or None'''
+        return self.pages.get(str(offset))
+    
+    def put(self,offset,count,dl):
+        '''Moves a downloaded page into the cache returning the path to open it with'''
+        with self.lock:
+            self.files += 1
+            cached = os.path.join(self.dir,'{}{}'.format(self.files,os.path.splitext(dl.file)[1]))
+            os.rename(dl.file,cached)
+            path = dl.path.replace(dl.file,cached)
+            self.pages[str(offset)] = (path,count)
+        return path
+        
+    def discard(self,path):
+        '''Removes a cached page by the path it was returned with'''
+        with self.lock:
+            for offset,(cached,_) in self.pages.items():
+                if cached == path:
+                    del self.pages[offset]
+                    os.remove(cached[len('/vsigzip/'):] if cached.startswith('/vsigzip/') else cached)
         
-        sufi = ast.literal_eval(str(res))
-        #ldslog.debug(sufi)
+    def purge(self):
+        shutil.rmtree(self.dir,True)
+        self.pages = {}
+    
+
+class GeoJSONStream(object):
+    '''Incremental reader of the features of a GeoJSON FeatureCollection. The document is read in chunks and each member of the 
+    features array is decoded once it has been read in full, so only the feature being decoded is held rather than the whole 
+    page. Gzipped downloads are read through the /vsigzip/ path DirectDownload returns for them'''
+    CHUNK_SIZE = 256*1024
+    #bytes at the end of a document searched for the members following the features array
+    TAIL_SIZE = 64*1024
+    FEATURES = re.compile('"features"\s*:\s*\[')
+    SEPARATOR = re.compile('[\s,]*')
+    MEMBERS = {'crs':re.compile('"crs"\s*:\s*\{[^}]*?"name"\s*:\s*"([^"]+)"'),
+               'numberMatched':re.compile('"numberMatched"\s*:\s*(\d+)'),
+               'totalFeatures':re.compile('"totalFeatures"\s*:\s*(\d+)')}
+    
+    def __init__(self,path):
+        self.path = path
+        self.file = gzip.open(path[len('/vsigzip/'):],'rb') if path.startswith('/vsigzip/') else open(path,'rb')
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        #anything other than a feature collection, e.g. an exception report, fails here rather than part way through
+        match = None
+        while match is None:
+            if not self._more():
+                self.close()
+                raise ValueError('No features array in {}'.format(path))
+            match = self.FEATURES.search(self.buffer)
+        self.pos = match.end()
         
-        return sufi
+    def __iter__(self):
+        return self
+    
+    def next(self):
+        size = self.CHUNK_SIZE
+        while True:
+            self.pos = self.SEPARATOR.match(self.buffer,self.pos).end()
+            if self.pos < len(self.buffer):
+                if self.buffer[self.pos] == ']':
+                    self.close()
+                    raise StopIteration
+                try:
+                    feat,self.pos = self.decoder.raw_decode(self.buffer,self.pos)
+                    return feat
+                except ValueError:
+                    #the feature runs past the end of the buffer, unless there's nothing left to read
+                    if self.eof: raise
+            if not self._more(size):
+                raise ValueError('Truncated features array in {}'.format(self.path))
+            #features bigger than a chunk are retried with twice as much more each time
+            size *= 2
+    
+    @classmethod
+    def readMembers(cls,path):
+        '''{member:value} of the members servers write after the features array, the crs name and the count of the whole request 
+        (numberMatched or GeoServer's totalFeatures), found in the end of the document. The last match is taken as a feature 
+        property of the same name comes before them. A gzipped page is read through to its end'''
+        if path.startswith('/vsigzip/'):
+            tail = ''
+            with closing(gzip.open(path[len('/vsigzip/'):],'rb')) as doc:
+                for chunk in iter(lambda: doc.read(cls.CHUNK_SIZE),''):
+                    tail = (tail+chunk)[-cls.TAIL_SIZE:]
+        else:
+            with open(path,'rb') as doc:
+                doc.seek(0,os.SEEK_END)
+                doc.seek(max(0,doc.tell()-cls.TAIL_SIZE))
+                tail = doc.read()
+        members = {}
+        for name,member in cls.MEMBERS.items():
+            found = member.findall(tail)
+            if found: members[name] = found[-1]
+        return members
+    
+    def _more(self,size=None):
+        '''Appends the next chunk of the file to the buffer, dropping whatever has been decoded. False at the end of the file'''
+        chunk = '' if self.eof else self.file.read(size or self.CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:]+chunk
+        self.pos = 0
+        return True
+        
+    def close(self):
+        self.file.close()
+        self.buffer = ''
+
+
+class SUFIExtractor(object):
+    '''Streaming reader of big int columns from a downloaded GML document, a page or a whole layer. Pairs of key<->{col:value} 
+    are parsed as they are looked up, reading forward through the document in the order GDAL reads its features so only those 
+    read ahead of the features being copied are held'''
+    FEATURE_TAGS = ('featureMember','member')
+    
+    def __init__(self,path,keycol,cols):
+        self.path = path
+        self.keycol = keycol
+        self.cols = cols
+        self.pairs = {}
+        #the last lookup is kept since a failed update is retried as a delete+insert of the same feature
+        self.last = (None,None)
+        self.reader = None
+        
+    def lookup(self,key):
+        '''Returns the {col:value} strings for a key, reading forward through the document until it is found'''
+        if key == self.last[0]:
+            return self.last[1]
+        if self.reader is None:
+            self.reader = self._read()
+        values = self.pairs.pop(key,None)
+        while values is None:
+            try:
+                k,v = next(self.reader)
+            except StopIteration:
+                raise KeyError('No 64bit values found for {}={}'.format(self.keycol,key))
+            if k == key:
+                values = v
+            else:
+                self.pairs[k] = v
+        self.last = (key,values)
+        return values
+    
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        self.pairs = {}
+            
+    def _read(self):
+        with closing(self.open(self.path)) as doc:
+            for pair in self.parse(doc,self.keycol,self.cols):
+                yield pair
+                
+    @staticmethod
+    def open(path):
+        '''Opens a download by the path DirectDownload returns for it'''
+        return gzip.open(path[len('/vsigzip/'):],'rb') if path.startswith('/vsigzip/') else open(path,'rb')
+    
+    @classmethod
+    def readPage(cls,path,keycol,cols):
+        '''{key:{col:value}} of a page, held only while the page is read'''
+        with closing(cls.open(path)) as doc:
+            return dict(cls.parse(doc,keycol,cols))
+                
+    @classmethod
+    def parse(cls,doc,keycol,cols):
+        '''Yields (key,{col:value}) for each feature in a GML document, clearing each feature once read'''
+        for _,elem in etree.iterparse(doc,events=('end',)):
+            if etree.QName(elem).localname not in cls.FEATURE_TAGS:
+                continue
+            values = {}
+            for feat in elem:
+                for field in feat:
+                    if isinstance(field.tag,basestring):
+                        values[etree.QName(field).localname] = field.text
+            yield values.get(keycol),dict((c,values.get(c)) for c in cols)
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
     
 class FeatureCounter(object):
     '''XSL parser to read big int columns returning a dict of id<->col matches'''
@@ -809,6 +1522,18 @@ class FeatureCounter(object):
         
         return fcval
     
+    #bytes at the start of a page searched for the attributes of its root element
+    HEAD_SIZE = 4096
+    MATCHED = re.compile('numberMatched="(\d+)"')
+    
+    @classmethod
+    def readMatched(cls,path):
+        '''Reads numberMatched (WFS 2.0) from the root element of a downloaded GML page, the count of the whole request. None if the 
+        server didn't count the features. The numberOfFeatures of WFS 1.x is the size of the page so isn't used'''
+        with closing(gzip.open(path[len('/vsigzip/'):],'rb') if path.startswith('/vsigzip/') else open(path,'rb')) as page:
+            match = cls.MATCHED.search(page.read(cls.HEAD_SIZE))
+        return int(match.group(1)) if match else None
+    
 class Encrypt(object):
     from lds.ReadConfig import MainFileReader
     ENC_PREFIX = "ENC:"
@@ -873,9 +1598,7 @@ def _readLDS(up,q):
     COPY OF LDSU.readLDS METHOD'''
     (u,p) = up
     ldslog.debug("_LDS URL {} using Proxy {}".format(u,p))
-    if LDSUtilities.isProxyValid(p): install_opener(build_opener(ProxyHandler(p)))
-    with closing(urlopen(u)) as lds:
-        q.put(lds.read())
+    q.put(LDSUtilities.readDocument(u,p))
        
 class Debugging(object):
     #simple decorator logging called func 
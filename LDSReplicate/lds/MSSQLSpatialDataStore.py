@@ -20,6 +20,7 @@ import re
 
 from lds.DataStore import DataStore, MalformedConnectionString
 from lds.LDSUtilities import LDSUtilities as LU, Encrypt
+from lds.ProjectionReference import Projection
 
 ldslog = LU.setupLogging()
 
@@ -40,6 +41,10 @@ class MSSQLSpatialDataStore(DataStore):
                       ogr.wkbMultiPolygon25D, ogr.wkbGeometryCollection25D)
     
     BBOX = {'XMIN':-180,'XMAX':180,'YMIN':-90,'YMAX':90}
+    
+    STAGED_APPLY = True
+    #Long IN lists degrade badly on SQL Server well before the batch size limit is reached
+    DELETE_CHUNK_SIZE = 1000
       
     def __init__(self,conn_str=None,user_config=None):
         '''
@@ -158,6 +163,19 @@ class MSSQLSpatialDataStore(DataStore):
                     raise
                 
 
+    def buildStagedApplySQL(self,table,stage,pkey,columns):
+        '''Builds a single MERGE statement applying a staged changeset'''
+        chg = '[{}]'.format(self.STAGE_CHANGE_COL)
+        dcols = ','.join(['[{}]'.format(d) for d,_ in columns])
+        scols = ','.join(['s.[{}]'.format(s) for _,s in columns])
+        setcols = ','.join(['t.[{}] = s.[{}]'.format(d,s) for d,s in columns if d != pkey])
+        
+        sql  = ["MERGE INTO {0} AS t USING {1} AS s ON t.[{2}] = s.[{2}] ".format(table,stage,pkey)
+                +"WHEN MATCHED AND s.{0} = 'delete' THEN DELETE ".format(chg)
+                +"WHEN MATCHED THEN UPDATE SET {0} ".format(setcols)
+                +"WHEN NOT MATCHED BY TARGET AND s.{0} <> 'delete' THEN INSERT ({1}) VALUES ({2});".format(chg,dcols,scols)]
+        return sql
+    
     def getConfigOptions(self):
         '''dataset creation not supported so no options'''
         local_opts = []
@@ -179,7 +197,8 @@ class MSSQLSpatialDataStore(DataStore):
             local_opts += ['SCHEMA='+schema]
             
         srid = self.layerconf.readLayerProperty(layer_id,'epsg')
-        if srid:
+        #only pass an SRID that resolves, the lookup is cached across layers
+        if srid and Projection.getSpatialReference(srid):
             local_opts += ['SRID='+srid]
         
         return super(MSSQLSpatialDataStore,self).getLayerOptions(layer_id) + local_opts
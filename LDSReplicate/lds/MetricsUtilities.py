@@ -0,0 +1,96 @@
+'''
+v.0.0.9
+
+LDSReplicate -  MetricsUtilities
+
+Copyright 2011 Crown copyright (c)
+Land Information New Zealand and the New Zealand Government.
+All rights reserved
+
+This program is released under the terms of the new BSD license. See the
+LICENSE file for more information.
+
+In memory operation counters and latency histograms, summarised to the timer log once per layer
+
+Created on 18/10/2026
+
+@author: agent
+'''
+
+import math
+import time
+
+from lds.LDSUtilities import LDSUtilities as LU
+
+timerlog = LU.setupLogging(lf='TIMER',ff=3)
+
+
+class LatencyHistogram(object):
+    '''Log scale latency histogram. Buckets grow by a factor of 2^(1/4) from 1 microsecond so percentiles are within about 20%'''
+    BASE = 2**0.25
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self,ms):
+        b = int(math.log(ms*1000,self.BASE)) if ms > 0.001 else 0
+        self.buckets[b] = self.buckets.get(b,0)+1
+        self.count += 1
+        self.total += ms
+        if ms > self.max: self.max = ms
+
+    def percentile(self,p):
+        '''Upper bound (ms) of the bucket containing the p'th percentile'''
+        if not self.count: return 0.0
+        rank = math.ceil(self.count*p/100.0)
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= rank:
+                return min(self.BASE**(b+1)/1000,self.max)
+        return self.max
+
+
+class LayerMetrics(object):
+    '''Per layer counters and latency histograms for each copy operation. Records are in memory, a summary line per operation
+    is written to the timer log when the layer is flushed. Per operation trace lines are only written for 1 in 'sample' records'''
+    OPS = ('insert','update','delete','fetch','transform','commit')
+
+    def __init__(self,layer,sample=0):
+        self.layer = layer
+        self.sample = sample
+        #created up front so records from the reader thread never add keys
+        self.hist = dict((op,LatencyHistogram()) for op in self.OPS)
+
+    @staticmethod
+    def start():
+        return time.time()
+
+    def record(self,op,st,ref=None):
+        '''Records an operation started at st (from start()), ref is included in sampled trace lines'''
+        ms = 1000*(time.time()-st)
+        h = self.hist[op]
+        h.add(ms)
+        if self.sample and h.count % self.sample == 0:
+            timerlog.info('{},{}{}'.format(op.upper(),'' if ref is None else str(ref)+',',ms))
+        return ms
+
+    def summary(self,op):
+        '''(count, p50, p95, p99, max) for an operation, times in ms'''
+        h = self.hist[op]
+        return (h.count,h.percentile(50),h.percentile(95),h.percentile(99),h.max)
+
+    def mean(self,op):
+        '''Mean time (ms) of an operation'''
+        h = self.hist[op]
+        return h.total/h.count if h.count else 0.0
+
+    def flush(self):
+        '''Writes a summary line for each operation recorded and resets the histograms'''
+        for op in self.OPS:
+            if self.hist[op].count:
+                timerlog.info('SUMMARY,{},{},{},{:.3f},{:.3f},{:.3f},{:.3f}'.format(self.layer,op,*self.summary(op)))
+        self.hist = dict((op,LatencyHistogram()) for op in self.OPS)
@@ -42,6 +42,10 @@ class PostgreSQLDataStore(DataStore):
     
     SPATIAL_INDEX = 'ON'
     
+    STAGED_APPLY = True
+    #PG has no practical limit on IN list length, chunk to keep statements a manageable size
+    DELETE_CHUNK_SIZE = 5000
+    
     def __init__(self,conn_str=None,user_config=None):
         '''
         PostgreSQL DataStore constructor
@@ -166,6 +170,20 @@ class PostgreSQLDataStore(DataStore):
                     raise
         
         
+    def buildStagedApplySQL(self,table,stage,pkey,columns):
+        '''Builds the set based PG statements applying a staged changeset. Deletes, then updates, then inserts (including updates 
+        with no existing match). Anti-join used instead of ON CONFLICT since older layers may not have a unique pkey constraint'''
+        pk = '"{}"'.format(pkey)
+        chg = '"{}"'.format(self.STAGE_CHANGE_COL)
+        dcols = ','.join(['"{}"'.format(d) for d,_ in columns])
+        scols = ','.join(['s."{}"'.format(s) for _,s in columns])
+        setcols = ','.join(['"{}" = s."{}"'.format(d,s) for d,s in columns if d != pkey])
+        
+        sql  = ["DELETE FROM {0} t USING {1} s WHERE t.{2} = s.{2} AND s.{3} = 'delete'".format(table,stage,pk,chg)]
+        sql += ["UPDATE {0} t SET {4} FROM {1} s WHERE t.{2} = s.{2} AND s.{3} = 'update'".format(table,stage,pk,chg,setcols)]
+        sql += ["INSERT INTO {0} ({4}) SELECT {5} FROM {1} s WHERE s.{3} <> 'delete' AND NOT EXISTS (SELECT 1 FROM {0} t WHERE t.{2} = s.{2})".format(table,stage,pk,chg,dcols,scols)]
+        return sql
+        
     def checkGeoPrivileges(self,schema,user):
         #cmd1 = "select * from information_schema.role_table_grants where grantee='{}' and table_name='spatial_ref_sys".format(user)
 
@@ -17,7 +17,9 @@ Created on 17/08/2012
 @author: jramsay
 '''
 import osr
+import ogr
 import logging
+import threading
 
 from urllib2 import urlopen, build_opener, install_opener, ProxyHandler
 from contextlib import closing
@@ -31,6 +33,12 @@ class Projection(object):
     Utility Class performing common projection/spatial functions 
     '''
     EPSG = {}
+    
+    #process wide SRS cache, shared across layers. Cached SRS objects are shared so must not be modified by callers
+    SRS_CACHE = {}
+    CACHE_LOCK = threading.Lock()
+    #transformations aren't safe to use from more than one thread at a time so each layer worker thread builds its own
+    THREAD_TRANSFORMS = threading.local()
 
     '''EPSG Projection 2193 - NZGD2000 / New Zealand Transverse Mercator 2000'''
     EPSG[(2193,'ogc')] = 'PROJCS["NZGD2000 / New Zealand Transverse Mercator 2000",GEOGCS["NZGD2000",DATUM["New_Zealand_Geodetic_Datum_2000",SPHEROID["GRS 1980",6378137,298.257222101,AUTHORITY["EPSG","7019"]],TOWGS84[0,0,0,0,0,0,0],AUTHORITY["EPSG","6167"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.01745329251994328,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4167"]],UNIT["metre",1,AUTHORITY["EPSG","9001"]],PROJECTION["Transverse_Mercator"],PARAMETER["latitude_of_origin",0],PARAMETER["central_meridian",173],PARAMETER["scale_factor",0.9996],PARAMETER["false_easting",1600000],PARAMETER["false_northing",10000000],AUTHORITY["EPSG","2193"],AXIS["Easting",EAST],AXIS["Northing",NORTH]]'
@@ -60,13 +68,16 @@ class Projection(object):
 #            27200:cls.EPSG[27200]['esri']
 #        }.get(pid,cls.getDefaultProjection())
         
-    @staticmethod
-    def getDefaultSpatialRef():
+    @classmethod
+    def getDefaultSpatialRef(cls):
         '''Fallback Spatial Ref for LDS data sets. Probably not be appropriate in all cases'''
-        srs = osr.SpatialReference()
-        srs.SetGeogCS("GCS_NZGD_2000","D_NZGD_2000","GRS_1980",6378137.0,298.257222101,"Greenwich",0.0,"Degree",0.0174532925199433)
-        srs.SetAuthority("GEOGCS","EPSG",4167)
-        return srs
+        with cls.CACHE_LOCK:
+            if 'default' not in cls.SRS_CACHE:
+                srs = osr.SpatialReference()
+                srs.SetGeogCS("GCS_NZGD_2000","D_NZGD_2000","GRS_1980",6378137.0,298.257222101,"Greenwich",0.0,"Degree",0.0174532925199433)
+                srs.SetAuthority("GEOGCS","EPSG",4167)
+                cls.SRS_CACHE['default'] = srs
+            return cls.SRS_CACHE['default']
     
     @staticmethod
     def modifyMorphedSpatialReference(sref):
@@ -96,6 +107,31 @@ class Projection(object):
     
     
     
+    @classmethod
+    def getSpatialReference(cls,epsg):
+        '''Cached validateEPSG, returns None for an invalid EPSG'''
+        key = str(epsg).strip()
+        with cls.CACHE_LOCK:
+            if key not in cls.SRS_CACHE:
+                cls.SRS_CACHE[key] = cls.validateEPSG(epsg)
+            return cls.SRS_CACHE[key]
+        
+    @classmethod
+    def getTransformation(cls,src_sref,epsg):
+        '''Cached target SRS and CoordinateTransformation from a source SRS to an EPSG. Keyed on the source WKT (and axis mapping) 
+        since layer SRS objects are new for every layer. Transformations are cached per thread. Returns (None,None) if the EPSG is invalid'''
+        dst_sref = cls.getSpatialReference(epsg)
+        if dst_sref is None or src_sref is None:
+            return dst_sref,None
+        strategy = src_sref.GetAxisMappingStrategy() if hasattr(src_sref,'GetAxisMappingStrategy') else None
+        key = (src_sref.ExportToWkt(),strategy,str(epsg).strip())
+        cache = getattr(cls.THREAD_TRANSFORMS,'cache',None)
+        if cache is None:
+            cache = cls.THREAD_TRANSFORMS.cache = {}
+        if key not in cache:
+            cache[key] = osr.CoordinateTransformation(src_sref,dst_sref)
+        return dst_sref,cache[key]
+    
     @staticmethod
     def validateEPSG(epsg):
         '''Returns a Spatial Reference privided a valid EPSG number'''
@@ -108,6 +144,21 @@ class Projection(object):
             srs = None
         return srs
     
+    @staticmethod
+    def transformWKB(transform,wkbs,iso=False):
+        '''Transforms a block of WKB geometries (None for no geometry) sending all their vertices through one TransformPoints call. 
+        Returns the transformed geometries as WKB, ISO WKB if iso is set'''
+        geoms = [ogr.CreateGeometryFromWkb(wkb) if wkb is not None else None for wkb in wkbs]
+        if not _transformPoints(transform,[g for g in geoms if g is not None]):
+            #a failed point leaves the block to be transformed a geometry at a time, as partialCloneFeature only OGR errors are fatal
+            geoms = [ogr.CreateGeometryFromWkb(wkb) if wkb is not None else None for wkb in wkbs]
+            for geom in geoms:
+                if geom is None: continue
+                try:
+                    geom.Transform(transform)
+                except RuntimeError as rer:
+                    if 'OGR Error' in str(rer): raise
+        return [(geom.ExportToIsoWkb() if iso else geom.ExportToWkb()) if geom is not None else None for geom in geoms]
         
         
 class Geometry(object):
@@ -133,4 +184,113 @@ class Geometry(object):
         '''TODO... remove this once MS bounding box statement tested'''
         return (cls.XMIN,cls.YMIN,cls.XMAX,cls.YMAX)
     
-    
\ No newline at end of file
+    
+class TransformPool(object):
+    '''Process pool reprojecting blocks of geometries as WKB. Each worker transforms a whole block per call so polygon heavy 
+    layers can be reprojected on more than one core without a round trip per geometry. The worker processes are forked once, 
+    by start(), before any replication threads exist, since a child forked from a threaded process can inherit locks held by 
+    threads it doesn't have. Blocks carry their SRS so the one pool serves every layer and layer worker'''
+    BLOCK_SIZE = 500
+    POOL = None
+    WORKERS = 0
+    POOL_LOCK = threading.Lock()
+    
+    def __init__(self,src_sref,dst_sref):
+        self.dst_sref = dst_sref
+        self.srs = (TransformPool.describeSRS(src_sref),TransformPool.describeSRS(dst_sref))
+        
+    @classmethod
+    def start(cls,workers):
+        '''Starts the process wide pool if it isn't already running. Returns False, leaving geometries to be transformed as 
+        they're copied, if other threads are already running'''
+        with cls.POOL_LOCK:
+            if cls.POOL is None:
+                if threading.active_count() > 1:
+                    ldslog.warn('{} threads running, transform workers not started'.format(threading.active_count()))
+                    return False
+                from multiprocessing import Pool
+                cls.POOL = Pool(workers)
+                cls.WORKERS = workers
+            return True
+        
+    @classmethod
+    def running(cls):
+        return cls.POOL is not None
+        
+    @classmethod
+    def stop(cls):
+        with cls.POOL_LOCK:
+            if cls.POOL is not None:
+                cls.POOL.close()
+                cls.POOL.join()
+                cls.POOL = None
+                cls.WORKERS = 0
+        
+    @staticmethod
+    def describeSRS(sref):
+        '''Picklable SRS description, the WKT plus the axis mapping since GDAL3 it isn't carried by the WKT'''
+        return (sref.ExportToWkt(),sref.GetAxisMappingStrategy() if hasattr(sref,'GetAxisMappingStrategy') else None)
+    
+    def getBlockSize(self):
+        '''Number of features to read ahead so every worker gets a full block'''
+        return self.BLOCK_SIZE*TransformPool.WORKERS
+        
+    def transformFeatures(self,feats):
+        '''Reprojects the geometries of a list of features in place'''
+        wkbs = [f.GetGeometryRef().ExportToWkb() if f.GetGeometryRef() else None for f in feats]
+        blocks = [wkbs[i:i+self.BLOCK_SIZE] for i in range(0,len(wkbs),self.BLOCK_SIZE)]
+        res = TransformPool.POOL.map(_transformWKBBlock,[self.srs+(b,) for b in blocks])
+        for f,wkb in zip(feats,[w for b in res for w in b]):
+            if wkb is not None:
+                geom = ogr.CreateGeometryFromWkb(wkb)
+                geom.AssignSpatialReference(self.dst_sref)
+                f.SetGeometryDirectly(geom)
+    
+    
+#per worker process transformations, built on first use
+_WORKER_TRANSFORMS = {}
+
+def _transformWKBBlock(args):
+    '''Pool worker transforming a block of WKB geometries. Module level so it can be pickled on win32'''
+    src,dst,wkbs = args
+    if (src,dst) not in _WORKER_TRANSFORMS:
+        srefs = []
+        for wkt,strategy in (src,dst):
+            sref = osr.SpatialReference()
+            sref.ImportFromWkt(wkt)
+            if strategy is not None: sref.SetAxisMappingStrategy(strategy)
+            srefs.append(sref)
+        _WORKER_TRANSFORMS[(src,dst)] = osr.CoordinateTransformation(*srefs)
+    return Projection.transformWKB(_WORKER_TRANSFORMS[(src,dst)],wkbs)
+
+def _transformPoints(transform,geoms):
+    '''Transforms the vertices of a block of geometries in a single TransformPoints call. Returns False, with the geometries 
+    left untouched, if any point couldn't be transformed'''
+    parts = [part for geom in geoms for part in _vertexParts(geom)]
+    points = [part.GetPoint(i) for part in parts for i in range(part.GetPointCount())]
+    if not points:
+        return True
+    try:
+        res = transform.TransformPoints(points)
+    except RuntimeError as rer:
+        if 'OGR Error' in str(rer): raise
+        return False
+    if any(abs(c) == float('inf') or c != c for p in res for c in p[:2]):
+        return False
+    res = iter(res)
+    for part in parts:
+        dim = part.GetCoordinateDimension()
+        for i in range(part.GetPointCount()):
+            x,y,z = next(res)[:3]
+            if dim == 2: part.SetPoint_2D(i,x,y)
+            else: part.SetPoint(i,x,y,z)
+    return True
+
+def _vertexParts(geom):
+    '''Yields the points, linestrings and rings of a geometry, the parts holding its vertices'''
+    if geom.GetGeometryCount():
+        for i in range(geom.GetGeometryCount()):
+            for part in _vertexParts(geom.GetGeometryRef(i)):
+                yield part
+    else:
+        yield geom
@@ -19,6 +19,7 @@ import os
 import re
 import json
 import ogr
+import threading
 import codecs
 
 #from ConfigParser import ConfigParser, NoSectionError, NoOptionError, ParsingError,  Error
@@ -1035,7 +1036,8 @@ class LayerDSReader(LayerReader):
             return plist
         else:
             feat = self.lcfname._findMatchingFeature(layer, 'id', pkey)
-            if feat is None:
+            #config tables built by earlier versions may not have the newer columns
+            if feat is None or feat.GetFieldIndex(field)<0:
                 return None
             prop = feat.GetField(field)
         return LU.recode(prop) if LU.assessNone(prop) else None#.encode('utf8')
@@ -1057,11 +1059,37 @@ class LayerDSReader(LayerReader):
             ldslog.error(e)
             
     def _setFeatureValue(self,layer,p,field,value):
+        if layer.GetLayerDefn().GetFieldIndex(field)<0:
+            layer.CreateField(ogr.FieldDefn(field,ogr.OFTString))
         feat = self.lcfname._findMatchingFeature(layer, 'id', p)###fname -> lcfname
         feat.SetField(field,LU.recode(value,uflag='encode'))
         layer.SetFeature(feat)
         #ldslog.debug("Check "+field+" for layer "+p+" is set to "+value+" : GetField="+feat.GetField(field))
 
+
+class SerialLayerReader(object):
+    '''
+    Layer config wrapper shared by concurrent layer workers. Reads and writes are serialised since the underlying 
+    file or DS (owned by the main destination) is not safe to use from more than one thread
+    '''
+    
+    def __init__(self,layerreader):
+        self.layerreader = layerreader
+        self.lock = threading.RLock()
+        
+    def __getattr__(self,name):
+        attr = getattr(self.layerreader,name)
+        if not callable(attr):
+            return attr
+        def serial(*args,**kwargs):
+            with self.lock:
+                return attr(*args,**kwargs)
+        return serial
+    
+    def getDS(self):
+        '''The config DS is not the worker's connection so checkpoints can't share its transaction'''
+        return False
+
                    
 class GUIPrefsReader(object):
     '''
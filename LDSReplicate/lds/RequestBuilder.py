@@ -49,9 +49,11 @@ class RequestBuilder(object):
     u = rb.sourceURI()
     '''
     
-    #LDS supports these formats but only GML is currently parsed
-    SUPPORTED_OUTPUT_GML_FORMATS = ('GML2','GML3','JSON')
+    #LDS also supports JSON but the WFS driver is only given GML, JSON is requested for pages (see DataStore.PAGE_FORMATS)
+    SUPPORTED_OUTPUT_GML_FORMATS = ('GML2','GML3')
     DEFAULT_OUTPUT_GML_FORMAT = 'GML2'
+    #GetFeature parameter limiting the number of features returned
+    COUNT_PARAM = 'maxFeatures'
 
 
     def __init__(self,params,conn_str=None):
@@ -60,6 +62,9 @@ class RequestBuilder(object):
         '''
         self.setParameters(params)
         self.conn_str = conn_str
+        #sort/start parameters, set by the LDS datastore when resuming a layer
+        self.pkey = None
+        self.pstart = None
         #if conn_str provided get key from the string
         if self.conn_str:
             self.key = self.extractAPIKey(self.conn_str,raise_err=False)
@@ -107,21 +112,53 @@ class RequestBuilder(object):
             raise MalformedConnectionString('Cannot parse API key')
         return srch.group(1) if srch else None
     
-    def _buildCQLStr(self):
+    def _buildCQLStr(self,pstart=None):
         '''Builds a cql_filter string as set by the user appending an 'id>...' partitioning string if needed. NB. Manual partitioning is accomplished using the parameters, 'maxFeatures' to set feature quantity, a page-by-page recorded 'id' value and a 'sortBy=id' argument'''
         cql = ()
         maxfeat = ""
+        pstart = self.pstart if pstart is None else pstart
         
-#         #if implementing pagination in cql      
-#         if self.pstart and self.psize:
-#             cql += (self.pkey+">"+str(self.pstart),)
-#             #sortBy used so last feature will have the new maximum key, saves a comparison
-#             maxfeat = "&sortBy="+self.pkey+"&maxFeatures="+str(self.psize)            
+        #sortBy used so the last feature committed has the maximum key and a resumed request can start after it
+        if self.pkey:
+            maxfeat += "&sortBy="+self.pkey
+            if LU.assessNone(pstart):
+                cql += (self.pkey+"%3E"+self._formatCQLValue(pstart),)
 
         if self.cql:
             cql += (LU.checkCQL(self.cql),)
 
-        return maxfeat+"&cql_filter="+';'.join(cql) if len(cql)>0 else ""   
+        if len(cql)>1:
+            cql = tuple('%28'+c+'%29' for c in cql)
+        return maxfeat+("&cql_filter="+'%20AND%20'.join(cql) if len(cql)>0 else "")
+    
+    def pageURI(self,uri,start,count):
+        '''Restricts a GetFeature request to the page of features from index 'start', replacing any paging already in the request'''
+        uri = re.sub('&(startIndex|count|maxFeatures)=\d+','',uri,flags=re.IGNORECASE)
+        return '{}&startIndex={}&{}={}'.format(uri,start,self.COUNT_PARAM,count)
+    
+    def keysetURI(self,uri,lastkey,count):
+        '''Replaces the cql/sort parameters of a request built by this RB with those for the page of 'count' features following 
+        'lastkey' in primary key order'''
+        cql = self._buildCQLStr()
+        if uri.endswith(cql): uri = uri[:len(uri)-len(cql)]
+        return '{}{}&{}={}'.format(uri,self._buildCQLStr(lastkey),self.COUNT_PARAM,count)
+    
+    @staticmethod
+    def formatURI(uri,fmt):
+        '''Replaces the outputFormat of a GetFeature request'''
+        return re.sub('outputFormat=[^&]*','outputFormat='+fmt,uri,flags=re.IGNORECASE)
+    
+    @staticmethod
+    def describeFeatureTypeURI(uri):
+        '''DescribeFeatureType request for the feature type of a GetFeature request. Used to type the fields of downloaded pages'''
+        base,query = uri.split('?',1)
+        keep = [q for q in query.split('&') if re.match('(service|version|typeNames?)=',q,flags=re.IGNORECASE)]
+        return base+'?'+'&'.join(keep+['request=DescribeFeatureType'])
+    
+    @staticmethod
+    def _formatCQLValue(val):
+        '''Quote non numeric values for use in a cql comparison'''
+        return str(val) if re.match('^-?\d+(\.\d+)?$',str(val)) else "%27"+str(val).replace("'","''")+"%27"
     
     
     def validateConnStr(self,cs):
@@ -205,6 +242,7 @@ class RequestBuilder(object):
 class RequestBuilderWFS200(RequestBuilder):
     
     WVER = '2.0.0'
+    COUNT_PARAM = 'count'
     
     def __init__(self,params,cs):
         super(RequestBuilderWFS200,self).__init__(params,cs)
@@ -44,6 +44,10 @@ class SpatiaLiteDataStore(DataStore):
     OGR_SQLITE_JOURNAL = 'WAL'
     
     DEFAULT_GCOL = 'GEOMETRY'
+    
+    STAGED_APPLY = True
+    #Keeps statements well inside the default SQLITE_MAX_SQL_LENGTH
+    DELETE_CHUNK_SIZE = 500
       
     def __init__(self,conn_str=None,user_config=None):
         '''
@@ -148,6 +152,16 @@ class SpatiaLiteDataStore(DataStore):
                 else:
                     raise
 
+    def buildStagedApplySQL(self,table,stage,pkey,columns):
+        '''Builds the SQLite statements applying a staged changeset. UPDATE..FROM isn't available in older SQLite so updates are a delete+insert'''
+        chg = '"{}"'.format(self.STAGE_CHANGE_COL)
+        dcols = ','.join(['"{}"'.format(d) for d,_ in columns])
+        scols = ','.join(['"{}"'.format(s) for _,s in columns])
+        
+        sql  = ["DELETE FROM {0} WHERE \"{2}\" IN (SELECT \"{2}\" FROM {1} WHERE {3} IN ('delete','update'))".format(table,stage,pkey,chg)]
+        sql += ["INSERT INTO {0} ({3}) SELECT {4} FROM {1} WHERE {2} <> 'delete'".format(table,stage,chg,dcols,scols)]
+        return sql
+
     def changeColumnIntToString(self,table,column):
         '''SQLite column type changer. Used to change 64 bit integer columns to string. Brutal converter that deletes and recreates layer table'''
         '''No longer needed but the method is useful so retained for reference''' 
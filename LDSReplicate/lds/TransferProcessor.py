@@ -16,21 +16,25 @@ Created on 26/07/2012
 '''
 
 import re
+import sys
 import gdal
+import Queue
+import threading
 #import pdb
 
 from datetime import datetime 
 
-from lds.DataStore import DataStore, DatasourceOpenException
+from lds.DataStore import DataStore, DatasourceOpenException, PageSizeController
 from lds.LDSDataStore import LDSDataStore
+from lds.ProjectionReference import TransformPool
 #from lds.FileGDBDataStore import FileGDBDataStore
 #from lds.PostgreSQLDataStore import PostgreSQLDataStore
 #from lds.MSSQLSpatialDataStore import MSSQLSpatialDataStore
 #from lds.SpatiaLiteDataStore import SpatiaLiteDataStore
 from lds.ConfigConnector import ConfigConnector
 
-from lds.LDSUtilities import LDSUtilities as LU, ConfigInitialiser
-from lds.ReadConfig import LayerFileReader, LayerDSReader
+from lds.LDSUtilities import LDSUtilities as LU, ConfigInitialiser, HTTPTransport
+from lds.ReadConfig import LayerFileReader, LayerDSReader, SerialLayerReader
 from __builtin__ import classmethod
 
 ldslog = LU.setupLogging()
@@ -85,10 +89,13 @@ class TransferProcessor(object):
         self.partitionsize = None
         self.sixtyfourlayers = None
         self.prefetchsize = None
+        self.commitinterval = None
         
         self.layer = None
         self.layer_total = 0
         self.layer_count = 0
+        self.count_lock = threading.Lock()
+        self.jobs = 1
         
         #only do a config file rebuild if requested
         self.clearInitConfig()
@@ -168,6 +175,12 @@ class TransferProcessor(object):
     def getLayerGroupValue(self):
         return self.lgval
         
+    def setJobs(self,jobs):
+        self.jobs = max(int(jobs),1)
+        
+    def getJobs(self):
+        return self.jobs
+        
     def setEPSG(self,ep):
         self.epsg = LU.assessNone(ep)
         
@@ -203,13 +216,22 @@ class TransferProcessor(object):
             return True
         return False
     
+    def getPartition(self,testlayer):
+        '''Pre check of named layers to see if they should be read in primary key ordered pages of 'partitionsize' features'''
+        lid = re.search('(\d+)$',testlayer)
+        return bool(lid and self.partitionlayers) and lid.group(1) in [re.sub('\D','',p) for p in self.partitionlayers]
+    
     def doSRSConvert(self):
         '''Pre check of layer to see if an SRS conversion has been requested. NB Any entry here assumes conversion is needed, doesn't check against existing SRS'''
         return False if self.dst.getSRS() is None else True
     
-    def hasPrimaryKey(self,pklayer):
+    def hasTransform(self):
+        '''Whether any selected layer will be reprojected, by a requested EPSG or one saved from an earlier copy'''
+        return self.doSRSConvert() or any(LU.assessNone(self.dst.getEPSGConversion(layer)) for layer in self.lnl)
+    
+    def hasPrimaryKey(self,pklayer,dst=None):
         '''Reads layer conf pkey identifier. If PK is None or something, use this to decide processing type i.e. no PK = driverCopy'''
-        return LU.assessNone(self.dst.getLayerConf().readLayerProperty(pklayer,'pkey'))
+        return LU.assessNone((dst or self.dst).getLayerConf().readLayerProperty(pklayer,'pkey'))
               
         
     def processLDS(self):
@@ -227,6 +249,7 @@ class TransferProcessor(object):
 
         self.dst.versionCheck()
         (self.sixtyfourlayers,self.partitionlayers,self.partitionsize,self.prefetchsize) = self.dst.confwrap.readDSParameters('Misc',{'idp':self.src.idp})
+        self.commitinterval = self.dst.confwrap.readDSProperty('Misc','commitinterval')
 
         if not self.dst.getLayerConf():
             self.dst.setLayerConf(TransferProcessor.getNewLayerConf(self.dst))        
@@ -240,7 +263,7 @@ class TransferProcessor(object):
         #------------------------------------------------------------------------------------------
         #Valid layers are those that exist in LDS and are also configured in the LC
         self.readCapsDoc(self.src)
-        lds_valid = [i[0] for i in self.assembleLayerList(intersect=True)]
+        lds_valid = set(i[0] for i in self.assembleLayerList(intersect=True))
         #if layer provided, check that layer is in valid list
         #else if group then intersect valid and group members
         lgid = self.idLayerOrGroup(self.lgval)
@@ -281,83 +304,187 @@ class TransferProcessor(object):
         td = LU.checkDateFormat(self.todate)
         self.layer_total = len(self.lnl)
         self.layer_count = 0
-        for each_layer in self.lnl:
-            ldslog.debug('BENCHMARK '+each_layer)
-            lm = LU.checkDateFormat(self.dst.getLastModified(each_layer))
-            srs = self.dst.getEPSGConversion(each_layer)
-            pk = self.hasPrimaryKey(each_layer)
-            filt = self.dst.getLayerConf().readLayerProperty(each_layer,'cql')
-            #Set (cql) filters in URI call using layer picking the one with highest precedence            
-            self.src.setFilter(LU.precedence(self.cql,self.dst.getFilter(),filt))
-        
-            #SRS are set in the DST since the conversion takes place during the write process. Needed here to trigger bypass to featureCopy 
-            #print 'tp.epsg=',self.epsg,'srs=',srs,'!getsrs=',self.dst.getSRS()
-            self.dst.setSRS(LU.precedence(self.epsg,srs,None))
-
-            #Destination URI won't change because of incremental so set it here
-            self.dst.setURI(self.dst.destinationURI(each_layer))
-            #RB dst (not implemented)
-            #self.dst.setURI(self.dst.requestbuilder.destinationURI(each_layer))
-                
-            #if PK is none do paging since page index uses pk (can't lookup matching FIDs for updates/deletes?)
-            if pk:
-                gdal.SetConfigOption('OGR_WFS_PAGING_ALLOWED','ON')
+        HTTPTransport.resetCounters()
+        #transform workers are forked before any fetch, reader or layer worker threads are started, and only if a layer is reprojected
+        workers = self.dst.getTransformWorkers()
+        if workers and LU.getRuntimeEnvironment() != 'QGIS' and self.hasTransform():
+            TransformPool.start(workers)
+        try:
+            jobs = self.concurrentJobs()
+            if jobs > 1:
+                self.processConcurrent(jobs,fd,td)
             else:
-                gdal.SetConfigOption('OGR_WFS_PAGING_ALLOWED','OFF')
-                
-            #check dates -> check incr read -> incr or non
-
-            nonincr = False          
-            if any(i for i in [lm, fd, td]) and pk:
-                ldslog.debug('lm={}, fd={}, td={}'.format(lm,fd,td))
-                final_fd = (DataStore.EARLIEST_INIT_DATE if lm is None else lm) if fd is None else fd
-                final_td = self.dst.getCurrent() if td is None else td
-          
-                if (datetime.strptime(final_td,'%Y-%m-%dT%H:%M:%S')-datetime.strptime(final_fd,'%Y-%m-%dT%H:%M:%S')).days>0:
-                    #self.src.setURI(self.src.sourceURIIncremental(each_layer,final_fd,final_td))
-                    #RB srci
-                    self.src.setURI(self.src.requestbuilder.sourceURIIncremental(each_layer,final_fd,final_td))
-                    if self.readLayer():
-                        self.dst.setIncremental()    
-                        self.dst.setPrefetchSize(self.prefetchsize)
-                        ldslog.info('Layer='+str(each_layer)+' lastmodified='+str(final_td))
-                        ldslog.info('Layer='+str(each_layer)+' epsg='+str(self.dst.getSRS()))
-                        self.dst.write(self.src, self.dst.getURI(), each_layer, self.getSixtyFour(each_layer))
-                        #----------------------------------------------------------
-                        #self.dst.getLayerConf().writeLayerProperty(each_layer,'lastmodified',final_td)
-                        #self.dst.getLayerConf().writeLayerProperty(each_layer,'epsg',self.dst.getSRS())
-                        self.dst.setLastModified(each_layer,final_td)
-                        self.dst.saveEPSGConversion(each_layer,self.dst.getSRS())
-                    else:
-                        ldslog.warn('Incremental Read failed. Switching to Non-Incremental')
-                        nonincr = True
+                for each_layer in self.lnl:
+                    if self.processLayer(each_layer,self.src,self.dst,fd,td):
+                        self.layer_count += 1
+        finally:
+            TransformPool.stop()
+        ldslog.info(HTTPTransport.summary())
+
+        #self.closeConnections()
+        
+    def processLayer(self,each_layer,src,dst,fd,td):
+        '''Replicate a single layer from src to dst. Returns False if the layer didn't need updating'''
+        ldslog.debug('BENCHMARK '+each_layer)
+        lm = LU.checkDateFormat(dst.getLastModified(each_layer))
+        srs = dst.getEPSGConversion(each_layer)
+        pk = self.hasPrimaryKey(each_layer,dst)
+        filt = dst.getLayerConf().readLayerProperty(each_layer,'cql')
+        #Set (cql) filters in URI call using layer picking the one with highest precedence            
+        src.setFilter(LU.precedence(self.cql,dst.getFilter(),filt))
+        #sort and start parameters are only set for resumable full copies and concurrently fetched pages
+        src.setPrimaryKey(None)
+        src.clearResumePoint()
+        #JSON is only read from the pages fetched after the WFS driver has read the first
+        paged = dst.getPageConcurrency(each_layer) > 1 or dst.getPageFormat(each_layer,src.fmt) == 'JSON'
+        #partition layers are read in pages following the last key read, fetched pages must be cut from the same order
+        partition = bool(pk) and self.getPartition(each_layer)
+        src.setKeyset(partition,self.partitionsize)
+        if (paged or partition) and pk:
+            src.setPrimaryKey(pk)
+        #start from the page size learned on previous runs, adjusted as pages are read
+        src.setPartitionSize(None)
+        size = dst.getPageSize(each_layer) or (src.getKeysetSize() if partition else src.OGR_WFS_PAGE_SIZE)
+        src.setPageSizer(PageSizeController(size,dst.getPageLatency()))
+    
+        #SRS are set in the DST since the conversion takes place during the write process. Needed here to trigger bypass to featureCopy 
+        #print 'tp.epsg=',self.epsg,'srs=',srs,'!getsrs=',dst.getSRS()
+        dst.setSRS(LU.precedence(self.epsg,srs,None))
+
+        #Destination URI won't change because of incremental so set it here
+        dst.setURI(dst.destinationURI(each_layer))
+        #RB dst (not implemented)
+        #dst.setURI(dst.requestbuilder.destinationURI(each_layer))
+            
+        #if PK is none do paging since page index uses pk (can't lookup matching FIDs for updates/deletes?)
+        #concurrent paging also needs it so the WFS driver only reads the first page
+        #GDAL config is process wide, layer workers only set it for their own thread 
+        setOption = gdal.SetConfigOption if dst is self.dst else gdal.SetThreadLocalConfigOption
+        if pk or paged or partition:
+            setOption('OGR_WFS_PAGING_ALLOWED','ON')
+        else:
+            setOption('OGR_WFS_PAGING_ALLOWED','OFF')
+            
+        #check dates -> check incr read -> incr or non
+
+        nonincr = False          
+        #an interrupted full copy is finished before any incremental updates are applied to it
+        if self.commitinterval and dst.getCheckpoint(each_layer):
+            ldslog.info('Layer={} has an unfinished full copy'.format(each_layer))
+            nonincr = True
+        elif any(i for i in [lm, fd, td]) and pk:
+            ldslog.debug('lm={}, fd={}, td={}'.format(lm,fd,td))
+            final_fd = (DataStore.EARLIEST_INIT_DATE if lm is None else lm) if fd is None else fd
+            final_td = dst.getCurrent() if td is None else td
+      
+            if (datetime.strptime(final_td,'%Y-%m-%dT%H:%M:%S')-datetime.strptime(final_fd,'%Y-%m-%dT%H:%M:%S')).days>0:
+                #src.setURI(src.sourceURIIncremental(each_layer,final_fd,final_td))
+                #RB srci
+                src.setURI(src.requestbuilder.sourceURIIncremental(each_layer,final_fd,final_td))
+                if self.readLayer(src):
+                    dst.setIncremental()    
+                    dst.setPrefetchSize(self.prefetchsize)
+                    ldslog.info('Layer='+str(each_layer)+' lastmodified='+str(final_td))
+                    ldslog.info('Layer='+str(each_layer)+' epsg='+str(dst.getSRS()))
+                    dst.write(src, dst.getURI(), each_layer, self.getSixtyFour(each_layer))
+                    #----------------------------------------------------------
+                    #dst.getLayerConf().writeLayerProperty(each_layer,'lastmodified',final_td)
+                    #dst.getLayerConf().writeLayerProperty(each_layer,'epsg',dst.getSRS())
+                    dst.setLastModified(each_layer,final_td)
+                    dst.saveEPSGConversion(each_layer,dst.getSRS())
                 else:
-                    ldslog.warning("No update required for layer "+each_layer+" since [start:"+final_fd+" >= finish:"+final_td+"] by at least 1 day")
-                    continue
+                    ldslog.warn('Incremental Read failed. Switching to Non-Incremental')
+                    nonincr = True
             else:
-                nonincr = True
-            #--------------------------------------------------    
-            if nonincr:                
-                #self.src.setURI(self.src.sourceURI(each_layer))
-                #RB src
-                self.src.setURI(self.src.requestbuilder.sourceURI(each_layer))
-                if self.readLayer():
-                    self.dst.clearIncremental()
-                    self.cleanLayer(each_layer,truncate=True)
-                    ldslog.info('Cleaning Layer={} epsg={}'.format(each_layer,self.dst.getSRS()))
-                    self.dst.write(self.src, self.dst.getURI(), each_layer, self.getSixtyFour(each_layer))
-                    #since no date provided defaults to current 
-                    #self.dst.getLayerConf().writeLayerProperty(each_layer,'epsg',self.dst.getSRS())
-                    self.dst.setLastModified(each_layer)
-                    self.dst.saveEPSGConversion(each_layer,self.dst.getSRS())
+                ldslog.warning("No update required for layer "+each_layer+" since [start:"+final_fd+" >= finish:"+final_td+"] by at least 1 day")
+                return False
+        else:
+            nonincr = True
+        #--------------------------------------------------    
+        if nonincr:                
+            #chunked commits need a source that can be re-requested from a checkpoint, not possible with a user supplied URI
+            dst.setCommitInterval(None if src.conn_str else self.commitinterval)
+            checkpoint = None
+            if dst.getCommitInterval():
+                src.setPrimaryKey(pk)
+                checkpoint = dst.getCheckpoint(each_layer)
+                if checkpoint and not src.setResumePoint(checkpoint):
+                    ldslog.warning('Checkpoint {} has no key to resume from, restarting layer {}'.format(checkpoint,each_layer))
+                    dst.clearCheckpoint(each_layer)
+                    checkpoint = None
+            #src.setURI(src.sourceURI(each_layer))
+            #RB src
+            src.setURI(src.requestbuilder.sourceURI(each_layer))
+            if self.readLayer(src):
+                dst.clearIncremental()
+                if checkpoint:
+                    ldslog.info('Resuming Layer={} from checkpoint {}'.format(each_layer,checkpoint))
                 else:
-                    ldslog.warn('Non-Incremental Read failed')
-                    raise DatasourceInitialisationException('Unable to read from data source with URI '+self.src.getURI())
-                
-            self.layer_count += 1
-            self.dst.src_feat_count = 0
-
-        #self.closeConnections()
+                    self.cleanLayer(each_layer,truncate=True,dst=dst)
+                    ldslog.info('Cleaning Layer={} epsg={}'.format(each_layer,dst.getSRS()))
+                dst.write(src, dst.getURI(), each_layer, self.getSixtyFour(each_layer))
+                #since no date provided defaults to current 
+                #dst.getLayerConf().writeLayerProperty(each_layer,'epsg',dst.getSRS())
+                dst.setLastModified(each_layer)
+                dst.saveEPSGConversion(each_layer,dst.getSRS())
+            else:
+                ldslog.warn('Non-Incremental Read failed')
+                raise DatasourceInitialisationException('Unable to read from data source with URI '+src.getURI())
+            
+        dst.src_feat_count = 0
+        return True
+    
+    def concurrentJobs(self):
+        '''Number of layers to replicate at once. Layer workers need their own connections to the DST so single file 
+        destinations and user supplied source URIs are always processed one layer at a time'''
+        if self.jobs < 2 or len(self.lnl) < 2 or self.src.conn_str \
+        or self.dst.DRIVER_NAME not in (DataStore.DRIVER_NAMES['pg'],DataStore.DRIVER_NAMES['ms']):
+            return 1
+        #workers set their WFS paging and page size options per thread, without thread local options (GDAL < 2.0) they'd be shared
+        if not hasattr(gdal,'SetThreadLocalConfigOption'):
+            ldslog.warn('GDAL thread local config options not available, replicating one layer at a time')
+            return 1
+        return min(self.jobs,len(self.lnl))
+    
+    def processConcurrent(self,jobs,fd,td):
+        '''Replicate layers on 'jobs' worker threads. Each worker has its own SRC/DST so per layer DataStore state 
+        isn't shared, only the layer config is and access to that is serialised'''
+        layers = Queue.Queue()
+        for each_layer in self.lnl:
+            layers.put(each_layer)
+        layerconf = SerialLayerReader(self.dst.getLayerConf())
+        failed = []
+        workers = [threading.Thread(target=self.layerWorker,args=(layers,layerconf,fd,td,failed),name='{}-{}'.format(self.name,w)) 
+                   for w in range(jobs)]
+        ldslog.info('Replicating {} layers with {} workers'.format(self.layer_total,len(workers)))
+        for w in workers: w.start()
+        for w in workers: w.join()
+        if failed:
+            exc_info = failed[0]
+            raise exc_info[0], exc_info[1], exc_info[2]
+        
+    def layerWorker(self,layers,layerconf,fd,td,failed):
+        '''Take layers off the queue until it is empty or any worker has failed'''
+        src = self.src.clone()
+        dst = self.dst.clone()
+        try:
+            dst.setDS(dst.initDS(dst.destinationURI(None)))
+            dst.setLayerConf(layerconf)
+            while not failed:
+                try:
+                    each_layer = layers.get_nowait()
+                except Queue.Empty:
+                    break
+                if self.processLayer(each_layer,src,dst,fd,td):
+                    with self.count_lock:
+                        self.layer_count += 1
+                        ldslog.info('Completed Layer={} ({}/{})'.format(each_layer,self.layer_count,self.layer_total))
+        except Exception:
+            ldslog.error('Layer worker {} failed'.format(threading.current_thread().name),exc_info=True)
+            failed.append(sys.exc_info())
+        finally:
+            dst.closeDS()
+            src.closeDS()
         
     def closeConnections(self):
         pass
@@ -369,7 +496,7 @@ class TransferProcessor(object):
     def readCapsDoc(self,src):
         '''Fetch, format and store the capabilities document'''
         if not hasattr(self,'lds_caps'):
-            self.lds_caps = LU.treeDecode(LDSDataStore.fetchLayerInfo(src.getCapabilities(),src.ver,src.pxy))
+            self.lds_caps = LU.treeDecode(LDSDataStore.fetchLayerInfo(src.getCapabilities(),src.ver,src.pxy,src.getCapsCacheTTL()))
         
     def readConfDoc(self,dst):
         '''Return a list of the LC names'''
@@ -380,27 +507,31 @@ class TransferProcessor(object):
         '''Match the capabilities layer list with the configured layer list'''
         if not hasattr(self,'lds_conf') or not self.lds_conf: self.readConfDoc(self.dst)
         if not hasattr(self,'lds_caps') or not self.lds_caps: self.readCapsDoc(self.src)
+        conf_names = set(j[0] for j in self.lds_conf)
         if intersect:
-            return [i for i in self.lds_caps if i[0] in [j[0] for j in self.lds_conf]]
+            return [i for i in self.lds_caps if i[0] in conf_names]
         else: #union
-            return list(self.lds_conf)+[i for i in self.lds_caps if i[0] not in [j[0] for j in self.lds_conf]]
+            return list(self.lds_conf)+[i for i in self.lds_caps if i[0] not in conf_names]
         
 
 #--------------------------------------------------------------------------------------------------
 
-    def readLayer(self):
+    def readLayer(self,src=None):
         '''Attempt a read of the configured layer'''
-        return self.src.read(self.src.getURI(),False)
+        src = src or self.src
+        return src.read(src.getURI(),False)
 
 #--------------------------------------------------------------------------------------------------
         
-    def cleanLayer(self,layer_i,truncate=False):
+    def cleanLayer(self,layer_i,truncate=False,dst=None):
         '''clean a selected layer (once the layer conf file has been established)'''
+        dst = dst or self.dst
         try:
-            dds = self.dst.getDS()
-            if self.dst._cleanLayerByRef(dds,layer_i,truncate):
-                self.dst.clearLastModified(layer_i)
-                self.dst.clearEPSGConversion(layer_i)
+            dds = dst.getDS()
+            if dst._cleanLayerByRef(dds,layer_i,truncate):
+                dst.clearLastModified(layer_i)
+                dst.clearEPSGConversion(layer_i)
+                dst.clearCheckpoint(layer_i)
             #self.dst.closeDS()#Open/close now controlled by DREG
         except DatasourceOpenException as dse:
             #if we can't clean it probably doesn't exist so continue with any replication jobs
@@ -414,7 +545,7 @@ class TransferProcessor(object):
     @classmethod
     def parseCapabilitiesDoc(cls,capabilitiesurl,wfs_ver,file_json,pxy,idp):
         '''Class method returning the capabilities doc as requested, in either JSON or CP format'''
-        return ConfigInitialiser.buildConfiguration(capabilitiesurl,wfs_ver,file_json,idp)
+        return ConfigInitialiser.buildConfiguration(capabilitiesurl,wfs_ver,file_json,idp,pxy)
             
     @classmethod
     def getLayerConf(cls,src,dst,initlc=False):
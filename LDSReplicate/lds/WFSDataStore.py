@@ -17,12 +17,15 @@ Created on 23/07/2012
 
 import os 
 import re
+import socket
 import urllib
+import httplib
 
+from urllib2 import URLError
 from abc import ABCMeta, abstractmethod
 
 from lds.DataStore import DataStore
-from lds.LDSUtilities import LDSUtilities, Encrypt
+from lds.LDSUtilities import LDSUtilities, Encrypt, ReadTimeoutException
 
 class WFSDataStore(DataStore):
     '''
@@ -32,6 +35,7 @@ class WFSDataStore(DataStore):
     __metaclass__ = ABCMeta
     
     DRIVER_NAME = "WFS"
+    CPL_CURL_GZIP = 'YES'
     PROXY_AUTH = ('BASIC','NTLM','DIGEST','ANY')    
     PROXY_TYPE = ('DIRECT','SYSTEM','USER_DEFINED')
     #PROXY_AUTH = ('BASIC','NTLM','GSSNEGOTIATE','ANY')    
@@ -97,7 +101,8 @@ class WFSDataStore(DataStore):
                 proxyconfigoptions += ['GDAL_PROXY_AUTH='+str(self.PP['AUTH'])]
                 #NB do we also need to set GDAL_HTTP_AUTH?   
             
-        return super(WFSDataStore,self).getConfigOptions()+proxyconfigoptions
+        #ask for compressed responses, curl decodes them
+        return super(WFSDataStore,self).getConfigOptions()+proxyconfigoptions+['CPL_CURL_GZIP='+str(self.CPL_CURL_GZIP)]
     
     def getLayerOptions(self,layer_id):
         '''Pass up getLayerOptions call'''
@@ -130,9 +135,11 @@ class WFSDataStore(DataStore):
     
     
     def testURL(self,url):
-        '''Connect to a URL using the configured proxy (using urlopen method)'''
-        return self.processExternal(LDSUtilities.readLDS, (url, self.pxy))
-        #return LDSUtilities.readDocument(url, self.pxy)
+        '''Connect to a URL using the configured proxy over the shared HTTP transport, the socket timeout bounds the read'''
+        try:
+            return LDSUtilities.readDocument(url, self.pxy)
+        except (URLError, socket.error, httplib.HTTPException) as e:
+            raise ReadTimeoutException(LDSUtilities.errorMessageTranslate(str(e)))
         
 
         
\ No newline at end of file
@@ -21,15 +21,58 @@ import os
 import sys
 import time
 import subprocess
+import shutil
+import re
+import tempfile
+import sqlite3
+import ogr
 
 sys.path.append('..')
 
-from lds.LDSUtilities import LDSUtilities
+from urllib2 import HTTPError
+
+from lds.LDSUtilities import LDSUtilities, PageCache, PageFetcher
 
 from lds.LDSDataStore import LDSDataStore
+from lds.DataStore import DataStore, LayerInfo, Checkpoint, PrefetchBuffer, PageSizeController, GeoJSONLayer, PagedSource, \
+    FeaturePipeline, CopyPlan, InaccessibleFeatureException, FeatureCopyException
+from lds.SpatiaLiteDataStore import SpatiaLiteDataStore
+from lds.MetricsUtilities import LatencyHistogram, LayerMetrics
 
 testlog = LDSUtilities.setupLogging(ff=2)
 
+def bareStore(pkey,cls=SpatiaLiteDataStore):
+    '''A destination store with just the layer state set up by write(), for testing copy operations on local layers'''
+    ds = cls.__new__(cls)
+    ds.dst_info = LayerInfo('v:x1','x1')
+    ds.dst_info.pkey = pkey
+    ds.fid_map = None
+    ds.feat_field_names = None
+    ds.copy_plan = None
+    ds.optcols = set(['__change__','gml_id','ogc_fid','__pk__'])
+    ds.sixtyfour = None
+    ds.delete_queue = []
+    ds.delete_keys = set()
+    ds.change_ct = {'insert':0,'update':0,'delete':0}
+    ds.metrics = LayerMetrics('v:x1')
+    return ds
+
+def memoryLayer(ftype,keys):
+    '''A Memory driver layer with an 'id' key column. The datasource is returned too as the layer is only valid while it exists'''
+    mds = ogr.GetDriverByName('Memory').CreateDataSource('mem')
+    layer = mds.CreateLayer('x1',None,ogr.wkbNone)
+    layer.CreateField(ogr.FieldDefn('id',ftype))
+    for key in keys:
+        feat = ogr.Feature(layer.GetLayerDefn())
+        feat.SetField('id',key)
+        layer.CreateFeature(feat)
+    return mds,layer
+
+def keyFeature(layer,key):
+    feat = ogr.Feature(layer.GetLayerDefn())
+    feat.SetField('id',key)
+    return feat
+
 
 class Test_1_DataStore(unittest.TestCase):
     
@@ -68,12 +111,612 @@ class Test_1_DataStore(unittest.TestCase):
         self.assertEqual(res[1][1],rsl[1][1],'res 11')
         self.assertEqual(res[0][2][0],rsl[0][2][0],'res 020')
         self.assertEqual(res[1][2][1],rsl[1][2][1],'res 121')
+        
+
+class Test_2_Checkpoint(unittest.TestCase):
+    
+    def test_1_parse(self):
+        self.assertEqual(Checkpoint.parse(None),None,'no checkpoint')
+        self.assertEqual(Checkpoint.parse(''),None,'blank checkpoint')
+        cp = Checkpoint.parse('committed=50000;total=120000;lastkey=a;b')
+        self.assertEqual(cp.committed,50000,'committed')
+        self.assertEqual(cp.total,120000,'total')
+        self.assertEqual(cp.lastkey,'a;b','lastkey with separator')
+        
+    def test_2_roundtrip(self):
+        cp = Checkpoint.parse(str(Checkpoint(100,None,None)))
+        self.assertEqual((cp.committed,cp.lastkey,cp.total),(100,None,None),'index only checkpoint')
+        cp = Checkpoint.parse(str(Checkpoint(100,'1234',500)))
+        self.assertEqual((cp.committed,cp.lastkey,cp.total),(100,'1234',500),'keyed checkpoint')
+        
+        
+class Test_3_LatencyHistogram(unittest.TestCase):
+    
+    def test_1_percentiles(self):
+        h = LatencyHistogram()
+        self.assertEqual(h.percentile(50),0.0,'empty histogram')
+        for ms in range(1,101):
+            h.add(float(ms))
+        self.assertEqual(h.count,100,'count')
+        self.assertEqual(h.max,100.0,'max')
+        #bucket bounds are within a factor of 2^(1/4) of the true value
+        for p in (50,95,99):
+            self.assertTrue(p <= h.percentile(p) <= p*LatencyHistogram.BASE,'p{} = {}'.format(p,h.percentile(p)))
+        self.assertEqual(h.percentile(100),100.0,'p100 capped at max')
+        
+        
+class Test_4_PrefetchBuffer(unittest.TestCase):
+    
+    def setUp(self):
+        self.fdef = ogr.FeatureDefn()
+        self.fdef.AddFieldDefn(ogr.FieldDefn('id',ogr.OFTInteger))
+        self.fdef.AddFieldDefn(ogr.FieldDefn('name',ogr.OFTString))
+        
+    def feature(self,fid):
+        feat = ogr.Feature(self.fdef)
+        feat.SetFID(fid)
+        feat.SetField('id',fid)
+        feat.SetField('name','n{}'.format(fid))
+        feat.SetGeometry(ogr.CreateGeometryFromWkt('POINT ({0} {0})'.format(fid)))
+        return feat
+        
+    def test_1_spill(self):
+        '''budget holds the first few features, the rest are spilled and must come back in order with their values'''
+        pb = PrefetchBuffer(3*PrefetchBuffer.FEATURE_OVERHEAD)
+        for fid in range(10):
+            pb.add('update' if fid%2 else 'insert',self.feature(fid))
+        self.assertEqual(len(pb),10,'all features buffered')
+        self.assertTrue(pb.spilled > 0,'features spilled')
+        self.assertEqual([f.GetFID() for f in pb['insert']],[0,2,4,6,8],'insert order')
+        self.assertEqual([f.GetField('name') for f in pb['update']],['n1','n3','n5','n7','n9'],'update values')
+        self.assertEqual([f.GetGeometryRef().GetX() for f in pb['update']],[1,3,5,7,9],'spilled geometry')
+        self.assertEqual(list(pb['delete']),[],'no deletes')
+        pb.close()
+        
+        
+class Test_5_PageSizeController(unittest.TestCase):
+    
+    def test_1_aimd(self):
+        psc = PageSizeController(10000,1000)
+        self.assertEqual(psc.success(500),11000,'additive increase under target')
+        self.assertEqual(psc.success(2000),8250,'gentle decrease over target')
+        self.assertEqual(psc.failure(),4125,'halved on timeout')
+        self.assertEqual(psc.pages,2,'pages timed')
+        
+    def test_2_bounds(self):
+        psc = PageSizeController(150,1000)
+        psc.failure()
+        self.assertEqual(psc.size,PageSizeController.MINIMUM,'minimum size')
+        psc = PageSizeController(PageSizeController.MAXIMUM,1000)
+        psc.success(1)
+        self.assertEqual(psc.size,PageSizeController.MAXIMUM,'maximum size')
+        
+        
+class Test_6_GeoJSONLayer(unittest.TestCase):
+    
+    DOC = '''{"type":"FeatureCollection","features":[
+    {"type":"Feature","id":"x1203.1","geometry":{"type":"Point","coordinates":[174.7,-41.3]},"properties":{"id":1,"sufi":9007199254740993,"__change__":"INSERT"}},
+    {"type":"Feature","id":"x1203.2","geometry":null,"properties":{"id":2,"sufi":9007199254740995,"__change__":"DELETE"}}
+    ],"totalFeatures":2}'''
+    
+    def setUp(self):
+        fd,self.page = tempfile.mkstemp(suffix='.json')
+        os.write(fd,self.DOC)
+        os.close(fd)
+        
+    def tearDown(self):
+        os.remove(self.page)
+        
+    def test_1_layer(self):
+        '''features as read from a GML page of a changeset layer with sufi read as a string'''
+        defn = ogr.FeatureDefn('x1203')
+        for name,ftype in (('gml_id',ogr.OFTString),('id',ogr.OFTInteger),('sufi',ogr.OFTString),('__change__',ogr.OFTString)):
+            defn.AddFieldDefn(ogr.FieldDefn(name,ftype))
+        layer = GeoJSONLayer(self.page,defn)
+        feat = layer.GetNextFeature()
+        self.assertEqual((feat.GetFID(),feat.GetField('gml_id'),feat.GetField('sufi'),feat.GetField('__change__')),
+                         (1,'x1203.1','9007199254740993','INSERT'),'fields')
+        self.assertEqual(feat.GetGeometryRef().GetX(),174.7,'geometry')
+        self.assertIsNone(layer.GetNextFeature().GetGeometryRef(),'null geometry')
+        self.assertIsNone(layer.GetNextFeature(),'end of page')
+        layer.close()
+        
+        
+class Test_7_CutPages(unittest.TestCase):
+    
+    class Download(object):
+        def __init__(self,offset):
+            fd,self.file = tempfile.mkstemp(suffix='.gml')
+            os.write(fd,str(offset))
+            os.close(fd)
+            self.path = '/vsigzip/'+self.file
+    
+    def setUp(self):
+        self.cache = PageCache('request','v:x1')
+        
+    def tearDown(self):
+        self.cache.purge()
+        
+    def test_1_cutPages(self):
+        '''pages cached at the old size are replayed, the rest are cut at the new one'''
+        for offset in (1,1001):
+            self.cache.put(offset,1000,self.Download(offset))
+        pages = list(DataStore.cutPages(1,lambda: 3001,500,self.cache))
+        self.assertEqual(pages,[(1,1000),(1001,1000),(2001,500),(2501,500)],'page offsets')
+        
+        
+class Test_8_FIDMap(unittest.TestCase):
+    
+    def lookup(self,ftype,keys,key):
+        mds,layer = memoryLayer(ftype,keys)
+        ds = bareStore('id')
+        ds.fid_map = ds.buildFIDMap(layer,'id')
+        return ds._lookupFID(layer,keyFeature(layer,key))
+        
+    def test_1_stringKeys(self):
+        self.assertEqual(self.lookup(ogr.OFTString,['0','a1','b2'],'b2'),('b2',2),'string key')
+        #a miss isn't searched for as an integer, which would match key '0'
+        self.assertEqual(self.lookup(ogr.OFTString,['0','a1','b2'],'zz'),('zz',None),'missing string key')
+        
+    def test_2_integerKeys(self):
+        self.assertEqual(self.lookup(ogr.OFTInteger,[10,20,30],10),('10',0),'integer key at FID 0')
+        self.assertEqual(self.lookup(ogr.OFTInteger,[10,20,30],99),('99',None),'missing integer key')
+
+
+class Test_9_BatchDelete(unittest.TestCase):
+    '''Queued deletes against a SQLite layer with keys 10,20,30'''
+    
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='lds_test_')
+        self.sds = ogr.GetDriverByName('SQLite').CreateDataSource(os.path.join(self.tmp,'x1.sqlite'))
+        self.layer = self.sds.CreateLayer('x1',None,ogr.wkbNone)
+        self.layer.CreateField(ogr.FieldDefn('id',ogr.OFTInteger))
+        for key in (10,20,30):
+            self.layer.CreateFeature(keyFeature(self.layer,key))
+        self.ds = bareStore('id')
+        self.ds.ds = self.sds
+        
+    def tearDown(self):
+        self.layer = None
+        self.sds = None
+        shutil.rmtree(self.tmp,True)
+        
+    def keys(self):
+        self.layer.ResetReading()
+        return sorted(f.GetField('id') for f in self.layer)
+    
+    def deleteReinsert(self):
+        defn = self.layer.GetLayerDefn()
+        for key in (20,99,20):
+            self.ds.queueDelete(self.layer,keyFeature(self.layer,key),None)
+        self.assertEqual(self.ds.change_ct['delete'],0,'deletes not counted until flushed')
+        self.ds.flushDeletes()
+        self.assertEqual(self.ds.change_ct['delete'],1,'only the key found is counted')
+        self.assertEqual(self.keys(),[10,30])
+        self.ds.insertFeature(self.layer,keyFeature(self.layer,20),defn)
+        self.assertEqual(self.keys(),[10,20,30])
+        
+    def test_1_deleteReinsert(self):
+        self.deleteReinsert()
+        
+    def test_2_deleteReinsertMapped(self):
+        self.ds.fid_map = self.ds.buildFIDMap(self.layer,'id')
+        self.deleteReinsert()
+        self.assertEqual(sorted(self.ds.fid_map),['10','20','30'],'reinserted key mapped')
 
 
+class Test_10_StagedApply(unittest.TestCase):
+    '''Staged changesets applied to a SQLite table with keys 10,20,30'''
+    
+    def setUp(self):
+        self.ds = bareStore('id')
+        
+    def apply(self,staged):
+        db = sqlite3.connect(':memory:')
+        db.execute('create table x1 (id integer, name text)')
+        db.executemany('insert into x1 values (?,?)',[(10,'a'),(20,'b'),(30,'c')])
+        db.execute('create table x1_lds_stage (id integer, name text, {} text)'.format(self.ds.STAGE_CHANGE_COL))
+        db.executemany('insert into x1_lds_stage values (?,?,?)',staged)
+        for sql in self.ds.buildStagedApplySQL('x1','x1_lds_stage','id',(('id','id'),('name','name'))):
+            db.execute(sql)
+        return db.execute('select id,name from x1 order by id').fetchall()
+        
+    def test_1_apply(self):
+        staged = [(10,None,'delete'),(20,'B','update'),(40,'d','insert')]
+        self.assertEqual(self.apply(staged),[(20,'B'),(30,'c'),(40,'d')])
+        
+    def test_2_updateAsUpsert(self):
+        #a delete followed by a re-insert is staged as an update
+        self.assertEqual(self.apply([(20,'B','update'),(50,'e','update')]),[(10,'a'),(20,'B'),(30,'c'),(50,'e')])
+        
+    def test_3_stageChange(self):
+        mds,layer = memoryLayer(ogr.OFTInteger,[])
+        layer.CreateField(ogr.FieldDefn(self.ds.STAGE_CHANGE_COL,ogr.OFTString))
+        self.ds.stage_keys = {}
+        for key,change in ((10,'delete'),(20,'insert'),(10,'insert'),(20,'update'),(30,'insert'),(30,'delete')):
+            self.ds.stageChange(layer,keyFeature(layer,key),change)
+        layer.ResetReading()
+        staged = sorted((f.GetField('id'),f.GetField(self.ds.STAGE_CHANGE_COL)) for f in layer)
+        self.assertEqual(staged,[(10,'update'),(20,'update'),(30,'delete')],'one row per key')
+        
+    def test_4_stageName(self):
+        '''statements use the staging table name the driver gave the layer'''
+        mds,layer = memoryLayer(ogr.OFTInteger,[])
+        self.ds.stage_name = 'lds.x1_lds_stage'
+        sql = []
+        self.ds.executeSQL = sql.append
+        self.ds.applyStagedIncrement(layer,layer)
+        self.assertEqual(sql[0],'create index x1_lds_stage_pk on lds.x1_lds_stage(id)','index')
+        self.assertTrue(all('FROM lds.x1_lds_stage' in s for s in sql[1:]),'apply statements')
 
 
+class Test_11_CheckpointResume(unittest.TestCase):
+    '''A resumed copy where keys 10,20,30 were committed but the checkpoint was only recorded at key 20'''
+    
+    class Source(object):
+        def getPrimaryKey(self):
+            return 'id'
+    
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='lds_test_')
+        self.sds = ogr.GetDriverByName('SQLite').CreateDataSource(os.path.join(self.tmp,'x1.sqlite'))
+        self.layer = self.sds.CreateLayer('x1',None,ogr.wkbNone)
+        self.layer.CreateField(ogr.FieldDefn('id',ogr.OFTInteger))
+        for key in (10,20,30):
+            self.layer.CreateFeature(keyFeature(self.layer,key))
+        self.ds = bareStore('id')
+        self.ds.ds = self.sds
+        self.ds.src_link = self.Source()
+        
+    def tearDown(self):
+        self.layer = None
+        self.sds = None
+        shutil.rmtree(self.tmp,True)
+        
+    def test_1_discardUncheckpointed(self):
+        self.ds.discardUncheckpointed(Checkpoint(2,'20',3))
+        self.layer.ResetReading()
+        self.assertEqual(sorted(f.GetField('id') for f in self.layer),[10,20],'features after the checkpoint key discarded')
+        
+    class FailingCommit(object):
+        '''A destination layer whose commits fail'''
+        def __init__(self):
+            self.started = 0
+        def CommitTransaction(self):
+            raise RuntimeError('OGR Error: General Error')
+        def StartTransaction(self):
+            self.started += 1
+            
+    def test_2_layerCommit(self):
+        '''a failed layer commit is logged, as when exceptions were switched off around it'''
+        self.ds.commitTransaction(self.FailingCommit())
+        
+    def test_3_chunkCommit(self):
+        '''a failed chunk commit raises before its checkpoint is recorded'''
+        recorded = []
+        self.ds.src_info = self.ds.dst_info
+        self.ds.layerconf = self.Source()
+        self.ds.layerconf.getDS = lambda: None
+        self.ds.setCheckpoint = lambda layer,checkpoint: recorded.append(checkpoint)
+        layer = self.FailingCommit()
+        self.assertRaises(RuntimeError,self.ds.commitCheckpoint,layer,Checkpoint(2,'20',3))
+        self.assertEqual((recorded,layer.started),([],0),'no checkpoint or next chunk')
+
+
+class Test_12_PagedSource(unittest.TestCase):
+    
+    class Fetcher(object):
+        '''Returns the given pages in order, raising any that are exceptions'''
+        name = 'x1203'
+        def __init__(self,pages):
+            self.pages = list(pages)
+            self.fetched = 0
+            self.discarded = []
+        def next(self,lastkey=None):
+            if not self.pages: return None
+            self.fetched += 1
+            page = self.pages.pop(0)
+            if isinstance(page,Exception): raise page
+            return page
+        def discard(self,path):
+            self.discarded.append(path)
+        def pageSize(self):
+            return 3
+        def stop(self):
+            pass
+    
+    def setUp(self):
+        self.defn = ogr.FeatureDefn('x1203')
+        self.defn.AddFieldDefn(ogr.FieldDefn('id',ogr.OFTInteger))
+        self.tmp = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.tmp,True)
+        
+    def page(self,*ids,**kw):
+        '''A GeoJSON page of points at (170+id,-41) in the given crs, latitude first if swap is set'''
+        path = os.path.join(self.tmp,'{}.json'.format(len(os.listdir(self.tmp))))
+        point = '[-41,{}]' if kw.get('swap') else '[{},-41]'
+        with open(path,'w') as page:
+            page.write('{"type":"FeatureCollection","features":[')
+            page.write(','.join('{{"type":"Feature","id":"x1203.{0}","geometry":{{"type":"Point","coordinates":{1}}},"properties":{{"id":{0}}}}}'
+                                .format(i,point.format(170+i)) for i in ids))
+            page.write(']')
+            if kw.get('matched'): page.write(',"numberMatched":{}'.format(kw['matched']))
+            if kw.get('crs'): page.write(',"crs":{{"type":"name","properties":{{"name":"{}"}}}}'.format(kw['crs']))
+            page.write('}')
+        return path
+    
+    def readAll(self,fetcher,total=None):
+        self.source = PagedSource(fetcher,self.defn,None,LayerMetrics('v:x1203'),total=total)
+        return list(iter(self.source.next,None))
+    
+    def test_1_shortPage(self):
+        '''a page capped by the server below the size requested doesn't end the layer, an empty one does'''
+        fetcher = self.Fetcher([self.page(1,2),self.page(3,4,5),self.page(),self.page(6)])
+        self.assertEqual([f.GetField('id') for f in self.readAll(fetcher)],[1,2,3,4,5],'all pages up to the empty one')
+        self.assertEqual(fetcher.fetched,3,'stopped at the empty page')
+        
+    def test_2_total(self):
+        fetcher = self.Fetcher([self.page(1,2,3),self.page(4),self.page(5)])
+        self.assertEqual(len(self.readAll(fetcher,4)),4,'features matched')
+        self.assertEqual(fetcher.fetched,2,'no page fetched past the count')
+        
+    def test_3_unreadable(self):
+        '''an exception report returned as a page is an error rather than the end of the layer'''
+        report = os.path.join(self.tmp,'report.json')
+        with open(report,'w') as page:
+            page.write('<ows:ExceptionReport><ows:Exception exceptionCode="NoApplicableCode"/></ows:ExceptionReport>')
+        fetcher = self.Fetcher([self.page(1),report])
+        with self.assertRaises(InaccessibleFeatureException) as ife:
+            self.readAll(fetcher)
+        self.assertTrue(re.search('|'.join(DataStore.GDAL_IGNORE),str(ife.exception)),'retried')
+        self.assertEqual(fetcher.discarded,[report],'dropped from the cache')
+        
+    def test_4_fetchError(self):
+        '''a page that fails every attempt is retried with the layer, as a gateway error with a smaller page'''
+        fetcher = self.Fetcher([self.page(1),HTTPError('http://localhost/wfs',504,'Gateway Time-out',None,None)])
+        with self.assertRaises(InaccessibleFeatureException) as ife:
+            self.readAll(fetcher)
+        self.assertTrue(re.search('|'.join(DataStore.GDAL_IGNORE),str(ife.exception)),'retried')
+        self.assertTrue(re.search(DataStore.GDAL_OVERLOAD,str(ife.exception)),'page size reduced')
+        self.assertTrue(re.search(DataStore.GDAL_OVERLOAD,'HTTP Error 504: Gateway Time-out'),'urllib2 message')
+        
+    def test_5_crs(self):
+        '''the CRS is read from the first page, which is swapped to x,y if it gives a lat/long CRS by URN'''
+        for crs,swap in (('EPSG:4167',False),('urn:ogc:def:crs:EPSG::4167',True),('http://www.opengis.net/def/crs/EPSG/0/4167',True)):
+            feats = self.readAll(self.Fetcher([self.page(1,2,swap=swap,crs=crs),self.page(3,swap=swap,crs=crs)]),3)
+            self.assertEqual([f.GetGeometryRef().GetPoint_2D(0) for f in feats],[(171,-41),(172,-41),(173,-41)],'x,y as GML')
+            self.assertEqual(self.source.srs.GetAuthorityCode(None),'4167','page CRS')
+        self.readAll(self.Fetcher([self.page(1)]))
+        self.assertIsNone(self.source.srs,'layer CRS without a crs member')
+        
+    def test_6_matched(self):
+        '''without a total reading stops at the count given by the first page'''
+        fetcher = self.Fetcher([self.page(1,2,matched=3),self.page(3),self.page(4)])
+        self.assertEqual(len(self.readAll(fetcher)),3,'features matched')
+        self.assertEqual((self.source.matched,fetcher.fetched),(3,2),'no page fetched past the count')
+        
+    def test_7_firstPage(self):
+        '''pages after the first are only cut once it has been read and the total is known'''
+        test,cut,cache = self,[],PageCache('request','v:x1203')
+        class LocalFetcher(PageFetcher):
+            def _fetchPage(self,dl,pno,offset,count):
+                #a layer of 3 features
+                return test.page(*range(offset+1,min(offset+count,3)+1))
+        def pages():
+            for offset,count in DataStore.cutPages(0,lambda: source.total,2,cache):
+                cut.append(offset)
+                yield offset,count,'http://localhost/p{}'.format(offset)
+        source = PagedSource(LocalFetcher(pages(),None,4,2,'v_x1203'),self.defn,None,LayerMetrics('v:x1203'))
+        self.assertEqual(source.next().GetField('id'),1,'first feature')
+        self.assertEqual(cut,[0],'first page only')
+        source.total = 3
+        self.assertEqual([f.GetField('id') for f in iter(source.next,None)],[2,3],'rest of the layer')
+        self.assertEqual(cut,[0,2],'pages up to the total')
+        source.close()
+        cache.purge()
+
+
+class Test_13_PageCachePurge(unittest.TestCase):
+    
+    class Source(object):
+        def getDS(self):
+            return None
+        def getPageSizer(self):
+            return None
+    
+    def setUp(self):
+        self.cache = PageCache('request','v:x1')
+        
+    def tearDown(self):
+        self.cache.purge()
+        
+    def test_1_purgedOnFailure(self):
+        '''the cache is removed once the layer is given up on, as when it completes'''
+        ds = bareStore('id')
+        ds.ds = None
+        ds.getIncremental = lambda: False
+        ds.getTimerSample = lambda: 0
+        ds.closeFeatureReader = lambda: None
+        def featureCopy(src,dst,layername):
+            ds.page_cache = self.cache
+            raise FeatureCopyException('Unrecoverable')
+        ds.getCopyEngine = lambda: featureCopy
+        self.assertRaises(FeatureCopyException,ds.write,self.Source(),None,'v:x1',None)
+        self.assertFalse(os.path.exists(self.cache.dir),'purged')
+        self.assertIsNone(ds.page_cache,'cache dropped')
+
+
+class Test_14_CopyPlan(unittest.TestCase):
+    '''Field maps compiled for a source layer against the destination definition built with them'''
+    INTEGER64 = getattr(ogr,'OFTInteger64',None)
+    
+    def setUp(self):
+        self.ds = bareStore('id')
+        self.ds.sixtyfour = True
+        
+    class Values(object):
+        '''64bit values by key, as read from the source document'''
+        def __init__(self,values): self.values = values
+        def lookup(self,key): return self.values[key]
+        
+    def feature(self,fields,values=()):
+        '''A source feature with the given (name,type) fields and values'''
+        defn = ogr.FeatureDefn('x1')
+        for name,ftype in fields:
+            defn.AddFieldDefn(ogr.FieldDefn(name,ftype))
+        feat = ogr.Feature(defn)
+        for (name,_),value in zip(fields,values):
+            feat.SetField(name,value)
+        return feat
+        
+    def plan(self,*fields):
+        '''The copy plan and destination field names for a source feature with the given (name,type) fields'''
+        fout_def = self.ds.partialCloneFeatureDef(self.feature(fields))
+        return self.ds.copy_plan,[fout_def.GetFieldDefn(i).GetName() for i in range(fout_def.GetFieldCount())]
+    
+    def copy(self,fields,values):
+        '''The {name:value} fields of each destination feature copied from the source values, by SetFromWithMap where GDAL has it 
+        and field by field'''
+        fin = self.feature(fields,values)
+        fout_def = self.ds.partialCloneFeatureDef(fin)
+        copies = []
+        for set_from in sorted(set((CopyPlan.SET_FROM,False))):
+            self.ds.copy_plan.SET_FROM = set_from
+            fout = self.ds.partialCloneFeature(fin,fout_def)
+            copies.append(dict((fout_def.GetFieldDefn(i).GetName(),fout.GetField(i)) for i in range(fout_def.GetFieldCount())))
+        return self.ds.copy_plan,copies
+    
+    @unittest.skipIf(INTEGER64 is None,'needs GDAL >= 2.0')
+    def test_1_native64Optcol(self):
+        '''a native 64bit column listed as discarded is kept by both, later fields aren't shifted'''
+        self.ds.optcols.add('sufi')
+        plan,names = self.plan(('gml_id',ogr.OFTString),('sufi',self.INTEGER64),('id',ogr.OFTInteger),('name',ogr.OFTString))
+        self.assertEqual(names,['sufi','id','name'],'destination fields')
+        self.assertEqual(plan.field_map,[-1,0,1,2],'field map')
+        
+    def test_2_skipped(self):
+        '''discarded columns map to nothing and the fields after them move up'''
+        fields = (('gml_id',ogr.OFTString),('name',ogr.OFTString),('__change__',ogr.OFTString),('id',ogr.OFTInteger))
+        plan,copies = self.copy(fields,('x1.7','Wellington','INSERT',7))
+        self.assertEqual(plan.field_map,[-1,0,-1,1],'field map')
+        for fout in copies:
+            self.assertEqual(fout,{'name':'Wellington','id':7},'kept fields')
+        
+    def test_3_reordered(self):
+        '''each source field lands at its own destination index whatever its source position'''
+        self.ds.optcols.add('note')
+        fields = (('note',ogr.OFTString),('id',ogr.OFTInteger),('ogc_fid',ogr.OFTInteger),('area',ogr.OFTReal),('name',ogr.OFTString))
+        plan,copies = self.copy(fields,('skip',7,3,12.5,'Wellington'))
+        self.assertEqual(plan.field_map,[-1,0,-1,1,2],'field map')
+        self.assertEqual(plan.copy,((1,0),(3,1),(4,2)),'per field fallback')
+        for fout in copies:
+            self.assertEqual(fout,{'id':7,'area':12.5,'name':'Wellington'},'fields by destination index')
+        
+    def test_4_stringified64(self):
+        '''a 64bit column GDAL read through a double is left out of the map and set from its exact string value'''
+        self.ds.sufi_list = self.Values({'7':{'sufi':'9007199254740993'}})
+        fields = (('gml_id',ogr.OFTString),('sufi',ogr.OFTReal),('id',ogr.OFTInteger))
+        plan,copies = self.copy(fields,('x1.7',9007199254740993.0,7))
+        self.assertEqual(plan.field_map,[-1,-1,1],'field map')
+        self.assertEqual(plan.sufi,((1,0,'sufi'),),'64bit field')
+        for fout in copies:
+            self.assertEqual(fout,{'sufi':'9007199254740993','id':7},'exact 64bit string')
+
+        
+        
+class Test_15_CopyEngine(unittest.TestCase):
+    '''Full layer copies use Arrow batches only where configured and supported'''
+    
+    class Conf(object):
+        def __init__(self,**props): self.props = props
+        def readDSProperty(self,section,prop): return self.props.get(prop)
+    
+    def store(self,**props):
+        ds = bareStore('id')
+        ds.confwrap = self.Conf(**props)
+        ds.commitinterval = None
+        ds.arrow_failed = False
+        return ds
+        
+    def test_1_default(self):
+        ds = self.store()
+        self.assertEqual(ds.getCopyEngine(),ds.featureCopy,'feature copy unless configured')
+        
+    def test_2_arrow(self):
+        ds = self.store(copyengine='arrow')
+        self.assertEqual(ds.getCopyEngine(),ds.featureCopyArrow if DataStore.arrowCapable() else ds.featureCopy,'arrow where supported')
+        ds.commitinterval = 1000
+        self.assertEqual(ds.getCopyEngine(),ds.featureCopy,'checkpoints need feature copy')
+        ds.commitinterval = None
+        ds.arrow_failed = True
+        self.assertEqual(ds.getCopyEngine(),ds.featureCopy,'feature copy after a failed batch copy')
+        
+        
+class Test_16_FeaturePipeline(unittest.TestCase):
+    '''Features read ahead on the reader thread, given as numbered items'''
+    
+    def setUp(self):
+        self.poll = FeaturePipeline.POLL
+        FeaturePipeline.POLL = 0.05
+        self.fetched = 0
+        
+    def tearDown(self):
+        FeaturePipeline.POLL = self.poll
+        
+    def fetch(self):
+        self.fetched += 1
+        return self.fetched
+    
+    def waitFor(self,cond,timeout=5):
+        end = time.time()+timeout
+        while not cond() and time.time() < end:
+            time.sleep(0.01)
+        return cond()
+        
+    def test_1_backPressure(self):
+        '''the reader stops fetching once the queue is full and resumes as the writer takes features'''
+        pipeline = FeaturePipeline(self.fetch,2,'v:x1')
+        pipeline.start()
+        try:
+            self.assertTrue(self.waitFor(lambda: pipeline.queue.full() and self.fetched == 3),'queue filled')
+            time.sleep(0.2)
+            self.assertEqual(self.fetched,3,'reader blocked holding one feature')
+            self.assertEqual(pipeline.reader_waits,1,'reader wait counted')
+            self.assertEqual([pipeline.next(),pipeline.next(),pipeline.next()],[1,2,3],'features in order')
+            self.assertTrue(self.waitFor(lambda: self.fetched >= 5),'reader resumed')
+        finally:
+            pipeline.stop()
+            
+    def test_2_readerError(self):
+        '''an exception on the reader thread is raised by the writer once the features before it are read'''
+        def fetch():
+            if self.fetch() > 2: raise InaccessibleFeatureException('Unable to GetNextFeature')
+            return self.fetched
+        pipeline = FeaturePipeline(fetch,10,'v:x1')
+        pipeline.start()
+        try:
+            self.assertEqual([pipeline.next(),pipeline.next()],[1,2],'features before the error')
+            with self.assertRaises(InaccessibleFeatureException) as ife:
+                pipeline.next()
+            self.assertEqual(str(ife.exception),'Unable to GetNextFeature','reader exception')
+        finally:
+            pipeline.stop()
+        self.assertEqual(self.fetched,3,'reader stopped at the error')
         
+    def test_3_earlyStop(self):
+        '''a writer stopping before the end of the source releases the blocked reader thread'''
+        pipeline = FeaturePipeline(self.fetch,1,'v:x1')
+        pipeline.start()
+        self.assertEqual(pipeline.next(),1,'first feature')
+        self.assertTrue(self.waitFor(pipeline.queue.full),'reader blocked')
+        pipeline.stop()
+        self.assertFalse(pipeline.thread.is_alive(),'reader thread ended')
+        fetched = self.fetched
+        time.sleep(0.2)
+        self.assertEqual(self.fetched,fetched,'nothing fetched after stopping')
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testLDSRead']
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -22,11 +22,14 @@ import sys
 import time
 import subprocess
 
+from StringIO import StringIO
+
 sys.path.append('..')
 
 from lds.LDSUtilities import LDSUtilities
 
 from lds.LDSDataStore import LDSDataStore
+from lds.DataStore import Checkpoint
 
 testlog = LDSUtilities.setupLogging(ff=2)
 
@@ -68,6 +71,27 @@ class Test_1_LDSDataStore(unittest.TestCase):
         self.assertEqual(res[1][1],rsl[1][1],'res 11')
         self.assertEqual(res[0][2][0],rsl[0][2][0],'res 020')
         self.assertEqual(res[1][2][1],rsl[1][2][1],'res 121')
+        
+    def test_4_iterLayerInfo(self):
+        caps = '''<wfs:WFS_Capabilities xmlns:wfs="http://www.opengis.net/wfs" xmlns:ows="http://www.opengis.net/ows">
+        <wfs:FeatureTypeList>
+        <wfs:FeatureType><wfs:Name>v:x845</wfs:Name><wfs:Title>Basepoints</wfs:Title>
+        <ows:Keywords><ows:Keyword>New Zealand</ows:Keyword><ows:Keyword>Maritime Boundaries</ows:Keyword></ows:Keywords></wfs:FeatureType>
+        <wfs:FeatureType><wfs:Name>v:x846</wfs:Name><wfs:Title>Outer Limit</wfs:Title></wfs:FeatureType>
+        </wfs:FeatureTypeList>
+        </wfs:WFS_Capabilities>'''
+        res = LDSDataStore.iterLayerInfo(StringIO(caps),'1.1.0')
+        self.assertEqual(next(res),('v:x845','Basepoints',['New Zealand','Maritime Boundaries']),'first layer')
+        self.assertEqual(list(res),[('v:x846','Outer Limit',[])],'remaining layers')
+        
+    def test_5_setResumePoint(self):
+        self.ldsdatastore.setPrimaryKey('id')
+        self.assertTrue(self.ldsdatastore.setResumePoint(Checkpoint(5000,'1234',9000)),'resume by key')
+        self.assertEqual(self.ldsdatastore.pstart,'1234')
+        #without a sort key there's no stable order to resume a startIndex from
+        self.ldsdatastore.setPrimaryKey(None)
+        self.assertFalse(self.ldsdatastore.setResumePoint(Checkpoint(5000,None,9000)),'restart without a key')
+        self.assertEqual(self.ldsdatastore.pstart,None)
 
 
 
@@ -0,0 +1,440 @@
+'''
+v.0.0.9
+
+LDSReplicate -  LDSUtilities_Test
+
+Copyright 2011 Crown copyright (c)
+Land Information New Zealand and the New Zealand Government.
+All rights reserved
+
+This program is released under the terms of the new BSD license. See the
+LICENSE file for more information.
+
+Tests for the download, cache and document reading utilities
+
+Created on 18/10/2026
+
+@author: agent
+'''
+import unittest
+import os
+import sys
+import shutil
+import socket
+import atexit
+import tempfile
+import threading
+import gzip
+import zlib
+import BaseHTTPServer
+import SocketServer
+
+sys.path.append('..')
+
+from StringIO import StringIO
+from contextlib import closing
+from urllib2 import Request, HTTPError
+
+from lds.LDSUtilities import LDSUtilities, SUFIExtractor, CapabilitiesCache, HTTPTransport, GeoJSONStream, PageCache, FeatureCounter, \
+    PageFetcher, DirectDownload
+
+testlog = LDSUtilities.setupLogging(ff=2)
+
+
+class TempFileTest(unittest.TestCase):
+    '''Tests reading files written to a temporary directory, removed after each test'''
+    
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp,True)
+    
+    def write(self,name,content,gz=False):
+        '''Writes a file returning the path it is opened by, through /vsigzip/ if gzipped as downloads are'''
+        path = os.path.join(self.tmp,name)
+        with closing(gzip.open(path,'wb') if gz else open(path,'wb')) as f:
+            f.write(content)
+        return '/vsigzip/'+path if gz else path
+
+
+class LocalServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+    '''HTTP server on a free local port serving on its own thread'''
+    daemon_threads = True
+    
+    def __init__(self,handler):
+        BaseHTTPServer.HTTPServer.__init__(self,('127.0.0.1',0),handler)
+        threading.Thread(target=self.serve_forever).start()
+        self.base = 'http://127.0.0.1:{}'.format(self.server_address[1])
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class LocalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Keep-alive request handler logging nothing'''
+    protocol_version = 'HTTP/1.1'
+    
+    def respond(self,code,body='',**headers):
+        self.send_response(code)
+        for name,value in headers.items():
+            self.send_header(name.replace('_','-'),value)
+        if code != 304: self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self,*args):
+        pass
+
+
+class Test_1_SUFIExtractor(TempFileTest):
+    
+    DOC = '''<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs" xmlns:gml="http://www.opengis.net/gml" xmlns:v="http://data.linz.govt.nz/ns/v">
+    <gml:featureMember><v:x1203 fid="x1203.1"><v:id>1</v:id><v:sufi>9007199254740993</v:sufi></v:x1203></gml:featureMember>
+    <gml:featureMember><v:x1203 fid="x1203.2"><v:id>2</v:id><v:sufi>9007199254740995</v:sufi></v:x1203></gml:featureMember>
+    <gml:featureMember><v:x1203 fid="x1203.3"><v:id>3</v:id><v:sufi>9007199254740997</v:sufi></v:x1203></gml:featureMember>
+    </wfs:FeatureCollection>'''
+    
+    def test_1_parse(self):
+        pairs = list(SUFIExtractor.parse(StringIO(self.DOC),'id',['sufi']))
+        self.assertEqual(pairs,[('1',{'sufi':'9007199254740993'}),('2',{'sufi':'9007199254740995'}),('3',{'sufi':'9007199254740997'})],
+                         'exact 64bit strings by key')
+    
+    def test_2_outOfOrder(self):
+        '''a download is read forward holding only the pairs read ahead of the lookup'''
+        extractor = SUFIExtractor(self.write('x1203.gml',self.DOC,gz=True),'id',['sufi'])
+        self.assertEqual(extractor.lookup('2'),{'sufi':'9007199254740995'},'read forward')
+        self.assertEqual(extractor.pairs.keys(),['1'],'read ahead held')
+        self.assertEqual(extractor.lookup('1'),{'sufi':'9007199254740993'},'read from held pairs')
+        self.assertEqual(extractor.lookup('3'),{'sufi':'9007199254740997'},'last feature')
+        self.assertRaises(KeyError,extractor.lookup,'4')
+        extractor.close()
+    
+    def test_3_readPage(self):
+        pairs = SUFIExtractor.readPage(self.write('page.gml',self.DOC),'id',['sufi'])
+        self.assertEqual(sorted(pairs),['1','2','3'],'all features of the page')
+        self.assertEqual(pairs['3'],{'sufi':'9007199254740997'},'exact 64bit string')
+
+
+class Test_2_CapabilitiesCache(TempFileTest):
+    
+    LAYERS = [('v:x1','title',['keyword'])]
+    
+    def setUp(self):
+        TempFileTest.setUp(self)
+        self.cache_dir = CapabilitiesCache.CACHE_DIR
+        CapabilitiesCache.CACHE_DIR = os.path.join(self.tmp,'cache')
+        self.doc = self.write('caps.xml','<caps/>')
+        self.url = 'file://'+self.doc
+    
+    def tearDown(self):
+        CapabilitiesCache.CACHE_DIR = self.cache_dir
+        TempFileTest.tearDown(self)
+    
+    def test_1_parseOnce(self):
+        parsed = []
+        def parse(doc):
+            parsed.append(doc.read())
+            return self.LAYERS
+        self.assertEqual(CapabilitiesCache(self.url).layers(parse),self.LAYERS,'parsed layers')
+        self.assertEqual(CapabilitiesCache(self.url).layers(parse),self.LAYERS,'cached layers')
+        self.assertEqual(parsed,['<caps/>'],'document parsed once')
+    
+    def test_2_unreachable(self):
+        '''a failed revalidation falls back to the cached copy'''
+        path = CapabilitiesCache(self.url).document()
+        os.remove(self.doc)
+        self.assertEqual(CapabilitiesCache(self.url,ttl=0).document(),path,'cached copy')
+        CapabilitiesCache(self.url).clear()
+        self.assertRaises(IOError,CapabilitiesCache(self.url,ttl=0).document)
+
+
+class Test_3_HTTPTransport(unittest.TestCase):
+    
+    class Handler(LocalHandler):
+        clients = []
+        def do_GET(self):
+            self.clients.append(self.client_address)
+            if self.path == '/moved':
+                self.respond(302,Location='/page')
+            elif self.path == '/unchanged':
+                self.respond(304)
+            elif self.path == '/deflate':
+                self.respond(200,zlib.compress('decoded '*100)[2:-4],Content_Encoding='deflate')
+            elif self.path == '/gzip':
+                buf = StringIO()
+                with closing(gzip.GzipFile(fileobj=buf,mode='wb')) as gz:
+                    gz.write('decoded '*100)
+                self.respond(200,buf.getvalue(),Content_Encoding='gzip')
+            else:
+                self.respond(200,self.path)
+    
+    def setUp(self):
+        self.server = LocalServer(self.Handler)
+        self.transport = HTTPTransport()
+        del self.Handler.clients[:]
+    
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+    
+    def test_1_keepAlive(self):
+        for path in ('/a','/b','/moved'):
+            with closing(self.transport.open(self.server.base+path)) as resp:
+                self.assertEqual(resp.getcode(),200,'status')
+                self.assertEqual(resp.read(),'/page' if path=='/moved' else path,'body')
+        self.assertEqual(len(self.Handler.clients),4,'requests incl. redirect')
+        self.assertEqual(len(set(self.Handler.clients)),1,'one connection')
+    
+    def test_2_notModified(self):
+        with self.assertRaises(HTTPError) as he:
+            self.transport.open(Request(self.server.base+'/unchanged',headers={'If-None-Match':'"1"'}))
+        self.assertEqual(he.exception.code,304,'conditional request')
+    
+    def test_3_decode(self):
+        HTTPTransport.resetCounters()
+        with closing(self.transport.open(self.server.base+'/gzip')) as resp:
+            self.assertEqual(resp.read(),'decoded '*100,'gzip body')
+        self.assertEqual(HTTPTransport.decoded_bytes,800,'decoded count')
+        self.assertTrue(0<HTTPTransport.wire_bytes<800,'wire count')
+    
+    def test_4_rawDeflate(self):
+        '''deflate without the zlib header, read in small pieces past the end'''
+        with closing(self.transport.open(self.server.base+'/deflate')) as resp:
+            body = ''.join(iter(lambda: resp.read(100),''))
+            self.assertEqual(body,'decoded '*100,'raw deflate body')
+            self.assertEqual(resp.read(),'','nothing after the end')
+
+
+class Test_4_GeoJSONStream(TempFileTest):
+    
+    DOC = '''{"type":"FeatureCollection","features":[
+    {"type":"Feature","id":"x1203.1","geometry":{"type":"Point","coordinates":[174.7,-41.3]},"properties":{"id":1,"sufi":9007199254740993,"__change__":"INSERT"}},
+    {"type":"Feature","id":"x1203.2","geometry":null,"properties":{"id":2,"sufi":9007199254740995,"__change__":"DELETE"}}
+    ],"totalFeatures":2}'''
+    
+    def setUp(self):
+        TempFileTest.setUp(self)
+        self.chunk_size = GeoJSONStream.CHUNK_SIZE
+    
+    def tearDown(self):
+        GeoJSONStream.CHUNK_SIZE = self.chunk_size
+        TempFileTest.tearDown(self)
+    
+    def test_1_stream(self):
+        '''features are decoded whole whatever the chunks they were read in'''
+        GeoJSONStream.CHUNK_SIZE = 16
+        feats = list(GeoJSONStream(self.write('page.json',self.DOC)))
+        self.assertEqual([f['properties']['sufi'] for f in feats],[9007199254740993,9007199254740995],'exact 64bit values')
+        self.assertEqual(feats[1]['properties']['__change__'],'DELETE','change column')
+    
+    def test_2_invalid(self):
+        self.assertRaises(ValueError,list,GeoJSONStream(self.write('page.json',self.DOC[:150])))
+        self.assertRaises(ValueError,GeoJSONStream,self.write('page.json','<ows:ExceptionReport/>'))
+
+
+class Test_5_PageCache(TempFileTest):
+    
+    class Download(object):
+        def __init__(self,path):
+            self.file = path
+            self.path = '/vsigzip/'+path
+    
+    def setUp(self):
+        TempFileTest.setUp(self)
+        self.cache = PageCache('request','v:x1')
+    
+    def tearDown(self):
+        self.cache.purge()
+        TempFileTest.tearDown(self)
+    
+    def test_1_replay(self):
+        dl = self.Download(self.write('p1.gml','1'))
+        path = self.cache.put(1,1000,dl)
+        self.assertFalse(os.path.exists(dl.file),'moved into the cache')
+        self.assertTrue(path.startswith('/vsigzip/'+self.cache.dir),'opened as downloaded')
+        self.assertEqual(self.cache.get(1),(path,1000),'cached page')
+        self.assertIsNone(self.cache.get(1001),'uncached page')
+        self.cache.purge()
+        self.assertFalse(os.path.exists(self.cache.dir),'purged')
+
+
+class Test_6_FeatureCounter(TempFileTest):
+    
+    def page(self,root,gz=False):
+        return self.write('page.gml'+('.gz' if gz else ''),'<?xml version="1.0" encoding="UTF-8"?>'+root+'<wfs:member/></wfs:FeatureCollection>',gz)
+    
+    def test_1_readMatched(self):
+        '''the count of the whole request from the first page'''
+        wfs2 = '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" numberMatched="1234" numberReturned="500">'
+        wfs1 = '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs" numberOfFeatures="500">'
+        unknown = '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" numberMatched="unknown" numberReturned="500">'
+        self.assertEqual(FeatureCounter.readMatched(self.page(wfs2)),1234,'WFS 2.0 count')
+        self.assertEqual(FeatureCounter.readMatched(self.page(wfs2,gz=True)),1234,'gzipped page')
+        self.assertEqual(FeatureCounter.readMatched(self.page(wfs1)),None,'WFS 1.1 page size')
+        self.assertEqual(FeatureCounter.readMatched(self.page(unknown)),None,'not counted')
+
+
+class Test_7_PageFetcher(unittest.TestCase):
+    
+    class Handler(LocalHandler):
+        requests = []
+        failing = set()
+        def do_GET(self):
+            self.requests.append(self.path)
+            if self.path in self.failing:
+                self.respond(503)
+            else:
+                self.respond(200,self.path)
+    
+    def setUp(self):
+        self.server = LocalServer(self.Handler)
+        del self.Handler.requests[:]
+        self.Handler.failing.clear()
+        self.cache = PageCache(self.server.base,'v:x1')
+    
+    def tearDown(self):
+        self.cache.purge()
+        self.server.stop()
+    
+    def attempt(self):
+        '''Reads the layer's pages as one copy attempt does, returning their contents up to the end or an error'''
+        pages = [(n,1,'{}/p{}'.format(self.server.base,n)) for n in (1,2,3)]
+        fetcher = PageFetcher(pages,None,1,1,'v_x1',None,'.json',self.cache)
+        fetcher.MAX_ATTEMPTS = 1
+        bodies = []
+        try:
+            for path in iter(fetcher.next,None):
+                with open(path) as page:
+                    bodies.append(page.read())
+        finally:
+            fetcher.stop()
+        return bodies
+    
+    def test_1_replay(self):
+        '''a page failing every request fails the attempt, the retry only fetches the pages not yet read'''
+        self.Handler.failing.add('/p3')
+        self.assertRaises(HTTPError,self.attempt)
+        self.assertEqual(sorted(self.cache.pages),['1','2'],'pages read are cached')
+        self.Handler.failing.clear()
+        del self.Handler.requests[:]
+        self.assertEqual(self.attempt(),['/p1','/p2','/p3'],'whole layer on retry')
+        self.assertEqual(self.Handler.requests,['/p3'],'earlier pages from the cache')
+
+        
+        
+class Test_8_DirectDownload(TempFileTest):
+    '''Downloads through a stub transport returning scripted responses'''
+    
+    BODY = '0123456789'
+    
+    class Response(object):
+        '''A response read in chunks, dropping the connection once 'drop' bytes have been read'''
+        def __init__(self,code,body,drop=None,**headers):
+            self.code = code
+            self.body = body
+            self.drop = drop
+            self.headers = dict((name.replace('_','-'),value) for name,value in headers.items())
+            self.sent = 0
+        def getcode(self):
+            return self.code
+        def info(self):
+            return self
+        def getheader(self,name):
+            return self.headers.get(name)
+        def read(self,size):
+            if self.drop is not None and self.sent >= self.drop:
+                raise socket.error(104,'Connection reset by peer')
+            end = self.sent+size if self.drop is None else min(self.sent+size,self.drop)
+            chunk = self.body[self.sent:end]
+            self.sent += len(chunk)
+            return chunk
+        def close(self):
+            pass
+        
+    class Transport(object):
+        def __init__(self,*responses):
+            self.responses = list(responses)
+            self.requests = []
+        def open(self,req):
+            self.requests.append(req)
+            return self.responses.pop(0)
+    
+    def setUp(self):
+        TempFileTest.setUp(self)
+        self.get = HTTPTransport.__dict__['get']
+        self.temp_dir = DirectDownload.TEMP_DIR
+        self.chunk_size = DirectDownload.CHUNK_SIZE
+        DirectDownload.TEMP_DIR = self.tmp
+        DirectDownload.CHUNK_SIZE = 4
+        
+    def tearDown(self):
+        HTTPTransport.get = self.get
+        DirectDownload.TEMP_DIR = self.temp_dir
+        DirectDownload.CHUNK_SIZE = self.chunk_size
+        TempFileTest.tearDown(self)
+        
+    def download(self,*responses):
+        '''Downloads through the responses returning the download and the requests made'''
+        transport = self.Transport(*responses)
+        HTTPTransport.get = classmethod(lambda cls,pxy=None: transport)
+        dl = DirectDownload('http://localhost/wfs',None,'v:x1')
+        dl.download()
+        return dl,transport.requests
+        
+    def test_1_resume(self):
+        '''a dropped connection is resumed from the bytes received, only if the document is unchanged'''
+        dl,requests = self.download(self.Response(200,self.BODY,4,ETag='"v1"',Accept_Ranges='bytes',Content_Length='10'),
+                                    self.Response(206,self.BODY[4:],Content_Length='6'))
+        self.assertEqual([r.get_header('Range') for r in requests],[None,'bytes=4-'],'range request')
+        self.assertEqual(requests[1].get_header('If-range'),'"v1"','conditional on the first response')
+        self.assertEqual(dl.path,dl.file,'plain download')
+        with open(dl.path) as f:
+            self.assertEqual(f.read(),self.BODY,'whole document')
+            
+    def test_2_restart(self):
+        '''a download is restarted if the server doesn't take ranges or ignores the range requested'''
+        dl,requests = self.download(self.Response(200,self.BODY,4,Content_Length='10'),self.Response(200,self.BODY,Content_Length='10'))
+        self.assertIsNone(requests[1].get_header('Range'),'no range without Accept-Ranges')
+        dl,requests = self.download(self.Response(200,self.BODY,4,Accept_Ranges='bytes',Content_Length='10'),
+                                    self.Response(200,self.BODY,Accept_Ranges='bytes',Content_Length='10'))
+        self.assertEqual(requests[1].get_header('Range'),'bytes=4-','range requested')
+        with open(dl.path) as f:
+            self.assertEqual(f.read(),self.BODY,'whole document rewritten')
+            
+    def test_3_gzip(self):
+        '''a gzipped response is stored as received and opened through /vsigzip/'''
+        buf = StringIO()
+        with closing(gzip.GzipFile(fileobj=buf,mode='wb')) as gz:
+            gz.write(self.BODY*100)
+        dl,requests = self.download(self.Response(200,buf.getvalue(),Content_Encoding='gzip'))
+        self.assertEqual(requests[0].get_header('Accept-encoding'),'gzip','compression requested')
+        self.assertEqual(dl.path,'/vsigzip/'+dl.file,'opened through /vsigzip/')
+        with closing(gzip.open(dl.file)) as f:
+            self.assertEqual(f.read(),self.BODY*100,'decoded document')
+        self.assertEqual(dl.decodedSize(),1000,'decoded size from the trailer')
+        
+    def test_4_tempDir(self):
+        '''downloads share one directory per run which is removed at exit, each download is removed once read'''
+        DirectDownload.TEMP_DIR = None
+        registered = []
+        register = atexit.register
+        atexit.register = lambda *args: registered.append(args)
+        try:
+            tmp = DirectDownload.tempDir()
+        finally:
+            atexit.register = register
+        self.assertEqual(DirectDownload.tempDir(),tmp,'one directory per run')
+        dl = DirectDownload('http://localhost/wfs',None,'v:x1')
+        self.assertEqual(dl.file,os.path.join(tmp,'v_x1.gml'),'named for the layer')
+        with open(dl.file,'w') as f:
+            f.write(self.BODY)
+        dl.remove()
+        self.assertFalse(os.path.exists(dl.file),'download removed')
+        for args in registered:
+            args[0](*args[1:])
+        self.assertFalse(os.path.exists(tmp),'directory removed at exit')
+
+if __name__ == "__main__":
+    unittest.main()
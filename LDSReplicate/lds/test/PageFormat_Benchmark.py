@@ -0,0 +1,134 @@
+'''
+v.0.0.9
+
+LDSReplicate -  PageFormat_Benchmark
+
+Copyright 2011 Crown copyright (c)
+Land Information New Zealand and the New Zealand Government.
+All rights reserved
+
+This program is released under the terms of the new BSD license. See the
+LICENSE file for more information.
+
+Compares the parse throughput of a page of features as GML2, opened by OGR with its schema as PagedSource does, against the
+same page as GeoJSON read by GeoJSONLayer. Usage: python PageFormat_Benchmark.py [features] [vertices]
+
+Created on 18/10/2026
+
+@author: agent
+'''
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+
+import ogr
+import gdal
+
+sys.path.append('..')
+
+from lds.DataStore import GeoJSONLayer
+
+NS = 'data.linz.govt.nz'
+LAYER = 'x1203'
+
+XSD = '''<?xml version="1.0" encoding="UTF-8"?>
+<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:gml="http://www.opengis.net/gml" xmlns:{ns}="http://{ns}"
+  elementFormDefault="qualified" targetNamespace="http://{ns}">
+  <xsd:import namespace="http://www.opengis.net/gml" schemaLocation="http://schemas.opengis.net/gml/2.1.2/feature.xsd"/>
+  <xsd:complexType name="{l}Type">
+    <xsd:complexContent>
+      <xsd:extension base="gml:AbstractFeatureType">
+        <xsd:sequence>
+          <xsd:element maxOccurs="1" minOccurs="0" name="shape" nillable="true" type="gml:PolygonPropertyType"/>
+          <xsd:element maxOccurs="1" minOccurs="0" name="id" nillable="true" type="xsd:int"/>
+          <xsd:element maxOccurs="1" minOccurs="0" name="sufi" nillable="true" type="xsd:long"/>
+          <xsd:element maxOccurs="1" minOccurs="0" name="name" nillable="true" type="xsd:string"/>
+          <xsd:element maxOccurs="1" minOccurs="0" name="__change__" nillable="true" type="xsd:string"/>
+        </xsd:sequence>
+      </xsd:extension>
+    </xsd:complexContent>
+  </xsd:complexType>
+  <xsd:element name="{l}" substitutionGroup="gml:_Feature" type="{ns}:{l}Type"/>
+</xsd:schema>'''
+
+GML_HEAD = '''<?xml version="1.0" encoding="UTF-8"?>
+<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs" xmlns:gml="http://www.opengis.net/gml" xmlns:{ns}="http://{ns}">
+'''
+GML_FEATURE = '''<gml:featureMember><{ns}:{l} fid="{l}.{i}"><{ns}:shape><gml:Polygon srsName="http://www.opengis.net/gml/srs/epsg.xml#2193">\
+<gml:outerBoundaryIs><gml:LinearRing><gml:coordinates decimal="." cs="," ts=" ">{c}</gml:coordinates></gml:LinearRing>\
+</gml:outerBoundaryIs></gml:Polygon></{ns}:shape><{ns}:id>{i}</{ns}:id><{ns}:sufi>{s}</{ns}:sufi><{ns}:name>{n}</{ns}:name>\
+<{ns}:__change__>INSERT</{ns}:__change__></{ns}:{l}></gml:featureMember>
+'''
+GML_TAIL = '</wfs:FeatureCollection>'
+
+
+def ring(i,vertices):
+    '''A closed ring of 'vertices' points'''
+    pts = [(1750000.0+i+j*0.5,5420000.0+(j%2)*0.5) for j in range(vertices-1)]
+    return pts+pts[:1]
+
+def write(tmp,features,vertices):
+    '''Writes the same page as GML2, with its schema, and GeoJSON returning the paths'''
+    xsd,gml,geojson = [os.path.join(tmp,'page'+s) for s in ('.xsd','.gml','.json')]
+    with open(xsd,'w') as f:
+        f.write(XSD.format(ns=NS,l=LAYER))
+    with open(gml,'w') as g, open(geojson,'w') as j:
+        g.write(GML_HEAD.format(ns=NS))
+        j.write('{"type":"FeatureCollection","features":[')
+        for i in range(1,features+1):
+            pts = ring(i,vertices)
+            sufi,name = 9007199254740993+i,'Feature {}'.format(i)
+            g.write(GML_FEATURE.format(ns=NS,l=LAYER,i=i,s=sufi,n=name,c=' '.join('{},{}'.format(*p) for p in pts)))
+            j.write((',' if i>1 else '')+json.dumps({'type':'Feature','id':'{}.{}'.format(LAYER,i),
+                'geometry':{'type':'Polygon','coordinates':[pts]},
+                'properties':{'id':i,'sufi':sufi,'name':name,'__change__':'INSERT'}})+'\n')
+        g.write(GML_TAIL)
+        j.write('],"totalFeatures":{}}}'.format(features))
+    return xsd,gml,geojson
+
+def readGML(gml,xsd):
+    '''Opens a GML page with its schema and reads every feature, returning the count and the layer definition'''
+    ds = gdal.OpenEx(gml,gdal.OF_VECTOR,open_options=['XSD='+xsd]) if hasattr(gdal,'OpenEx') else ogr.Open(gml)
+    layer = ds.GetLayer(0)
+    count = 0
+    while layer.GetNextFeature():
+        count += 1
+    return count,layer.GetLayerDefn().Clone()
+
+def readGeoJSON(geojson,defn):
+    layer = GeoJSONLayer(geojson,defn)
+    count = 0
+    while layer.GetNextFeature():
+        count += 1
+    layer.close()
+    return count
+
+def timed(func,*args):
+    st = time.time()
+    res = func(*args)
+    return res,max(time.time()-st,0.001)
+
+def report(fmt,path,count,el):
+    mb = os.path.getsize(path)/1048576.0
+    print '{:8} {:8} features {:8.1f}MB {:8.2f}s {:10.0f} features/s {:8.2f}MB/s'.format(fmt,count,mb,el,count/el,mb/el)
+
+def main():
+    features = int(sys.argv[1]) if len(sys.argv)>1 else 50000
+    vertices = int(sys.argv[2]) if len(sys.argv)>2 else 20
+    ogr.UseExceptions()
+    tmp = tempfile.mkdtemp(prefix='lds_benchmark_')
+    try:
+        xsd,gml,geojson = write(tmp,features,vertices)
+        (gml_count,defn),gml_el = timed(readGML,gml,xsd)
+        json_count,json_el = timed(readGeoJSON,geojson,defn)
+        report('GML2',gml,gml_count,gml_el)
+        report('JSON',geojson,json_count,json_el)
+        print 'JSON/GML2 throughput {:.2f}x'.format(gml_el/json_el)
+    finally:
+        shutil.rmtree(tmp,True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+'''
+v.0.0.9
+
+LDSReplicate -  ProjectionReference_Test
+
+Copyright 2011 Crown copyright (c)
+Land Information New Zealand and the New Zealand Government.
+All rights reserved
+
+This program is released under the terms of the new BSD license. See the 
+LICENSE file for more information.
+
+Tests for cached transformations and block reprojection
+
+Created on 18/10/2026
+
+@author: agent
+'''
+import unittest
+import sys
+import threading
+
+import osr
+import ogr
+
+sys.path.append('..')
+
+from lds.LDSUtilities import LDSUtilities
+
+from lds.ProjectionReference import Projection, TransformPool
+
+testlog = LDSUtilities.setupLogging(ff=2)
+
+
+class Test_1_Projection(unittest.TestCase):
+    
+    def test_1_threadTransformations(self):
+        '''Each thread gets its own transformation, reused for the same source and EPSG'''
+        src = Projection.getSpatialReference(2193)
+        dst1,ct1 = Projection.getTransformation(src,4167)
+        self.assertIs(Projection.getTransformation(src,4167)[1],ct1,'cached in thread')
+        other = []
+        t = threading.Thread(target=lambda: other.append(Projection.getTransformation(src,4167)))
+        t.start()
+        t.join()
+        self.assertIs(other[0][0],dst1,'SRS shared')
+        self.assertIsNot(other[0][1],ct1,'transformation per thread')
+
+
+class Test_2_TransformPool(unittest.TestCase):
+    
+    def setUp(self):
+        self.assertTrue(TransformPool.start(2),'pool started without other threads')
+        
+    def tearDown(self):
+        TransformPool.stop()
+        
+    def features(self):
+        defn = ogr.FeatureDefn()
+        feats = []
+        for i in range(TransformPool.BLOCK_SIZE*2+7):
+            feat = ogr.Feature(defn)
+            if i % 100:
+                x,y = 1750000+i*10,5420000+i*5
+                feat.SetGeometry(ogr.CreateGeometryFromWkt('POLYGON (({0} {1},{2} {1},{2} {3},{0} {1}))'.format(x,y,x+7,y+3)))
+            feats.append(feat)
+        return feats
+        
+    def test_1_pooledMatchesSerial(self):
+        '''A block reprojected by the workers matches the same geometries transformed one at a time'''
+        src = Projection.getSpatialReference(2193)
+        dst,ct = Projection.getTransformation(src,4167)
+        pooled = self.features()
+        TransformPool(src,dst).transformFeatures(pooled)
+        for pf,sf in zip(pooled,self.features()):
+            geom = sf.GetGeometryRef()
+            if geom is None:
+                self.assertIsNone(pf.GetGeometryRef(),'no geometry')
+                continue
+            geom.Transform(ct)
+            self.assertEqual(pf.GetGeometryRef().ExportToWkt(),geom.ExportToWkt())
+            
+    def test_2_noForkWithThreads(self):
+        '''The pool isn't forked once other threads are running'''
+        TransformPool.stop()
+        stop = threading.Event()
+        t = threading.Thread(target=stop.wait)
+        t.start()
+        try:
+            self.assertFalse(TransformPool.start(2),'not started with a thread running')
+            self.assertFalse(TransformPool.running())
+        finally:
+            stop.set()
+            t.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -57,6 +57,45 @@ class Test_1_RequestBuilder(unittest.TestCase):
         self.assertEqual(w100.__str__(),'RequestBuilder_WFS-1.1.0','str cmp 100 (subst)')
         self.assertEqual(w110.__str__(),'RequestBuilder_WFS-1.1.0','str cmp 110')
         self.assertEqual(w200.__str__(),'RequestBuilder_WFS-2.0.0','str cmp 200')
+        
+    def test_2_resumeParameters(self):
+        w110 = RequestBuilder.getInstance(self.PARAMS110,None)
+        self.assertEqual(w110._buildCQLStr(),'','no sort/start params')
+        
+        w110.pkey = 'id'
+        self.assertEqual(w110._buildCQLStr(),'&sortBy=id','sort on pkey')
+        
+        w110.pstart = '1234'
+        self.assertEqual(w110._buildCQLStr(),'&sortBy=id&cql_filter=id%3E1234','resume from numeric key')
+        
+        w110.pstart = 'abc'
+        self.assertEqual(w110._buildCQLStr(),'&sortBy=id&cql_filter=id%3E%27abc%27','resume from text key')
+
+        
+    def test_3_pageURI(self):
+        w110 = RequestBuilder.getInstance(self.PARAMS110,None)
+        w200 = RequestBuilder.getInstance(self.PARAMS200,None)
+        uri = 'http://x/wfs?service=WFS&version=2.0.0&request=GetFeature&typeNames=v:x1&outputFormat=GML2&sortBy=id&startIndex=10'
+        self.assertEqual(w200.pageURI(uri,501,500),uri[:-14]+'&startIndex=501&count=500','page replaces start index')
+        self.assertEqual(w110.pageURI(uri,1,500),uri[:-14]+'&startIndex=1&maxFeatures=500','1.1.0 page size parameter')
+        self.assertEqual(RequestBuilder.describeFeatureTypeURI(uri),'http://x/wfs?service=WFS&version=2.0.0&typeNames=v:x1&request=DescribeFeatureType','describe feature type')
+        
+    def test_4_keysetURI(self):
+        w200 = RequestBuilder.getInstance(self.PARAMS200,None)
+        w200.pkey,w200.pstart = 'id',None
+        uri = w200.sourceURI('v:x1')
+        self.assertTrue(uri.endswith('&sortBy=id'),'sorted request')
+        self.assertEqual(w200.keysetURI(uri,'1234',500),uri+'&cql_filter=id%3E1234&count=500','page after key')
+        w200.pstart = '100'
+        uri = w200.sourceURI('v:x1')
+        self.assertEqual(w200.keysetURI(uri,'1234',500),uri.replace('id%3E100','id%3E1234')+'&count=500','page replaces resume key')
+        
+    def test_5_formatURI(self):
+        w110 = RequestBuilder.getInstance(self.PARAMS110,None)
+        uri = w110.sourceURI('v:x1')
+        self.assertEqual(RequestBuilder.formatURI(uri,'JSON'),uri.replace('outputFormat=GML2','outputFormat=JSON'),'page format')
+        w110.fmt = 'JSON'
+        self.assertTrue('outputFormat=GML2' in w110.sourceURI('v:x1'),'WFS driver requests GML')
 
 
 
@@ -23,7 +23,14 @@ from lds.test.ConfigConnector_Test import Test_2_ConfigConnector as T2
 from lds.test.LDSDataStore_Test import Test_1_LDSDataStore as T3
 from lds.test.DataStore_Test import Test_1_DataStore as T4
 from lds.test.RequestBuilder_Test import Test_1_RequestBuilder as T5
-from lds.test.LDSUtilities_Test import Test_1_LDSUtilities as T6
+from lds.test.LDSUtilities_Test import Test_1_SUFIExtractor as T6
+from lds.test.LDSUtilities_Test import Test_2_CapabilitiesCache as T7
+from lds.test.LDSUtilities_Test import Test_3_HTTPTransport as T8
+from lds.test.LDSUtilities_Test import Test_4_GeoJSONStream as T9
+from lds.test.LDSUtilities_Test import Test_5_PageCache as T10
+from lds.test.LDSUtilities_Test import Test_6_FeatureCounter as T11
+from lds.test.LDSUtilities_Test import Test_7_PageFetcher as T12
+from lds.test.LDSUtilities_Test import Test_8_DirectDownload as T13
 
 from lds.LDSUtilities import LDSUtilities
 
@@ -60,6 +67,13 @@ class FullSuite(unittest.TestSuite):
         suites += unittest.makeSuite(T4)
         suites += unittest.makeSuite(T5)
         suites += unittest.makeSuite(T6)
+        suites += unittest.makeSuite(T7)
+        suites += unittest.makeSuite(T8)
+        suites += unittest.makeSuite(T9)
+        suites += unittest.makeSuite(T10)
+        suites += unittest.makeSuite(T11)
+        suites += unittest.makeSuite(T12)
+        suites += unittest.makeSuite(T13)
         
         return unittest.TestSuite(suites)
 
@@ -0,0 +1,103 @@
+'''
+v.0.0.9
+
+LDSReplicate -  TransferProcessor_Test
+
+Copyright 2011 Crown copyright (c)
+Land Information New Zealand and the New Zealand Government.
+All rights reserved
+
+This program is released under the terms of the new BSD license. See the
+LICENSE file for more information.
+
+Tests for concurrent layer replication
+
+Created on 18/10/2026
+
+@author: agent
+'''
+import unittest
+import sys
+import threading
+
+import gdal
+
+sys.path.append('..')
+
+from lds.LDSUtilities import LDSUtilities
+
+from lds.TransferProcessor import TransferProcessor
+from lds.ProjectionReference import Projection
+
+testlog = LDSUtilities.setupLogging(ff=2)
+
+
+class Store(object):
+    '''Stands in for the LDS source and the destination, recording the clones made for the layer workers'''
+    def __init__(self,clones=None):
+        self.clones = clones if clones is not None else []
+        self.closed = False
+
+    def clone(self):
+        c = Store(self.clones)
+        self.clones.append(c)
+        return c
+
+    def destinationURI(self,layer):
+        return None
+
+    def initDS(self,uri):
+        return 'ds'
+
+    def setDS(self,ds):
+        self.ds = ds
+
+    def getLayerConf(self):
+        return {}
+
+    def setLayerConf(self,layerconf):
+        self.layerconf = layerconf
+
+    def closeDS(self):
+        self.closed = True
+
+
+class Test_1_ConcurrentLayers(unittest.TestCase):
+
+    def setUp(self):
+        self.tp = TransferProcessor(None)
+        self.tp.lnl = ('v:x1','v:x2')
+        self.tp.layer_total = 2
+        self.tp.src = Store()
+        self.tp.dst = Store()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.both = threading.Event()
+        self.seen = {}
+        self.tp.processLayer = self.processLayer
+
+    def processLayer(self,each_layer,src,dst,fd,td):
+        '''Sets a thread local option and a transformation for the layer then waits until the other layer is running too'''
+        gdal.SetThreadLocalConfigOption('OGR_WFS_PAGING_ALLOWED',each_layer)
+        ct = Projection.getTransformation(Projection.getSpatialReference(2193),4167)[1]
+        with self.lock:
+            self.running += 1
+            if self.running == 2: self.both.set()
+        #both layers are in progress at once only if each has its own worker
+        self.assertTrue(self.both.wait(10),'layers replicated concurrently')
+        self.seen[each_layer] = (threading.current_thread().name,src,dst,gdal.GetConfigOption('OGR_WFS_PAGING_ALLOWED'),ct)
+        return True
+
+    def test_1_twoLayers(self):
+        self.tp.processConcurrent(2,None,None)
+        self.assertEqual(self.tp.layer_count,2,'both layers completed')
+        (t1,s1,d1,o1,c1),(t2,s2,d2,o2,c2) = self.seen['v:x1'],self.seen['v:x2']
+        self.assertNotEqual(t1,t2,'one thread per layer')
+        self.assertTrue(s1 is not s2 and d1 is not d2,'own source and destination')
+        self.assertEqual((o1,o2),('v:x1','v:x2'),'config options not shared')
+        self.assertIsNot(c1,c2,'transformations not shared')
+        self.assertTrue(all(c.closed for c in self.tp.src.clones+self.tp.dst.clones),'connections closed')
+
+
+if __name__ == "__main__":
+    unittest.main()
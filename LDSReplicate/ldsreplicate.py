@@ -29,6 +29,7 @@ python LDSReader/ldsreplicate.py -l <layer_id>
     -s (--source) Connection string for source DS
     -d (--destination) Connection string for destination DS
     -c (--cql) Filter definition in CQL format
+    -j (--jobs) Number of layers to replicate concurrently (PostgreSQL and MSSQL destinations only)
     -h (--help) Display this message
     -v (--version) Display the version number"
 
@@ -68,7 +69,7 @@ ldslog = LDSUtilities.setupLogging()
 __version__ = AppVersion.getVersion()
 
 def usage():
-    print "Usage: python LDSReader/ldsreplicate.py -l <layer_id> [-f <from date>|-t <to date>|-c <cql filter>|-s <src conn str>|-d <dst conn str>|-v|-h] <output> [full]"
+    print "Usage: python LDSReader/ldsreplicate.py -l <layer_id> [-f <from date>|-t <to date>|-c <cql filter>|-s <src conn str>|-d <dst conn str>|-j <jobs>|-v|-h] <output> [full]"
     print "For help use --help"
 
 def main():
@@ -88,6 +89,7 @@ def main():
     dc = None
     cq = None
     uc = None
+    jb = None
     
     gdal_ver = VersionChecker.getGDALVersion()   
     #pgis_ver = VersionChecker.getPostGISVersion()   
@@ -107,7 +109,7 @@ def main():
     
     # parse command line options
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hvixf:t:l:g:e:s:d:c:u:", ["help","version","internal","external","fromdate=","todate=","layer=","group=","epsg=","source=","destination=","cql=","userconf="])
+        opts, args = getopt.getopt(sys.argv[1:], "hvixf:t:l:g:e:s:d:c:u:j:", ["help","version","internal","external","fromdate=","todate=","layer=","group=","epsg=","source=","destination=","cql=","userconf=","jobs="])
         ldslog.info("OPTS:"+str(opts))
         ldslog.info("ARGS:"+str(args))
     except getopt.error, msg:
@@ -141,6 +143,12 @@ def main():
             cq = val
         elif opt in ("-u","--userconf"):
             uc = val
+        elif opt in ("-j","--jobs"):
+            if not val.isdigit():
+                print "jobs must be a positive integer"
+                usage()
+                sys.exit(2)
+            jb = val
         else:
             print "unrecognised option:\n" \
             "-f (--fromdate) Date in yyyy-mm-dd format start of incremental range (omission assumes auto incremental bounds)," \
@@ -152,6 +160,7 @@ def main():
             "-d (--destination) Connection string for destination DS," \
             "-c (--cql) Filter definition in CQL format," \
             "-u (--user) User defined config file used as partial override for template.conf," \
+            "-j (--jobs) Number of layers to replicate concurrently," \
             "-h (--help) Display this message"
             sys.exit(2)
 
@@ -164,6 +173,7 @@ def main():
     #layer overrides group, whether layer is IN group is not considered
     ly if ly else gp
     tp = TransferProcessor(None,ly if ly else gp,ep,fd,td,sc,dc,cq,uc)
+    if jb: tp.setJobs(jb)
 
     #output format
     if len(args)==0: